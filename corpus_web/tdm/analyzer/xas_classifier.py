@@ -11,6 +11,8 @@ import csv
 # reference: http://www.reflectometry.org/danse/docs/elements/guide/using.html
 import periodictable
 
+from archive_layout import iter_files	# the archive layout is shared with downloaders. tdm/downloader must be on PYTHONPATH (see README).
+
 
 """
 - The first letter of the chemical symbol is always capitalized. If the symbol has two letters, the second letter is always lowercase.
@@ -152,14 +154,14 @@ def analyze_text(dirs):
 	NO_exafs_xanes_term_article_list = []
 
 	for dir in dirs:
-		for root, dirs, files in os.walk(dir):
+		for root, files in iter_files(dir):
 		#	results.extend([os.path.join(root, file) for file in files if file.endswith(".json")])
 			for file in files:
 				# Ignore downloaded json files, and only use a generated json which has the same name of an original article.
 				if file.endswith(".json") and \
-					(os.path.exists(os.path.join(root, file.replace(".json", ".xml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".nxml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".html")))):
+					(file.replace(".json", ".xml") in files or \
+					 file.replace(".json", ".nxml") in files or \
+					 file.replace(".json", ".html") in files):
 					
 					with open(os.path.join(root, file), "r") as read_file:
 						data = json.load(read_file)
@@ -492,13 +494,13 @@ def find_xas_result(figures, body_text):
 
 def iterate_dir(dirs):
 	for dir in dirs:
-		for root, dirs, files in os.walk(dir):
+		for root, files in iter_files(dir):
 			for file in files:
 				# Ignore downloaded json files, and only use a generated json which has the same name of an original article.
 				if file.endswith(".json") and \
-					(os.path.exists(os.path.join(root, file.replace(".json", ".xml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".nxml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".html")))):
+					(file.replace(".json", ".xml") in files or \
+					 file.replace(".json", ".nxml") in files or \
+					 file.replace(".json", ".html") in files):
 
 					# debugging...
 					#if file not in ['ADVS-2-0p.json', 'S0022459618304250.json']:
@@ -545,13 +547,13 @@ def create_debug_files_for_sample_selection(dirs):
 	"""
 	ret = []
 	for dir in dirs:
-		for root, dirs, files in os.walk(dir):
+		for root, files in iter_files(dir):
 			for file in files:
 				# Ignore downloaded json files, and only use a generated json which has the same name of an original article.
 				if file.endswith(".json") and \
-					(os.path.exists(os.path.join(root, file.replace(".json", ".xml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".nxml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".html")))):
+					(file.replace(".json", ".xml") in files or \
+					 file.replace(".json", ".nxml") in files or \
+					 file.replace(".json", ".html") in files):
 					 
 					with open(os.path.join(root, file), "r+") as f:
 						data = json.load(f)
@@ -602,13 +604,13 @@ def create_xas_tree_json(dirs, output_file):
 		xas_tree.append({ "id": 'xanes_' + symbol + "_m", "parent": 'xanes_' + symbol, "text": "M-edge", "count": 0 })
 	
 	for dir in dirs:
-		for root, dirs, files in os.walk(dir):
+		for root, files in iter_files(dir):
 			for file in files:
 				# Ignore downloaded json files, and only use a generated json which has the same name of an original article.
 				if file.endswith(".json") and \
-					(os.path.exists(os.path.join(root, file.replace(".json", ".xml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".nxml"))) or \
-					 os.path.exists(os.path.join(root, file.replace(".json", ".html")))):
+					(file.replace(".json", ".xml") in files or \
+					 file.replace(".json", ".nxml") in files or \
+					 file.replace(".json", ".html") in files):
 					 
 					# debugging...
 					#if file not in ['ADVS-2-0p.json', 'S0022459618304250.json']:
@@ -626,7 +628,7 @@ def create_xas_tree_json(dirs, output_file):
 							
 							if uid is None:
 								print(file)
-								sys.exit()
+								raise SystemExit
 
 							num = 0
 							for xi in xas_info:
@@ -1,10 +1,12 @@
 import os
 import sys
 import datetime as DT
-from time import sleep
 import json
 import requests
-from base_downloader import BaseDownloader
+from concurrent.futures import ThreadPoolExecutor
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import article_dir
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,13 +26,60 @@ class AAASDownloader(BaseDownloader):
 	- cdesnowball-master\chemdataextractor\scrape\pub\rsc.py
 	"""
 	
+	requests_per_sec = 0.2	# the max speed is one request every 5 seconds.
 
 	def __init__(self):
 		super().__init__('AAAS')
-		self.sleep_sec = 5	# the max speed is one request every 5 seconds.
 	
 	
-	def retrieve_articles(self, keywords, year=None, enable_sleep=True):
+	def get_listing_doi(self, article_elem):
+		""" Return the DOI in a search result listing (e.g., <div class="highwire-cite-metadata-doi">DOI: 10.1126/science.aaa1234</div>), or None """
+		doi_elem = article_elem.find_class("highwire-cite-metadata-doi")
+		if len(doi_elem) > 0:
+			doi = doi_elem[0].text_content().strip()
+			if doi.upper().startswith('DOI:'):
+				doi = doi[4:].strip()
+			if doi.startswith('10.'):
+				return doi.lower()
+		
+		for a in article_elem.iter('a'):	# e.g., https://doi.org/10.1126/science.aaa1234
+			href = a.get('href', '')
+			if 'doi.org/10.' in href:
+				return href.split('doi.org/', 1)[-1].lower()
+		
+		return None
+	
+	
+	def get_article_info(self, info_link, headers):
+		""" Fetch the article's information page, and return (DOI, title), or (None, None) if the page is not available """
+		i_response = self.session.get(info_link, headers=headers, cache_ttl=self.cache_ttl)
+		
+		if i_response.status_code == 200:
+			info_page = fromstring(i_response.content)
+
+			doi = info_page.find('.//meta[@name="DC.Identifier"]').attrib['content']
+			doi = doi.lower()
+			title = info_page.find('.//meta[@name="DC.Title"]').attrib['content']
+			
+			return doi, title
+		else:
+			# Sometimes, Page Not Found (404 error) occurs. Don't exit, but ignore it.
+			# e.g., "New Approaches to Surface Structure Determinations" - https://science.sciencemag.org/content/214/4518/300
+			print("<AAAS-retrieve_articles()> Error!! info_link:", info_link)
+			self.display_error_msg(i_response)
+			
+			return None, None
+	
+	
+	def retrieve_articles(self, keywords, year=None, enable_sleep=True, since=None):
+		"""
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
+		  If it's None and year is given, articles of the last week are searched.
+		- enable_sleep: kept for old callers. The fixed 5-second sleeps are replaced by the rate limiter, which is always on
+		  since the information pages are fetched concurrently, and the limiter is shared by crawls of all projects (see share_session()).
+		  Change the rate with 'Rate_limit/AAAS' in the info file.
+		"""
 		headers = {'User-Agent': 'Mozilla/5.0; mailto: gpark@bnl.gov; BNL CSI Literature mining project', 'Accept': 'text/html'}
 		
 		'''
@@ -63,8 +112,7 @@ class AAASDownloader(BaseDownloader):
 		
 		base_url = "https://science.sciencemag.org"
 		
-		doi_link = {}
-		doi_title = {}	# this is to save the history of downloads.
+		hits = []	# (DOI in the listing or None, info link, full text link)
 		for keyword in keywords:
 			search_url = base_url + "/search/text_abstract_title:" + keyword \
 						 + " text_abstract_title_flags:" + search_option \
@@ -73,16 +121,17 @@ class AAASDownloader(BaseDownloader):
 						 + " sort:" + sort \
 						 + " format_result:" + result_fmt
 			
-			if year is not None:
+			if since is not None:
+				today = DT.date.today()
+				search_url += " limit_from:" + since.strftime("%Y-%m-%d") + " limit_to:" + today.strftime("%Y-%m-%d")
+			elif year is not None:
 				today = DT.date.today()
 				week_ago = today - DT.timedelta(days=7)
 				search_url += " limit_from:" + week_ago.strftime("%Y-%m-%d") + " limit_to:" + today.strftime("%Y-%m-%d")
 
 			# search articles.
 			while True:
-				if enable_sleep:
-					sleep(self.sleep_sec)
-				s_response = requests.get(search_url, headers=headers)
+				s_response = self.session.get(search_url, headers=headers, cache_ttl=self.cache_ttl)
 
 				#print(s_response.url)
 				#print(s_response.headers)
@@ -105,39 +154,21 @@ class AAASDownloader(BaseDownloader):
 					for article_elem in articles:
 						info_link = article_elem.find_class("highwire-cite-linked-title")[0].attrib['href']	# to find DOI, get the article's information page
 						
-						if enable_sleep:
-							sleep(self.sleep_sec)
-						i_response = requests.get(info_link, headers=headers)
-						
-						if i_response.status_code == 200:
-							info_page = fromstring(i_response.content)
-
-							doi = info_page.find('.//meta[@name="DC.Identifier"]').attrib['content']
-							doi = doi.lower()
-							title = info_page.find('.//meta[@name="DC.Title"]').attrib['content']
-														
-							html_text = article_elem.find_class("highwire-variant-link variant-full-text")
-
-							link = ''
-							if len(html_text) > 0:	# if html text is provided,
-								link = html_text[0].attrib['href']
-							else:	# no HTML text
-								abstract = article_elem.find_class("highwire-variant-link variant-abstract")
-								pdf_text = article_elem.find_class("highwire-variant-link variant-full-textpdf link-icon")
-								
-								# TODO: add abstract!!
-								if len(pdf_text) > 0:	# if html text is provided,
-									link = pdf_text[0].attrib['href']
+						html_text = article_elem.find_class("highwire-variant-link variant-full-text")
+
+						link = ''
+						if len(html_text) > 0:	# if html text is provided,
+							link = html_text[0].attrib['href']
+						else:	# no HTML text
+							abstract = article_elem.find_class("highwire-variant-link variant-abstract")
+							pdf_text = article_elem.find_class("highwire-variant-link variant-full-textpdf link-icon")
 							
-							if link:
-								doi_link[doi] = link
-								doi_title[doi] = title
-
-						else:
-							# Sometimes, Page Not Found (404 error) occurs. Don't exit, but ignore it.
-							# e.g., "New Approaches to Surface Structure Determinations" - https://science.sciencemag.org/content/214/4518/300
-							print("<AAAS-retrieve_articles()> Error!! info_link:", info_link)
-							self.display_error_msg(i_response)
+							# TODO: add abstract!!
+							if len(pdf_text) > 0:	# if html text is provided,
+								link = pdf_text[0].attrib['href']
+						
+						if link:
+							hits.append((self.get_listing_doi(article_elem), info_link, link))
 
 					# reference: https://lxml.de/3.1/api/private/lxml.html.HtmlElement-class.html
 					next_page = page.find_class("pager-next")	# find_class returns a list.
@@ -150,34 +181,43 @@ class AAASDownloader(BaseDownloader):
 						break
 				else:
 					self.display_error_msg(s_response)
-					sys.exit()
+					raise DownloadError(self.publisher, s_response)
 
-		print("<AAAS> #UIDs w/  duplicates:", len(doi_link))
-		duplicate_removed_uids = self.remove_duplicates(set(doi_link.keys()))   # skip already downloaded articles.
+		# skip already downloaded articles before fetching information pages. Hits without a DOI in the listing are checked after their pages are fetched.
+		print("<AAAS> #UIDs w/  duplicates:", len(hits))
+		duplicate_removed_uids = self.remove_duplicates(set([x[0] for x in hits if x[0] is not None]))
+		hits = [x for x in hits if x[0] is None or x[0] in duplicate_removed_uids]
+		
+		# fetch information pages (DOI, title) of unknown articles only. The number of in-flight requests is bounded, and the rate limiter still applies.
+		with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+			article_info = list(executor.map(lambda x: self.get_article_info(x[1], headers), hits))
+		
+		doi_link = {}
+		doi_title = {}	# this is to save the history of downloads.
+		for (_, _, link), (doi, title) in zip(hits, article_info):
+			if doi is not None:
+				doi_link[doi] = link
+				doi_title[doi] = title
+		
+		duplicate_removed_uids = self.remove_duplicates(set(doi_link.keys()))
 		print("<AAAS> #UIDs w/o duplicates:", len(duplicate_removed_uids))
 
 		doi_link = {k: v for k, v in doi_link.items() if k in duplicate_removed_uids}
 		doi_title = {k: v for k, v in doi_title.items() if k in duplicate_removed_uids}
 
 		""" Download articles """
+		items = []
 		for doi, link in doi_link.items():
-			if enable_sleep:
-				sleep(self.sleep_sec)
-			r_response = requests.get(link, headers=headers)
-			#r_response = requests.get("https://science.sciencemag.org/content/sci/275/5305/1452/F1.medium.gif", headers=headers)
+			#link = "https://science.sciencemag.org/content/sci/275/5305/1452/F1.medium.gif"
+			file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+			file = file.lower()	# lowercase 
+			file_dir = article_dir(self.path, file)
 			
-			if r_response.status_code == 200:
-				file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
-				file = file.lower()	# lowercase 
-				file_dir = self.path + file + '/'
-				os.mkdir(file_dir)	# create a directory for each article.
-				
-				file_ext = ".pdf" if link.endswith('pdf') else ".html"
-				self.write_to_file(r_response, file_dir, file, file_ext)
-				self.update_uid(doi)	# add a new uid - 02-12-2020
-			else:
-				self.display_error_msg(r_response)
-				sys.exit()
+			file_ext = ".pdf" if link.endswith('pdf') else ".html"
+			items.append(FetchItem(doi, link, file_dir, file, file_ext, headers=headers))
+		
+		for item in self.fetch_articles(items):
+			doi_title.pop(item.uid, None)
 		
 		#self.save_uids()    # save new uids in the uid file. -> changed to save uids right after write_to_file() since errors frequently occur between articles. - 02-12-2020
 		
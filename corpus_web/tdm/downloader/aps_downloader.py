@@ -1,8 +1,13 @@
 import sys
 from time import sleep
 import json
+import threading
 import requests
-from base_downloader import BaseDownloader
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import article_dir
 import logging
 
 logger = logging.getLogger(__name__)
@@ -34,83 +39,150 @@ class APSDownloader(BaseDownloader):
 	- https://journals.aps.org/licenses
 	"""
 
+	harvest_url = 'http://harvest.aps.org/v2/journals/articles'
+	
+	per_page = 100
+	page_timeout = (10, 120)	# (connect, read) timeout of a page request in seconds.
+	max_page_rounds = 3	# the number of rounds to retry failed pages.
+
 	def __init__(self):
 		super().__init__('APS')
 	
 	
-	def retrieve_all_open_access_articles(self):
-		"""
-		!! the request hangs in around 10-13 times, and the server returns an error msg - 502 Bad Gateway error!!
-		"""
-		search_url = 'http://harvest.aps.org/v2/journals/articles?set=openaccess'
+	def get_open_access_page(self, page):
+		""" Fetch a page of the open access set, and return (DOIs, the last page number) """
+		params = dict(self.harvest_params, page=page, per_page=self.per_page)
 		
-		num_of_requests = 0
+		# a page request sometimes hangs and the server returns 502 Bad Gateway, so a page has its own timeout. (the session retries it)
+		response = self.session.get(self.harvest_url, params=params, timeout=self.page_timeout, cache_ttl=self.cache_ttl)
 		
-		dois = set()
-		while True:
-			#sleep(1)
-			# http://docs.python-requests.org/en/master/user/advanced/#timeouts
-			response = requests.get(search_url, timeout=None)
-			
-			num_of_requests += 1
-			print(f'>>> Number of requests: {num_of_requests}')
-			
-			if response.status_code == 200:
-				next_page = response.links["next"].get('url') if response.headers.get('link') is not None else None
-				
-				response = response.json()
-				for item in response["data"]:
-					doi = item["identifiers"]["doi"]
-					dois.add(doi)
-
-				# http://docs.python-requests.org/en/master/user/advanced/
-				# if response.links["next"] is not None:
-				if next_page is not None:
-					#print(response.links["next"].get('url'))
-					#print(response.links["last"])
-					#search_url = response.links["next"].get('url')
-					search_url = next_page
-				else:
-					break
-			else:
-				self.display_error_msg(response)
-				sys.exit()
+		if response.status_code != 200:
+			self.display_error_msg(response)
+			raise DownloadError(self.publisher, response)
+		
+		last_page = page
+		if 'last' in response.links:
+			last_page = int(parse_qs(urlparse(response.links['last']['url']).query)['page'][0])
+		
+		dois = set([item["identifiers"]["doi"] for item in response.json()["data"]])
+		
+		return dois, last_page
+
 
-		duplicate_removed_uids = self.check_uids(dois)   # check if it's already downloaded.
+	def harvest_page(self, page):
+		""" Fetch a page of the open access set and download its new articles, and return the last page number """
+		dois, last_page = self.get_open_access_page(page)
 		
+		duplicate_removed_uids = self.remove_duplicates(dois)   # check if it's already downloaded.
+		
+		#headers = {'Accept': 'application/zip'}
+		headers = {'Accept': 'text/xml'}
+		
+		items = []
 		for doi in duplicate_removed_uids:
-			search_url = "http://harvest.aps.org/v2/journals/articles/" + doi
+			filename = "APS_" + ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+			items.append(FetchItem(doi, self.harvest_url + "/" + doi, article_dir(self.path, filename), filename, ".xml", headers=headers))
+		
+		self.fetch_articles(items)	# failed articles are recorded, and retried in the next run.
+		
+		return last_page
 
-			#headers = {'Accept': 'application/zip'}
-			headers = {'Accept': 'text/xml'}
 
-			response = requests.get(search_url, headers=headers)
+	def retrieve_all_open_access_articles(self, since=None):
+		"""
+		Mirror the open access set incrementally.
+		
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
+		  Only articles updated since the date are harvested ('from' parameter).
+		
+		Note:
+		- !! a page request hangs in around 10-13 times, and the server returns an error msg - 502 Bad Gateway error!!
+		  So, each page has a timeout, and pages are fetched in parallel, and a failed page doesn't stop the others.
+		- Failed pages are retried up to 'max_page_rounds' times. The checkpoint keeps finished pages,
+		  so the next run fetches only the pages that are not finished (e.g., pages that failed in every round).
+		- After all pages are finished, the checkpoint is cleared, and the next run walks the set again to find new articles.
+		"""
+		self.harvest_params = {'set': 'openaccess'}
+		if since is not None:
+			self.harvest_params['from'] = since.isoformat()
+		
+		checkpoint = self.get_checkpoint('openaccess', self.per_page, str(since))
+		state = checkpoint.load()
+		
+		done_pages = set(state.get('done_pages', []))
+		last_page = state.get('last_page')
+		lock = threading.Lock()	# guards done_pages and the checkpoint.
+		
+		if last_page is None:	# the first page tells the number of pages.
+			last_page = self.harvest_page(1)
+			done_pages.add(1)
+			checkpoint.save(done_pages=sorted(done_pages), last_page=last_page)
+		
+		def harvest(page):
+			self.harvest_page(page)
 			
-			if response.status_code == 200:
-				#print(response.headers)
+			with lock:
+				done_pages.add(page)
+				checkpoint.save(done_pages=sorted(done_pages), last_page=last_page)
+		
+		for num_rounds in range(1, self.max_page_rounds + 1):
+			pages = [x for x in range(1, last_page + 1) if x not in done_pages]
+			if len(pages) == 0:
+				break
+			
+			print(f'<APS> Round {num_rounds} - #Pages: {len(pages)} / {last_page}')
+			
+			with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+				futures = {executor.submit(harvest, x): x for x in pages}
+				
+				for future in as_completed(futures):
+					try:
+						future.result()
+					except (DownloadError, requests.exceptions.RequestException) as e:
+						logger.error(f'>> Page {futures[future]} failed: {e}')
+		
+		failed_pages = [x for x in range(1, last_page + 1) if x not in done_pages]
+		
+		if len(failed_pages) > 0:
+			logger.error(f'>> #Failed pages: {len(failed_pages)} - they are fetched in the next run. {failed_pages}')
+		else:
+			checkpoint.clear()
+		
+		return failed_pages
 
-				filename = "APS_" + ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
 
-				self.write_to_file(response, self.path, filename, ".xml")
-			else:
-				self.display_error_msg(response)
-				sys.exit()
-						
-		self.save_uids()    # save new uids in the uid file.
+	def retrieve_by_dois(self, dois):
+		""" Download articles of the given DOIs (e.g., a DOI list from collaborators) from the harvest API, and return the set of DOIs that are not retrieved """
+		headers = {'Accept': 'text/xml'}
+		
+		dois = list(dois)
+		
+		items = []
+		for doi in dois:
+			filename = "APS_" + ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+			items.append(FetchItem(doi, self.harvest_url + "/" + doi, article_dir(self.path, filename), filename, ".xml", headers=headers))
 		
+		self.fetch_articles(items)	# failed articles are recorded, and retried in the next run.
+		
+		return self.get_missing_dois(dois)
+
 
-	def retrieve_articles(self, query):
+	def retrieve_articles(self, query, since=None):
 		max_rows = 1000
 
 		params = {'query': query, 'rows': max_rows, 'cursor': "*", 'sort': 'score',
 				  'filter': 'has-full-text:true,member:16', # APS member id is 16.
 				  'mailto': 'gpark@bnl.gov'}
+		
+		if since is not None:	# works indexed in Crossref since the watermark of the last successful crawl.
+			params['filter'] += ',from-index-date:' + since.isoformat()
 
 		num_queries = 0
 		while True:
 			num_queries += 1
 
-			response = requests.get('https://api.crossref.org/works', params=params)
+			response = self.session.get('https://api.crossref.org/works', params=params, cache_ttl=self.cache_ttl)
 			
 			if response.status_code == 200:
 				#print(response.headers)
@@ -132,7 +204,7 @@ class APSDownloader(BaseDownloader):
 					
 					doi_link[doi] = link
 					
-				duplicate_removed_uids = self.check_uids(set(doi_link.keys()))   # check if it's already downloaded.
+				duplicate_removed_uids = self.remove_duplicates(set(doi_link.keys()))   # check if it's already downloaded.
 
 				doi_link = {k: v for k, v in doi_link.items() if k in duplicate_removed_uids}
 
@@ -142,40 +214,40 @@ class APSDownloader(BaseDownloader):
 				params['cursor'] = response['message']['next-cursor']
 			else:
 				self.display_error_msg(response)
-				sys.exit()
+				raise DownloadError(self.publisher, response)
 
 		for doi, link in doi_link.items():
 			search_url = "http://harvest.aps.org/v2/journals/articles/" + doi
 
 			headers = {'Accept': 'application/zip'}
-			response = requests.get(search_url, headers=headers)
+			response = self.session.get(search_url, headers=headers)
 
 			#print(response.headers)
 
 			filename = "APS_" + ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
 
 			if response.status_code == 200:
-				self.write_to_file(response, self.path, filename, ".zip")
-			else:
-				for l in link:
-					url = l.get('URL')
-					
-					response = requests.get(url)
-
-					if response.status_code == 200:
-						type = response.headers['content-type']
-						ext = ''
-						if type == 'application/vnd.tesseract.article+json':
-							ext = '.json'
-						elif type == 'application/pdf':
-							ext = '.pdf'
-						else:
-							logger.error(f'>> undefined type: {type} | URL: {url}')
-							sys.exit()
-
-						self.write_to_file(response, self.path, filename, ext)
+				# add a new uid. An invalid document (e.g., a truncated zip) is recorded as a failure, and the other links are tried.
+				if self.save_article(FetchItem(doi, search_url, article_dir(self.path, filename), filename, ".zip", headers=headers), response):
+					continue
+			
+			for l in link:
+				url = l.get('URL')
+				
+				response = self.session.get(url)
+
+				if response.status_code == 200:
+					type = response.headers['content-type']
+					ext = ''
+					if type == 'application/vnd.tesseract.article+json':
+						ext = '.json'
+					elif type == 'application/pdf':
+						ext = '.pdf'
 					else:
-						self.display_error_msg(response)
-						sys.exit()
-						
-		self.save_uids()    # save new uids in the uid file.
+						logger.error(f'>> undefined type: {type} | URL: {url}')
+						continue
+
+					self.save_article(FetchItem(doi, url, article_dir(self.path, filename), filename, ext), response)	# add a new uid
+				else:
+					self.display_error_msg(response)
+					self.record_failure(FetchItem(doi, url, article_dir(self.path, filename), filename, '.pdf'), response.status_code)
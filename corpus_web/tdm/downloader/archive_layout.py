@@ -0,0 +1,148 @@
+"""
+Layout of the article archive shared by downloaders, parsers, the indexer and the analyzer.
+
+Note:
+- Each article has its own directory (named by its key, e.g., PII, PMCID or DOI with special characters removed),
+  and the directory is placed under a two-level hash prefix of the key. e.g., <publisher root>/3f/a2/S0022286006007071/
+  So, a directory holds at most 256 entries except for article directories, and listing or walking the archive doesn't slow down as the archive grows.
+- Readers also accept the legacy layout (article directories and flat article files directly under the publisher root),
+  so the archive can be read before and during the migration. Run this module to migrate a legacy root.
+
+Usage:
+- python archive_layout.py <publisher root> [<publisher root> ...]
+"""
+
+import os
+import sys
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+shard_chars = 2	# hex characters per level.
+shard_levels = 2
+
+# extensions of article files that are moved into article directories by the migration. Other files (e.g., oa_file_list.csv, metadata.jsonl) stay.
+article_extensions = ('.xml', '.nxml', '.html', '.pdf', '.json', '.txt', '.zip')
+
+
+def shard(key):
+	""" Return the hash prefix of a key (e.g., S0022286006007071 -> 3f/a2) """
+	h = hashlib.md5(key.encode()).hexdigest()
+	return '/'.join(h[i*shard_chars:(i + 1)*shard_chars] for i in range(shard_levels))
+
+
+def shard_dir(root, key):
+	""" Return the directory in which the article directory of the key is placed """
+	return os.path.join(root, shard(key))
+
+
+def article_dir(root, key):
+	""" Return the directory (with a trailing slash) of an article. It's not created here. """
+	return os.path.join(root, shard(key), key) + '/'
+
+
+def is_shard(name):
+	return len(name) == shard_chars and all(c in '0123456789abcdef' for c in name)
+
+
+def iter_article_dirs(root):
+	""" Yield article directories under a publisher root (both sharded and legacy ones) """
+	def walk(dir, level):
+		with os.scandir(dir) as it:
+			for entry in it:
+				if not entry.is_dir():
+					continue
+
+				if level < shard_levels and is_shard(entry.name):
+					yield from walk(entry.path, level + 1)
+				elif level == 0 or level == shard_levels:
+					yield entry.path
+
+	yield from walk(root, 0)
+
+
+def iter_files(root):
+	"""
+	Yield (directory, file names) like os.walk() for each directory in article directories under a publisher root,
+	e.g., <key>/ and its subdirectories such as <PMCID>/ extracted from a PMC package.
+	Legacy flat files directly under the root are yielded first as (root, file names).
+	"""
+	with os.scandir(root) as it:
+		flat_files = [x.name for x in it if x.is_file()]
+
+	if len(flat_files) > 0:
+		yield root, flat_files
+
+	for dir in iter_article_dirs(root):
+		for path, _, files in os.walk(dir):
+			yield path, files
+
+
+def iter_articles(root, extension):
+	"""
+	Yield paths of article files (e.g., .xml), whose names are the same as their directories (e.g., <key>/<key>.xml).
+	Object files in article directories (e.g., downloaded xml files as supplementary objects) are ignored.
+	"""
+	with os.scandir(root) as it:
+		for entry in it:	# legacy flat files
+			if entry.is_file() and entry.name.endswith(extension):
+				yield entry.path
+
+	for dir in iter_article_dirs(root):
+		file = os.path.join(dir, os.path.basename(dir) + extension)
+		if os.path.isfile(file):
+			yield file
+
+
+def migrate(root):
+	"""
+	Move articles of the legacy layout under a publisher root into the sharded layout, and return the number of moved entries.
+
+	Note:
+	- An article directory directly under the root is moved (renamed) as a whole.
+	- Flat article files are grouped by name without extension (e.g., Emerald_101108xxx.pdf and Emerald_101108xxx.json) into article directories.
+	- Moves are renames on the same file system, so it's safe to stop and run it again.
+	"""
+	num_of_moved = 0
+
+	with os.scandir(root) as it:
+		entries = [x for x in it if not x.name.startswith('.')]
+
+	for entry in entries:
+		if entry.is_dir():
+			if is_shard(entry.name):
+				continue
+
+			dest = article_dir(root, entry.name).rstrip('/')
+			if os.path.exists(dest):
+				logger.error(f'>> Already exists: {dest}')
+				continue
+
+			os.makedirs(os.path.dirname(dest), exist_ok=True)
+			os.rename(entry.path, dest)
+		elif entry.name.endswith(article_extensions):
+			key = entry.name.rsplit('.', 1)[0]
+			dest = article_dir(root, key)
+
+			os.makedirs(dest, exist_ok=True)
+			os.rename(entry.path, dest + entry.name)
+		else:
+			continue
+
+		num_of_moved += 1
+
+		if num_of_moved % 10000 == 0:
+			print('>> the number of moved entries:', num_of_moved)
+
+	return num_of_moved
+
+
+def main():
+	for root in sys.argv[1:]:
+		num_of_moved = migrate(root)
+		print(f'>> {root}: {num_of_moved} entries moved')
+
+
+if __name__ == "__main__":
+	main()
@@ -1,17 +1,82 @@
+import os
 import abc
 import json
+import socket
+import functools
 import logging
+from datetime import datetime, date, timedelta
+from http_session import create_session
+from rate_limiter import RateLimiter
+from fetch_engine import FetchEngine
+from uid_registry import UIDRegistry
+from checkpoint import CrawlCheckpoint
+from retry import RetryPolicy
+from http_cache import HTTPCache
+from blob_store import BlobStore
+from document_validator import DocumentValidator, InvalidDocumentError
+from fetch_engine import FetchItem
+from crawl_scheduler import CrawlTask, CrawlScheduler
+from crawl_frontier import CrawlFrontier
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+# info file of API keys and archive paths. Each machine can have its own file (e.g., its own API keys) with the environment variable.
+info_file = os.environ.get('TDM_INFO_FILE', '/home/gpark/corpus_web/tdm/api_key_and_archive_info.txt')
+
+
+class DownloadError(Exception):
+	""" A request failed even after retries. It stops the publisher's crawl, but not the other publishers' crawls. """
+	
+	def __init__(self, publisher, response):
+		super().__init__(f'<{publisher}> {response.status_code} {response.url}')
+		self.publisher = publisher
+		self.response = response
+
 
 class BaseDownloader:
 	
+	# default rate limit of the publisher, which can be overridden by 'Rate_limit/<publisher> = <requests per sec>, <burst>' in the info file.
+	requests_per_sec = None	# None means no limit.
+	burst = 1
+	
+	# concurrency of article retrievals - total in-flight requests and in-flight requests per host.
+	max_concurrency = 4
+	max_per_host = 2
+	
+	# retry policy of requests - exponential backoff with jitter.
+	max_attempts = 5
+	backoff_base = 1	# seconds
+	backoff_max = 60	# seconds
+	
+	watermark_overlap = 1	# days - the delta query starts a bit before the watermark since articles are indexed with delays.
+	
+	cache_ttl = 24*60*60	# seconds - TTL of cached search pages and metadata lookups.
+	cache_size = 1024	# MB
+	
+	# request quota of the publisher (the max number of requests, days of a quota window), e.g., 'Quota/Elsevier = 20000, 7' in the info file.
+	quota = None	# None means no quota.
+	
+	# shared crawl frontier (if 'Frontier' is given in the info file) - the number of items claimed at once, and lease time of claimed items.
+	frontier_batch_size = 100
+	lease_time = 10*60	# seconds
+	poll_interval = 60	# seconds - interval of checking the frontier in the worker mode.
+	
+	chunk_size = 64*1024	# bytes - chunk size of writing downloaded documents.
 	
 	def __init__(self, publisher):
-		# get key, destination path, uid list, and error list.
-		with open('/home/gpark/corpus_web/tdm/api_key_and_archive_info.txt', 'r') as f:
+		self.publisher = publisher
+		self.project = None	# project of the current crawl (e.g., 'XAS'). It's recorded with uids for statistics.
+		self.uid_registry_file = None
+		self.checkpoint_dir = None
+		self.cache_dir = None
+		self.blob_dir = None
+		self.frontier_file = None
+		self.frontier_journal_mode = 'WAL'
+		self.registry_journal_mode = None	# the frontier's journal mode by default, since both are shared by the same workers.
+		
+		# get key, destination path, uid list, error list, and rate limit.
+		with open(info_file, 'r') as f:
 			self.error_list = set()
 			for line in f.readlines():
 				if line.startswith('API_key'):
@@ -26,40 +91,187 @@ class BaseDownloader:
 						self.path = val
 				elif line.startswith('UID_list'):
 					self.uid_list = line.split('=', 1)[1].strip() # unique identifier for articles (e.g., DOI). It's to avoid duplicate downloads for the same article from different sources.
+				elif line.startswith('Registry_journal_mode'):
+					self.registry_journal_mode = line.split('=', 1)[1].strip()
+				elif line.startswith('UID_registry'):
+					self.uid_registry_file = line.split('=', 1)[1].strip()
+				elif line.startswith('Checkpoint_dir'):
+					self.checkpoint_dir = line.split('=', 1)[1].strip()
+				elif line.startswith('HTTP_cache_size'):
+					self.cache_size = int(line.split('=', 1)[1].strip())
+				elif line.startswith('HTTP_cache'):
+					self.cache_dir = line.split('=', 1)[1].strip()
+				elif line.startswith('Blob_store'):
+					self.blob_dir = line.split('=', 1)[1].strip()
+				elif line.startswith('Frontier_journal_mode'):
+					self.frontier_journal_mode = line.split('=', 1)[1].strip()
+				elif line.startswith('Frontier'):
+					self.frontier_file = line.split('=', 1)[1].strip()
 				elif line.startswith('Error_list'):
 					key = line.split('=', 1)[0].split('/')[1].strip()
 					val = line.split('=', 1)[1].strip()
 					if key == publisher:
 						self.error_list.update([x.strip() for x in val.split(',')])
+				elif line.startswith('Rate_limit'):
+					key = line.split('=', 1)[0].split('/')[1].strip()
+					val = line.split('=', 1)[1].strip()
+					if key == publisher:
+						val = [x.strip() for x in val.split(',')]
+						self.requests_per_sec = float(val[0])
+						if len(val) > 1:
+							self.burst = int(val[1])
+				elif line.startswith('Quota'):
+					key = line.split('=', 1)[0].split('/')[1].strip()
+					val = line.split('=', 1)[1].strip()
+					if key == publisher:
+						val = [x.strip() for x in val.split(',')]
+						self.quota = (int(val[0]), int(val[1]) if len(val) > 1 else 7)
+		
+		# the registry replaces the flat uid list file. If it doesn't exist yet, it's created next to the uid list file, and the uid list is imported.
+		if self.uid_registry_file is None:
+			self.uid_registry_file = os.path.splitext(self.uid_list)[0] + '.db'
+		if self.registry_journal_mode is None:
+			self.registry_journal_mode = self.frontier_journal_mode
+		self.uid_registry = UIDRegistry(self.uid_registry_file, self.uid_list, self.registry_journal_mode)
+		
+		if self.checkpoint_dir is None:
+			self.checkpoint_dir = os.path.join(os.path.dirname(self.uid_list), 'checkpoints')
+		
+		if self.cache_dir is None:
+			self.cache_dir = os.path.join(os.path.dirname(self.uid_list), 'http_cache')
+		self.http_cache = HTTPCache(self.cache_dir, self.cache_size*1024*1024)	# used by requests with 'cache_ttl' (e.g., searches).
+		
+		# content-addressed store of downloaded payloads. It should be on the same file system as the archive, so files are hard links to payloads.
+		if self.blob_dir is None:
+			self.blob_dir = os.path.join(os.path.dirname(self.uid_list), 'blobs')
+		self.blob_store = BlobStore(self.blob_dir)
+		
+		self.rate_limiter = RateLimiter(self.requests_per_sec, self.burst)	# per-publisher token bucket that adapts to rate limit headers.
+		self.retry_policy = RetryPolicy(self.max_attempts, self.backoff_base, self.backoff_max)
+		self.session = create_session(rate_limiter=self.rate_limiter, retry_policy=self.retry_policy, cache=self.http_cache)	# connection-pooled session shared by all requests to this publisher.
+		
+		self.failed_list = os.path.join(self.checkpoint_dir, publisher + '_failed.jsonl')	# failed items for a later retry pass.
+		self.watermark_file = os.path.join(self.checkpoint_dir, publisher + '_watermark.json')	# key: project, value: start date of the last successful crawl.
+		self.quota_file = os.path.join(self.checkpoint_dir, publisher + '_quota.json')	# start date and usage of the current quota window.
+		
+		# article retrievals go through the shared frontier, so worker processes on several machines can share them.
+		self.frontier = CrawlFrontier(self.frontier_file, self.frontier_journal_mode) if self.frontier_file is not None else None
+		self.worker_id = socket.gethostname() + ':' + str(os.getpid())
 		
-		self.existing_uids = set([line.strip().lower() for line in open(self.uid_list)])
-		#to_be_saved_uids = set()	# update the uid_list file at a time to reduce File I/O
+		self.load_quota()
+	
+	
+	def share_session(self, downloader):
+		""" Send requests through another downloader's session, so crawls of the same publisher (e.g., different projects) share its rate limit and quota """
+		self.rate_limiter = downloader.rate_limiter
+		self.session = downloader.session
+		
+		self.load_quota()
 	
 
 	def remove_duplicates(self, new_uids):
-		ret_uids = new_uids.copy()  # keep the original list for debugging.
-
-		ret_uids = set([x.lower() for x in ret_uids])
-		ret_uids.difference_update(self.existing_uids)   # remove any duplicates
-		
-		#self.existing_uids.update(ret_uids)
-		#self.to_be_saved_uids.update(ret_uids)
+		ret_uids = self.uid_registry.filter_new(new_uids)	# remove any duplicates. uids are lowercased.
 		
 		# debugging
-		if len(ret_uids) != len(new_uids):	
-			tmp = new_uids.copy()
-			tmp = set([x.lower() for x in tmp])
-			for duplicate_uid in tmp.intersection(self.existing_uids):
+		if logger.isEnabledFor(logging.DEBUG) and len(ret_uids) != len(new_uids):
+			for duplicate_uid in set([x.lower() for x in new_uids]).difference(ret_uids):
 				logger.debug(f'>> Existing id: {duplicate_uid}')
 
 		return ret_uids
 	
 	
 	def update_uid(self, uid):
-		with open(self.uid_list, 'a') as file:
-			file.write("%s\n" % uid)
+		self.uid_registry.add(uid, self.publisher, self.project)
+	
+	
+	def update_uids(self, uids):
+		""" Register a batch of uids in a single transaction """
+		self.uid_registry.add_many(uids, self.publisher, self.project)
+	
+	
+	def get_missing_dois(self, dois):
+		""" Return the set of DOIs (lowercased) that are not retrieved (not in the registry). It's the return value of retrieve_by_dois() of every downloader. """
+		return self.uid_registry.filter_new(dois)
+	
+	
+	def get_checkpoint(self, *query):
+		""" Return the search checkpoint of the query (e.g., query string and year) """
+		return CrawlCheckpoint(self.checkpoint_dir, self.publisher, query)
+	
+	
+	def load_watermark(self, project):
+		"""
+		Return the date (datetime.date) from which the project's delta query starts, or None if the project has never been crawled.
+		It's the start date of the last successful crawl minus 'watermark_overlap' days.
+		"""
+		if not os.path.exists(self.watermark_file):
+			return None
+		
+		with open(self.watermark_file) as f:
+			watermarks = json.load(f)
+		
+		if project not in watermarks:
+			return None
+		
+		return date.fromisoformat(watermarks[project]) - timedelta(days=self.watermark_overlap)
+	
+	
+	def save_watermark(self, project, mark):
+		""" Save the start date (datetime.date) of a successful crawl as the project's watermark """
+		watermarks = {}
+		if os.path.exists(self.watermark_file):
+			with open(self.watermark_file) as f:
+				watermarks = json.load(f)
+		
+		watermarks[project] = mark.isoformat()
+		
+		if not os.path.exists(self.checkpoint_dir):
+			os.makedirs(self.checkpoint_dir)
+		
+		tmp_file = self.watermark_file + '.tmp'
+		with open(tmp_file, 'w') as f:
+			json.dump(watermarks, f)
+		os.replace(tmp_file, self.watermark_file)
+	
+	
+	def load_quota(self):
+		""" Load the usage of the current quota window. If the window is over, a new window starts today. """
+		self.quota_start = date.today()
+		self.quota_used = 0
+		self.quota_base = self.session.num_of_requests	# requests of the session are counted from here.
+		
+		if self.quota is None or not os.path.exists(self.quota_file):
+			return
 		
-		self.existing_uids.add(uid)
+		with open(self.quota_file) as f:
+			state = json.load(f)
+		
+		if date.fromisoformat(state['start']) + timedelta(days=self.quota[1]) > date.today():
+			self.quota_start = date.fromisoformat(state['start'])
+			self.quota_used = state['used']
+	
+	
+	def get_quota_remaining(self):
+		""" Return the number of requests left in the current quota window, or None if the publisher has no quota """
+		if self.quota is None:
+			return None
+		
+		return self.quota[0] - (self.quota_used + self.session.num_of_requests - self.quota_base)
+	
+	
+	def save_quota(self):
+		if self.quota is None:
+			return
+		
+		if not os.path.exists(self.checkpoint_dir):
+			os.makedirs(self.checkpoint_dir)
+		
+		state = {'start': self.quota_start.isoformat(), 'used': self.quota[0] - self.get_quota_remaining()}
+		
+		tmp_file = self.quota_file + '.tmp'
+		with open(tmp_file, 'w') as f:
+			json.dump(state, f)
+		os.replace(tmp_file, self.quota_file)
 
 	''' deprecated - changed to save uids right after write_to_file() since errors frequently occur between articles. - 02-12-2020
 	def save_uid(self):
@@ -70,10 +282,261 @@ class BaseDownloader:
 		self.to_be_saved_uids.clear()
 	'''
 
+	def fetch_articles(self, items, on_success=None):
+		"""
+		Retrieve articles (FetchItem) concurrently, and return the list of items that failed.
+		By default, each article is written to its directory, and then its uid is added.
+		If the frontier is used, the items are added to the frontier, and this worker retrieves items claimed from the frontier along with other workers.
+		"""
+		if self.frontier is not None and on_success is None:
+			self.frontier.add(self.publisher, [self.strip_credentials(x) for x in items])
+			return self.run_tasks(self.iter_frontier_tasks())
+		
+		engine = FetchEngine(self.session, self.max_concurrency, self.max_per_host, self.get_request_args)
+		
+		return engine.run(items, on_success if on_success is not None else self.save_article, self.on_fetch_error)
+	
+	
+	def save_article(self, item, response):
+		""" Write an article, and add its uid. If the article isn't valid, it's recorded as a failure, and False is returned. """
+		try:
+			self.write_to_file(response, item.destination, item.filename, item.extension)
+		except InvalidDocumentError as e:
+			logger.error(f'>> Invalid document: {item.uid} ({e.reason}) - {response.url}')
+			self.record_failure(item, 'invalid document: ' + e.reason)
+			return False
+		
+		self.update_uid(item.uid)
+		
+		return True
+	
+	
+	def on_fetch_error(self, item, response):
+		if response is not None:
+			self.display_error_msg(response)
+		
+		self.record_failure(item, response.status_code if response is not None else 'request error')
+	
+	
+	def record_failure(self, item, reason):
+		""" Record a failed item (FetchItem) for a later retry pass. Credentials are never written (see get_request_args()). """
+		if not os.path.exists(self.checkpoint_dir):
+			os.makedirs(self.checkpoint_dir)
+		
+		entry = {'item': self.strip_credentials(item).to_dict(), 'reason': reason, 'failed_at': datetime.now().isoformat(timespec='seconds')}
+		
+		with open(self.failed_list, 'a') as file:
+			file.write(json.dumps(entry) + '\n')
+	
+	
+	def load_failures(self, failed_list=None):
+		failed_list = self.failed_list if failed_list is None else failed_list
+		
+		if not os.path.exists(failed_list):
+			return []
+		
+		with open(failed_list) as file:
+			return [FetchItem.from_dict(json.loads(line)['item']) for line in file if line.strip() != '']
+	
+	
+	def retry_failures(self):
+		""" Retry the recorded failed items, and return the items that failed again (they are recorded again) """
+		return self.run_tasks(self.iter_retry_tasks())
+	
+	
+	def auth_headers(self, item):
+		""" Return the headers that authenticate the request of an item (e.g., API key), or None. It's overridden by publishers that need them. """
+		return None
+	
+	
+	def auth_params(self, item):
+		""" Return the query parameters that authenticate the request of an item (e.g., api_key), or None """
+		return None
+	
+	
+	def get_request_args(self, item):
+		"""
+		Return headers and params of the request of an item with this downloader's credentials.
+		
+		Note:
+		- Credentials are added when the request is sent instead of being kept in items, since items are shared through the frontier
+		  (other workers use their own keys) and written to the failed list.
+		"""
+		headers = dict(item.headers or {}, **(self.auth_headers(item) or {}))
+		params = dict(item.params or {}, **(self.auth_params(item) or {}))
+		
+		return {'headers': headers or None, 'params': params or None}
+	
+	
+	def strip_credentials(self, item):
+		""" Return a copy of an item without this downloader's credentials (e.g., an item recorded before credentials were added at request time) """
+		d = item.to_dict()
+		for field, auth in [('headers', self.auth_headers(item)), ('params', self.auth_params(item))]:
+			if d[field] is not None and auth is not None:
+				d[field] = {k: v for k, v in d[field].items() if k not in auth} or None
+		
+		return FetchItem.from_dict(d)
+	
+	
+	def make_task(self, url, run, kind='article', callback=None, max_per_host=None):
+		""" Return a task (CrawlTask) of this publisher, which goes through the publisher's rate limiter """
+		return CrawlTask(self.publisher, url, run, kind, callback, self.rate_limiter, max_per_host if max_per_host is not None else self.max_per_host)
+	
+	
+	def fetch_article(self, item):
+		""" Retrieve an article (FetchItem) and write it, and return True if it's written. Failures are recorded. """
+		try:
+			response = self.session.get(item.url, **self.get_request_args(item))
+		except Exception as e:
+			logger.error(f'>> Request failed: {item.url} ({e})')
+			response = None
+		
+		if response is not None and response.status_code == 200:
+			return self.save_article(item, response)
+		
+		self.on_fetch_error(item, response)
+		
+		return False
+	
+	
+	def iter_fetch_tasks(self, items, callback=None):
+		"""
+		Yield a task per article (FetchItem).
+		
+		params
+		- callback: function(item, is_fetched) called in the scheduler thread after the article is retrieved.
+		"""
+		if self.frontier is not None:
+			self.frontier.add(self.publisher, [self.strip_credentials(x) for x in items])
+			yield from self.iter_frontier_tasks(callback)
+			return
+		
+		for item in items:
+			yield self.make_task(item.url, functools.partial(self.fetch_article, item), 'article', 
+								 functools.partial(callback, item) if callback is not None else None)
+	
+	
+	def iter_frontier_tasks(self, callback=None):
+		"""
+		Yield a task per article claimed from the frontier until the publisher has no pending items, and return the list of items that failed.
+		
+		Note:
+		- Items are claimed in batches of 'frontier_batch_size' with a lease of 'lease_time' seconds, so a batch must be retrieved within the lease
+		  (e.g., 100 articles at 2 requests per second take about a minute). Items of a worker that died are claimed again after the lease expires.
+		- Items leased to other workers are not waited for. A worker (see downloader.py --worker) keeps claiming them until the frontier is drained.
+		"""
+		failed_items = []
+		
+		def on_fetched(item, is_fetched):
+			if is_fetched:
+				self.frontier.complete(self.publisher, item.uid)
+			else:
+				self.frontier.fail(self.publisher, item.uid)	# it's also recorded in the failed list, and the retry pass adds it again.
+				failed_items.append(item)
+			
+			if callback is not None:
+				callback(item, is_fetched)
+		
+		while True:
+			items = self.frontier.claim(self.publisher, self.worker_id, self.frontier_batch_size, self.lease_time)
+			if len(items) == 0:
+				break
+			
+			for item in items:
+				yield self.make_task(item.url, functools.partial(self.fetch_article, item), 'article', functools.partial(on_fetched, item))
+			
+			yield None	# the next batch is claimed after this batch.
+		
+		return failed_items
+	
+	
+	def iter_retry_tasks(self):
+		"""
+		Yield tasks that retry the recorded failed items, and return the items that failed again (they are recorded again).
+		
+		Note:
+		- The failed list is moved to a retry list first, so failures of this pass go to a new failed list.
+		  The retry list is removed only after all retried items finish, so a crash or a quota stop in the middle keeps the items for the next run.
+		"""
+		retry_list = self.failed_list + '.retry'
+		
+		if os.path.exists(self.failed_list):
+			if not os.path.exists(retry_list):
+				os.replace(self.failed_list, retry_list)
+			else:	# the previous retry pass didn't finish.
+				with open(self.failed_list) as src, open(retry_list, 'a') as dst:
+					dst.write(src.read())
+				os.remove(self.failed_list)
+		
+		items = {}	# key: uid, value: FetchItem - an item recorded more than once is retried once.
+		for item in self.load_failures(retry_list):
+			if item.uid not in self.uid_registry:	# skip items downloaded by another run in the meantime.
+				items[item.uid] = item
+		
+		print(f'<{self.publisher}> #Failed items to retry:', len(items))
+		
+		failed_items = []
+		
+		def on_fetched(item, is_fetched):
+			if not is_fetched:
+				failed_items.append(item)
+		
+		yield from self.iter_fetch_tasks(list(items.values()), on_fetched)
+		yield None	# wait for the retries.
+		
+		if os.path.exists(retry_list):
+			os.remove(retry_list)
+		
+		return failed_items
+	
+	
+	def iter_tasks(self, *args, **kwargs):
+		"""
+		Yield tasks (CrawlTask) of a crawl, and return doi_title. It's the work generator of retrieve_articles() for the crawl scheduler.
+		
+		Note:
+		- By default, the whole crawl is a single task. Downloaders override it to yield search pages and article retrievals as separate tasks,
+		  and their retrieve_articles() runs the generator (see run_tasks()).
+		"""
+		task = self.make_task(None, functools.partial(self.retrieve_articles, *args, **kwargs), 'crawl')
+		yield task
+		yield None	# wait for the crawl.
+		
+		return task.result
+	
+	
+	def run_tasks(self, tasks):
+		""" Run a generator of tasks of this publisher alone, and return its return value (e.g., doi_title). An error of a task is raised. """
+		scheduler = CrawlScheduler(self.max_concurrency)
+		job = scheduler.add(self.publisher, tasks, max_concurrency=self.max_concurrency, downloader=self)
+		scheduler.run()
+		
+		if job.error is not None:
+			raise job.error
+		
+		return job.result
+	
+
 	def write_to_file(self, response, destination, filename, extension):
-		with open(destination + filename + extension, 'wb') as file:
-			for chunk in response.iter_content(2048):
-				file.write(chunk)
+		"""
+		Write a document, and raise InvalidDocumentError if the document isn't valid (e.g., an error page, a truncated XML).
+		
+		Note:
+		- The document is written to a temporary file in large chunks and validated in the same pass (see DocumentValidator),
+		  and then it's committed by an atomic rename, so only valid documents reach the archive (and the parse stage).
+		- Content-Length is compared only if the body isn't content-encoded since the body is decoded (e.g., gzip) while it's read.
+		"""
+		content_length = None
+		if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+			content_length = int(response.headers['Content-Length'])
+		
+		validator = DocumentValidator(extension, response.headers.get('Content-Type'), content_length)
+		
+		if not os.path.exists(destination):
+			os.makedirs(destination)	# create a directory for each article (and its shard directories).
+		
+		# identical payloads (e.g., the same PDF from different sources) are stored once, and the file is a link to the payload.
+		self.blob_store.put(response.iter_content(self.chunk_size), destination + filename + extension, validator)
 
 
 	def display_error_msg(self, response, member=None):
@@ -0,0 +1,197 @@
+"""
+Crawler benchmark against a local mock publisher server (see mock_publisher.py), so throughput changes can be measured without the real APIs.
+
+Usage:
+- python benchmark.py [--sequential] [--no-rate-limit] [<publisher> ...]	# e.g., python benchmark.py --no-rate-limit Elsevier PMC
+
+Note:
+- The real downloaders are run with a temporary info file (TDM_INFO_FILE), so the archive, the UID registry, checkpoints and the HTTP cache
+  are in a temporary directory, and every run starts empty.
+- Requests of each downloader's session are sent to the mock server by a transport adapter (see RedirectAdapter), so the downloaders aren't modified,
+  and rate limiters, retries and circuit breakers see the original hosts.
+- Crawls are run by one scheduler as in downloader.py (or one by one with --sequential). The publishers' rate limits are kept unless --no-rate-limit is given
+  (e.g., RSC allows a request every 10 seconds).
+- Requests and retries are counted by the sessions, articles by the UID registry, and bytes (response bodies) and injected errors by the server.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import importlib
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+import logging
+
+from http_session import DEFAULT_POOL_SIZE
+from crawl_scheduler import CrawlScheduler
+from mock_publisher import MockPublisherServer
+
+logger = logging.getLogger(__name__)
+
+
+# key: publisher, value: (module, downloader class, crawl args, hosts of the publisher)
+publishers = {
+	'Elsevier': ('elsevier_downloader', 'ElsevierDownloader', ('XAFS', None), [MockPublisherServer.elsevier_host]),
+	'Springer': ('springer_downloader', 'SpringerDownloader', ('XAFS', None), [MockPublisherServer.springer_host]),
+	'PMC': ('pmc_downloader', 'PMCDownloader', ('XAFS', None), [MockPublisherServer.eutils_host, MockPublisherServer.ncbi_host, MockPublisherServer.pmc_ftp_host]),
+	'RSC': ('rsc_downloader', 'RSCDownloader', ('XAFS',), [MockPublisherServer.rsc_host]),
+	'Crossref': ('crossref_downloader', 'CrossrefDownloader', ('XAFS',), [MockPublisherServer.crossref_host, MockPublisherServer.emerald_host]),
+}
+
+
+class RedirectAdapter(HTTPAdapter):
+	""" Transport adapter that sends requests to the mock server, e.g., https://api.elsevier.com/content/... -> http://127.0.0.1:<port>/api.elsevier.com/content/... """
+
+	def __init__(self, base_url, **kwargs):
+		super().__init__(**kwargs)
+		self.base_url = base_url
+
+
+	def send(self, request, **kwargs):
+		url = urlsplit(request.url)
+		request.url = f'{self.base_url}/{url.netloc}{url.path}' + (f'?{url.query}' if url.query else '')
+
+		return super().send(request, **kwargs)
+
+
+def write_info_file(root, names):
+	""" Write an info file whose paths are in the root directory, and return the file """
+	lines = []
+	for name in names:
+		lines.append(f'API_key/{name} = BENCHMARK_KEY')
+		lines.append(f'Path/{name} = ' + os.path.join(root, 'archive', '' if name == 'Crossref' else name, ''))	# Crossref saves articles in member directories.
+
+	lines.append('UID_list = ' + os.path.join(root, 'uid_list.txt'))
+
+	info_file = os.path.join(root, 'api_key_and_archive_info.txt')
+	with open(info_file, 'w') as f:
+		f.write('\n'.join(lines) + '\n')
+
+	return info_file
+
+
+def create_downloaders(names, base_url, rate_limit=True, backoff_base=None):
+	""" Return dict of key: publisher - value: downloader whose requests go to the mock server """
+	downloaders = {}
+	for name in names:
+		module, cls, _, _ = publishers[name]
+		try:
+			downloader = getattr(importlib.import_module(module), cls)()
+		except ImportError as e:	# e.g., chemdataextractor for RSC
+			print(f'<Benchmark> {name} is skipped: {e}')
+			continue
+
+		adapter = RedirectAdapter(base_url, pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE)
+		downloader.session.mount('https://', adapter)
+		downloader.session.mount('http://', adapter)
+		downloader.session.trust_env = False	# no proxies for the local server.
+
+		downloader.rate_limiter.enabled = rate_limit
+		if backoff_base is not None:
+			downloader.retry_policy.base_delay = backoff_base
+
+		downloaders[name] = downloader
+
+	return downloaders
+
+
+def run_benchmark(downloaders, parallel=True):
+	""" Run the crawls, and return dict of key: publisher - value: (elapsed seconds, error) """
+	start_times = {}
+	end_times = {}
+	errors = {}
+
+	def timed(name, tasks):	# record the end time of a crawl in the scheduler.
+		try:
+			return (yield from tasks)
+		finally:
+			end_times[name] = time.time()
+
+	if parallel:
+		scheduler = CrawlScheduler()
+		jobs = {name: scheduler.add(name, timed(name, x.iter_tasks(*publishers[name][2])), 0, x.max_concurrency, x) for name, x in downloaders.items()}
+
+		start_times = dict.fromkeys(downloaders, time.time())
+		scheduler.run()
+
+		errors = {name: job.error for name, job in jobs.items()}
+	else:
+		for name, downloader in downloaders.items():
+			start_times[name] = time.time()
+			try:
+				downloader.retrieve_articles(*publishers[name][2])
+			except Exception as e:	# e.g., DownloadError after retries. The other publishers continue.
+				errors[name] = e
+			end_times[name] = time.time()
+
+	return {name: (end_times.get(name, time.time()) - start_times[name], errors.get(name)) for name in downloaders}
+
+
+def print_report(downloaders, server, results, registry_stats):
+	print(f'{"Publisher":<10}{"Requests":>10}{"Retries":>9}{"429":>6}{"5xx":>6}{"Articles":>10}{"MB":>9}{"Sec":>8}{"Req/s":>9}{"Art/s":>9}{"MB/s":>8}')
+
+	new_registry_stats = next(iter(downloaders.values())).uid_registry.get_stats()
+
+	for name, downloader in downloaders.items():
+		elapsed, error = results[name]
+		elapsed = max(elapsed, 1e-6)
+
+		counters = server.get_counters(publishers[name][3])
+		num_of_requests = downloader.session.num_of_requests
+		num_of_articles = new_registry_stats.get(downloader.publisher, 0) - registry_stats.get(downloader.publisher, 0)
+		mb = counters['bytes']/1024/1024
+
+		print(f'{name:<10}{num_of_requests:>10}{downloader.session.num_of_retries:>9}{counters["429"]:>6}{counters["5xx"]:>6}{num_of_articles:>10}'
+			  f'{mb:>9.2f}{elapsed:>8.1f}{num_of_requests/elapsed:>9.1f}{num_of_articles/elapsed:>9.1f}{mb/elapsed:>8.2f}' +
+			  (f'  (stopped: {error})' if error is not None else ''))
+
+
+def main():
+	start_time = time.time()
+
+	# settings of the mock server
+	num_of_articles = 100		# articles per publisher
+	article_size = 20*1024		# bytes
+	latency = 0.05				# seconds per request
+	error_429_rate = 0.02
+	error_5xx_rate = 0.02
+	retry_after = 1				# seconds
+
+	backoff_base = 0.1	# seconds - with the default (1 second), a short benchmark is dominated by backoff delays.
+
+	parallel = '--sequential' not in sys.argv
+	rate_limit = '--no-rate-limit' not in sys.argv
+	names = [x for x in sys.argv[1:] if not x.startswith('--')]
+	if len(names) == 0:
+		names = list(publishers)
+
+	root = tempfile.mkdtemp(prefix='tdm_benchmark_')
+	os.environ['TDM_INFO_FILE'] = write_info_file(root, names)	# read when the downloaders are imported.
+
+	server = MockPublisherServer(num_of_articles=num_of_articles, article_size=article_size, latency=latency,
+								 error_429_rate=error_429_rate, error_5xx_rate=error_5xx_rate, retry_after=retry_after)
+	base_url = server.start()
+
+	try:
+		downloaders = create_downloaders(names, base_url, rate_limit, backoff_base)
+		if len(downloaders) == 0:
+			return
+
+		registry_stats = next(iter(downloaders.values())).uid_registry.get_stats()
+
+		results = run_benchmark(downloaders, parallel)
+
+		print(f'<Benchmark> #Articles: {num_of_articles} per publisher | {article_size//1024} KB | latency: {latency} sec | '
+			  f'429: {error_429_rate:.0%} | 5xx: {error_5xx_rate:.0%} | ' + ('scheduler' if parallel else 'sequential') + ('' if rate_limit else ' | no rate limit'))
+		print_report(downloaders, server, results, registry_stats)
+	finally:
+		server.stop()
+		shutil.rmtree(root, ignore_errors=True)
+
+	print("--- %s seconds ---" % (time.time() - start_time))
+
+
+if __name__ == "__main__":
+	main()
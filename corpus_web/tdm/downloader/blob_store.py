@@ -0,0 +1,127 @@
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+	"""
+	Content-addressed store of raw payloads (articles and objects such as figures).
+
+	Note:
+	- A payload is stored once under its SHA-256 digest (e.g., <root>/ab/cd/abcd...), and files in article directories are hard links to it.
+	  So, identical payloads (e.g., the same figure or PDF downloaded for different articles or from different sources) take the space once.
+	- If a hard link can't be made (e.g., the archive is on another file system), the payload is copied.
+	- Since files are shared, files in the archive must be replaced (see put()) instead of being modified in place.
+	- A payload is written to a temporary file first, and it's committed (renamed into the store and linked) only after it passes the validator.
+	  So, an invalid or partially written payload never appears in the archive.
+	- Parsed outputs (e.g., JSON files) can be kept next to the payload (<digest>.json), so an identical payload is parsed once.
+
+	References:
+	- https://git-scm.com/book/en/v2/Git-Internals-Git-Objects
+	"""
+
+	def __init__(self, root):
+		self.root = root
+		self.tmp_dir = os.path.join(root, 'tmp')	# temporary files are in the store, so they are renamed (not copied) into it.
+
+		if not os.path.exists(self.tmp_dir):
+			os.makedirs(self.tmp_dir, exist_ok=True)
+
+
+	def get_path(self, digest):
+		return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+
+	def digest(self, file):
+		""" Return the SHA-256 digest of a file """
+		h = hashlib.sha256()
+		with open(file, 'rb') as f:
+			for chunk in iter(lambda: f.read(1024*1024), b''):
+				h.update(chunk)
+
+		return h.hexdigest()
+
+
+	def put(self, chunks, file, validator=None):
+		"""
+		Store a payload given as an iterable of bytes (e.g., response.iter_content()), link it to the file, and return (digest, is_new).
+		The payload is hashed (and validated) while it's written, so it's read once.
+
+		params
+		- validator: DocumentValidator. If the payload isn't valid, InvalidDocumentError is raised, and nothing is stored.
+		"""
+		h = hashlib.sha256()
+
+		tmp_file = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+		try:
+			with open(tmp_file, 'wb') as f:
+				for chunk in chunks:
+					if chunk:
+						h.update(chunk)
+						if validator is not None:
+							validator.feed(chunk)
+						f.write(chunk)
+
+			if validator is not None:
+				validator.close()
+		except BaseException:
+			if os.path.exists(tmp_file):	# e.g., open() failed, so the real error isn't hidden.
+				os.remove(tmp_file)
+			raise
+
+		digest = h.hexdigest()
+		blob = self.get_path(digest)
+
+		is_new = not os.path.exists(blob)
+		if is_new:
+			os.makedirs(os.path.dirname(blob), exist_ok=True)
+			os.replace(tmp_file, blob)	# if another writer stores the same payload at the same time, either one wins with the same content.
+		else:
+			os.remove(tmp_file)
+			logger.debug(f'>> Duplicate payload: {file} -> {digest}')
+
+		self.link(blob, file)
+
+		return digest, is_new
+
+
+	def link(self, blob, file):
+		""" Make the file a hard link to the blob (or a copy of it) """
+		tmp_file = file + '.' + uuid.uuid4().hex[:8]
+		try:
+			os.link(blob, tmp_file)
+		except OSError:	# e.g., EXDEV: cross-device link
+			shutil.copyfile(blob, tmp_file)
+
+		os.replace(tmp_file, file)	# an existing file is replaced at once.
+
+
+	def is_shared(self, file):
+		""" Return True if the file is linked to a blob, which is the case for files stored through put() """
+		return os.stat(file).st_nlink > 1
+
+
+	def get_parsed(self, file, extension='.json'):
+		""" Return the parsed output of the file's payload, or None if the payload hasn't been parsed yet """
+		if not self.is_shared(file):
+			return None
+
+		parsed = self.get_path(self.digest(file)) + extension
+
+		return parsed if os.path.exists(parsed) else None
+
+
+	def put_parsed(self, file, parsed_file, extension='.json'):
+		""" Keep the parsed output of the file's payload, so that identical payloads reuse it """
+		if not self.is_shared(file) or not os.path.exists(parsed_file):
+			return
+
+		parsed = self.get_path(self.digest(file)) + extension
+		if not os.path.exists(parsed):
+			tmp_file = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+			shutil.copyfile(parsed_file, tmp_file)
+			os.replace(tmp_file, parsed)
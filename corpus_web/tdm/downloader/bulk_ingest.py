@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from base_downloader import DownloadError
+from pmc_downloader import PMCDownloader
+from elsevier_downloader import ElsevierDownloader
+from springer_downloader import SpringerDownloader
+from aps_downloader import APSDownloader
+from crossref_downloader import CrossrefDownloader
+
+logger = logging.getLogger(__name__)
+
+
+class BulkIngester:
+	"""
+	Ingest a list of DOIs (e.g., 50k DOIs from collaborators) instead of keyword queries.
+
+	Note:
+	- DOIs that are already downloaded are removed in a single pass over the UID registry before anything is requested.
+	- DOIs are routed to downloaders by their prefixes. Known prefixes (CrossrefDownloader.publisher_prefixes) need no lookup.
+	  The other prefixes are resolved to Crossref members (one cached lookup per prefix), and then
+	  members with their own downloaders (e.g., Springer Nature) go to the downloaders, and members in the Crossref member map go to Crossref TDM links.
+	  The rest (e.g., biomedical publishers) are tried in PMC.
+	- Publishers are on different hosts with independent rate limits, so the publishers are fetched concurrently,
+	  and each publisher retrieves its DOIs in batches (retrieve_by_dois()). A failed batch doesn't stop the other batches.
+	- Every downloader's retrieve_by_dois() returns the DOIs it didn't retrieve, and they're reported per publisher.
+	- It can be run again with the same list (or the list of missing DOIs). Downloaded DOIs are registered, so only the rest are fetched.
+
+	Usage:
+	- python bulk_ingest.py <DOI list file (one DOI per line)> [project]
+	"""
+
+	downloader_classes = {
+		'Elsevier': ElsevierDownloader,
+		'Springer': SpringerDownloader,
+		'APS': APSDownloader,
+		'Crossref': CrossrefDownloader,
+		'PMC': PMCDownloader
+	}
+
+	batch_size = 1000	# the number of DOIs passed to a downloader at once.
+
+	def __init__(self, project=None):
+		self.project = project	# project of the DOI list (e.g., 'XAS'). It's recorded with uids for statistics.
+		self.downloaders = {}
+
+		self.crossref = self.get_downloader('Crossref')
+
+		self.prefix_publisher = {}	# key: DOI prefix, value: publisher (a key of downloader_classes)
+		for publisher, prefixes in self.crossref.publisher_prefixes.items():
+			if publisher in self.downloader_classes:
+				for prefix in prefixes:
+					self.prefix_publisher[prefix] = publisher
+
+
+	def get_downloader(self, publisher):
+		if publisher not in self.downloaders:
+			self.downloaders[publisher] = self.downloader_classes[publisher]()
+			self.downloaders[publisher].project = self.project
+
+		return self.downloaders[publisher]
+
+
+	@staticmethod
+	def normalize_doi(doi):
+		""" Return a lowercased DOI without a resolver or scheme (e.g., https://doi.org/10.1103/PhysRevB.66.064209 -> 10.1103/physrevb.66.064209) """
+		doi = doi.strip().lower()
+
+		for prefix in ['https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'http://dx.doi.org/', 'doi:']:
+			if doi.startswith(prefix):
+				doi = doi[len(prefix):].strip()
+
+		return doi
+
+
+	def get_publisher(self, prefix):
+		""" Return the publisher (a key of downloader_classes) that retrieves DOIs of the prefix """
+		if prefix not in self.prefix_publisher:
+			try:
+				member_id = self.crossref.get_prefix_member(prefix)
+			except (DownloadError, requests.exceptions.RequestException) as e:
+				logger.error(f'>> Prefix lookup failed - {prefix}: {e}')
+				member_id = None
+
+			if member_id in self.crossref.member_publishers:
+				self.prefix_publisher[prefix] = self.crossref.member_publishers[member_id]
+			elif member_id in self.crossref.member_names:
+				self.prefix_publisher[prefix] = 'Crossref'
+			else:
+				self.prefix_publisher[prefix] = 'PMC'
+
+		return self.prefix_publisher[prefix]
+
+
+	def route(self, dois):
+		""" Return dict of key: publisher - value: list of DOIs """
+		routes = {}
+		for doi in sorted(dois):
+			publisher = self.get_publisher(doi.split('/', 1)[0])
+			routes.setdefault(publisher, []).append(doi)
+
+		return routes
+
+
+	def retrieve(self, publisher, dois):
+		""" Retrieve DOIs of a publisher in batches, and return the set of DOIs that are not retrieved (including DOIs of failed batches) """
+		downloader = self.get_downloader(publisher)
+		num_of_batches = (len(dois) + self.batch_size - 1) // self.batch_size
+		missing_dois = set()
+
+		for i in range(0, len(dois), self.batch_size):
+			print(f'<{publisher}> Batch {i // self.batch_size + 1} / {num_of_batches}')
+
+			batch = dois[i:i + self.batch_size]
+			try:
+				missing_dois.update(downloader.retrieve_by_dois(batch))
+			except (DownloadError, requests.exceptions.RequestException) as e:	# the other batches continue.
+				logger.error(f'>> <{publisher}> batch failed: {e}')
+				missing_dois.update(batch)
+
+		return missing_dois
+
+
+	def ingest(self, dois):
+		"""
+		Download articles of the DOIs, and return dict of key: publisher - value: set of DOIs that are not downloaded.
+		"""
+		dois = set([self.normalize_doi(x) for x in dois])
+		dois = set([x for x in dois if x.startswith('10.') and '/' in x])
+
+		new_dois = self.crossref.uid_registry.filter_new(dois)	# skip already downloaded articles.
+
+		print('<Bulk> #DOIs w/  duplicates:', len(dois))
+		print('<Bulk> #DOIs w/o duplicates:', len(new_dois))
+
+		if len(new_dois) == 0:
+			return {}
+
+		routes = self.route(new_dois)
+
+		for publisher, x in routes.items():
+			print(f'<Bulk> {publisher}: {len(x)}')
+
+		for publisher in routes:	# downloaders are created before the threads start.
+			self.get_downloader(publisher)
+
+		with ThreadPoolExecutor(max_workers=len(routes)) as executor:
+			futures = {publisher: executor.submit(self.retrieve, publisher, x) for publisher, x in routes.items()}
+			missing_dois = {publisher: future.result() for publisher, future in futures.items()}
+
+		for publisher, x in routes.items():
+			print(f'<Bulk> {publisher} - downloaded: {len(x) - len(missing_dois[publisher])} / {len(x)}')
+
+		return missing_dois
+
+
+def main():
+	start_time = time.time()
+
+	doi_file = sys.argv[1]
+	project = sys.argv[2] if len(sys.argv) > 2 else None
+
+	with open(doi_file) as f:
+		dois = [x for x in f.read().splitlines() if x.strip() != '']
+
+	missing_dois = BulkIngester(project).ingest(dois)
+
+	# DOIs that are not downloaded (e.g., not open access) are written next to the DOI list by publisher. The file can be ingested again.
+	missing_file = os.path.splitext(doi_file)[0] + '_missing.txt'
+	with open(missing_file, 'w') as f:
+		for publisher, x in sorted(missing_dois.items()):
+			if len(x) > 0:
+				f.write(f'# {publisher}\n' + ''.join(doi + '\n' for doi in sorted(x)))
+
+	print('<Bulk> #Missing DOIs:', sum(len(x) for x in missing_dois.values()), '->', missing_file)
+	print("--- %s seconds ---" % (time.time() - start_time))
+
+
+if __name__ == "__main__":
+	main()
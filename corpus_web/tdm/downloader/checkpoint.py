@@ -0,0 +1,58 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlCheckpoint:
+	"""
+	Per-query checkpoint of a search (e.g., cursor, offset, date partition, collected uids).
+
+	Note:
+	- A checkpoint is a JSON file named after the publisher and a hash of the query, so different queries don't overwrite each other.
+	- It's written to a temp file first and then renamed, so a crash while saving never leaves a broken checkpoint.
+	- Downloaders save it after every search page, and clear it when retrieve_articles() finishes.
+	  If a crawl stops (e.g., DownloadError on an error response), the next run with the same query resumes from the last saved page.
+	"""
+
+	def __init__(self, checkpoint_dir, publisher, query):
+		if not os.path.exists(checkpoint_dir):
+			os.makedirs(checkpoint_dir)
+
+		key = hashlib.sha1(json.dumps([publisher, query], sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+		self.file = os.path.join(checkpoint_dir, publisher + '_' + key + '.json')
+
+
+	def load(self):
+		""" Return the saved state, or an empty dict if there is no checkpoint """
+		if not os.path.exists(self.file):
+			return {}
+
+		try:
+			with open(self.file) as f:
+				state = json.load(f)
+		except ValueError:
+			logger.error(f'>> Broken checkpoint is ignored: {self.file}')
+			return {}
+
+		logger.info(f'>> Resume from the checkpoint: {self.file}')
+
+		return state
+
+
+	def save(self, **state):
+		state['saved_at'] = time.time()
+
+		tmp_file = self.file + '.tmp'
+		with open(tmp_file, 'w') as f:
+			json.dump(state, f)
+		os.replace(tmp_file, self.file)
+
+
+	def clear(self):
+		if os.path.exists(self.file):
+			os.remove(self.file)
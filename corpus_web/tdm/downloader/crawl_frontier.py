@@ -0,0 +1,136 @@
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+import logging
+
+from fetch_engine import FetchItem
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlFrontier:
+	"""
+	Frontier of article retrievals (FetchItem) shared by downloader processes on one or more machines.
+
+	Note:
+	- An item is keyed by (publisher, uid), and its status is 'pending' -> 'leased' -> 'done' or 'failed'.
+	  Searches add items, and workers claim batches of pending items in a transaction ('BEGIN IMMEDIATE'), so an item is leased to one worker at a time.
+	- A lease expires after 'lease_time' seconds. Items leased by a dead worker are put back to pending by the next claim,
+	  and an item whose lease expired 'max_attempts' times (e.g., it kills workers) is marked as 'failed'.
+	- A failed retrieval is 'failed' and recorded in the failed list of the worker as usual. Adding the item again (e.g., the retry pass) puts it back to pending.
+	- WAL mode needs shared memory, so it works only for processes on the same machine. For workers on several machines sharing a file system (e.g., NFS),
+	  set 'Frontier_journal_mode = DELETE', so the rollback journal with file locks is used instead.
+
+	References:
+	- https://www.sqlite.org/wal.html (Disadvantages: WAL does not work over a network filesystem)
+	- https://www.sqlite.org/lang_transaction.html
+	- https://www.sqlite.org/lang_upsert.html
+	"""
+
+	max_attempts = 3
+	batch_size = 500	# the max number of host parameters in a single query is 999 in old SQLite versions.
+
+	def __init__(self, db_file, journal_mode='WAL'):
+		self.db_file = db_file
+		self._lock = threading.Lock()	# the connection is shared by threads of a process.
+		self.conn = sqlite3.connect(db_file, timeout=60, isolation_level=None, check_same_thread=False)
+		self.conn.execute(f'PRAGMA journal_mode={journal_mode}')
+		self.conn.execute('PRAGMA synchronous=NORMAL')
+		self.conn.execute('CREATE TABLE IF NOT EXISTS frontier (publisher TEXT, uid TEXT, item TEXT, status TEXT, attempts INTEGER, '
+						  'lease_owner TEXT, lease_expires REAL, error TEXT, updated TEXT, PRIMARY KEY (publisher, uid))')
+		self.conn.execute('CREATE INDEX IF NOT EXISTS frontier_status ON frontier (publisher, status)')
+
+
+	def add(self, publisher, items):
+		""" Add items (FetchItem) as pending, and return the number of newly added (or re-queued failed) items. Leased and done items are kept as they are. """
+		updated = datetime.now().isoformat(timespec='seconds')
+		rows = [(publisher, x.uid.lower(), json.dumps(x.to_dict()), updated) for x in items]
+
+		with self._lock:
+			self.conn.execute('BEGIN IMMEDIATE')
+			try:
+				before = self.conn.total_changes
+				for i in range(0, len(rows), self.batch_size):
+					self.conn.executemany("INSERT INTO frontier (publisher, uid, item, status, attempts, updated) VALUES (?, ?, ?, 'pending', 0, ?) "
+										  "ON CONFLICT (publisher, uid) DO UPDATE SET item = excluded.item, status = 'pending', attempts = 0, error = NULL, "
+										  "updated = excluded.updated WHERE status = 'failed'", rows[i:i + self.batch_size])
+				num_of_added = self.conn.total_changes - before
+				self.conn.execute('COMMIT')
+			except Exception:
+				self.conn.execute('ROLLBACK')
+				raise
+
+		return num_of_added
+
+
+	def claim(self, publisher, worker_id, limit, lease_time):
+		""" Lease up to 'limit' pending items of the publisher to the worker, and return them (list of FetchItem) """
+		now = time.time()
+
+		with self._lock:
+			self.conn.execute('BEGIN IMMEDIATE')	# no other worker claims the same items.
+			try:
+				self.requeue_expired(publisher, now)
+
+				rows = self.conn.execute("SELECT uid, item FROM frontier WHERE publisher = ? AND status = 'pending' LIMIT ?", (publisher, limit)).fetchall()
+				self.conn.executemany("UPDATE frontier SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires = ? WHERE publisher = ? AND uid = ?",
+									  [(worker_id, now + lease_time, publisher, x[0]) for x in rows])
+				self.conn.execute('COMMIT')
+			except Exception:
+				self.conn.execute('ROLLBACK')
+				raise
+
+		return [FetchItem.from_dict(json.loads(x[1])) for x in rows]
+
+
+	def requeue_expired(self, publisher, now):
+		""" Put items whose leases expired back to pending (or 'failed' after 'max_attempts' leases). It's called in the claim transaction. """
+		cur = self.conn.execute("UPDATE frontier SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, lease_owner = NULL, error = 'lease expired' "
+								"WHERE publisher = ? AND status = 'leased' AND lease_expires < ?", (self.max_attempts, publisher, now))
+		if cur.rowcount > 0:
+			logger.error(f'>> <{publisher}> {cur.rowcount} expired leases are re-queued')
+
+
+	def complete(self, publisher, uid):
+		with self._lock:
+			self.conn.execute("UPDATE frontier SET status = 'done', lease_owner = NULL, error = NULL, updated = ? WHERE publisher = ? AND uid = ?",
+							  (datetime.now().isoformat(timespec='seconds'), publisher, uid.lower()))
+
+
+	def fail(self, publisher, uid, error=None):
+		with self._lock:
+			self.conn.execute("UPDATE frontier SET status = 'failed', lease_owner = NULL, error = ?, updated = ? WHERE publisher = ? AND uid = ?",
+							  (None if error is None else str(error), datetime.now().isoformat(timespec='seconds'), publisher, uid.lower()))
+
+
+	def release(self, worker_id):
+		""" Put items leased to the worker back to pending (e.g., when the worker stops), and return the number of released items """
+		with self._lock:
+			cur = self.conn.execute("UPDATE frontier SET status = 'pending', attempts = attempts - 1, lease_owner = NULL WHERE status = 'leased' AND lease_owner = ?",
+									(worker_id,))
+			return cur.rowcount
+
+
+	def get_stats(self, publisher=None):
+		""" Return dict of key: (publisher, status) - value: the number of items """
+		query = 'SELECT publisher, status, COUNT(*) FROM frontier'
+		args = []
+		if publisher is not None:
+			query += ' WHERE publisher = ?'
+			args.append(publisher)
+		query += ' GROUP BY publisher, status'
+
+		with self._lock:
+			rows = self.conn.execute(query, args).fetchall()
+
+		return {(x[0], x[1]): x[2] for x in rows}
+
+
+	def has_work(self, publisher):
+		""" Return True if the publisher has pending or leased items """
+		with self._lock:
+			row = self.conn.execute("SELECT 1 FROM frontier WHERE publisher = ? AND status IN ('pending', 'leased') LIMIT 1", (publisher,)).fetchone()
+
+		return row is not None
@@ -0,0 +1,229 @@
+import time
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlTask:
+	"""
+	A unit of work of a crawl, which is usually a single request (e.g., a search page, an article retrieval, an OA package, a figure).
+
+	params
+	- publisher: publisher (or job) name of the task.
+	- url: URL of the request. The host is taken from it. If it's None, the publisher name is used as the host.
+	- run: function() that does the work in a worker thread. Its return value is kept in 'result'.
+	- kind: e.g., 'search', 'article', 'package', 'object', 'crawl' (a whole crawl that isn't split into tasks).
+	- callback: function(result) called in the scheduler thread after the task is done, so callbacks of a job are never run concurrently.
+	- rate_limiter: the rate limiter that the request goes through. The scheduler doesn't start the task until the limiter allows a request,
+	  and it takes the token of the first request when it starts the task.
+	- max_per_host: the max number of in-flight tasks to the host.
+	"""
+
+	def __init__(self, publisher, url, run, kind='article', callback=None, rate_limiter=None, max_per_host=2):
+		self.publisher = publisher
+		self.url = url
+		self.host = urlparse(url).netloc if url is not None else publisher
+		self.run = run
+		self.kind = kind
+		self.callback = callback
+		self.rate_limiter = rate_limiter
+		self.max_per_host = max_per_host
+		self.result = None
+
+
+	def __repr__(self):
+		return f'CrawlTask({self.publisher}, {self.kind}, {self.url})'
+
+
+class CrawlJob:
+	"""
+	A crawl (e.g., Elsevier search for XAS) given as a generator of tasks (a work generator).
+
+	Note:
+	- The generator yields CrawlTask objects, and it yields None when it needs the results of the tasks it has yielded so far
+	  (e.g., search results before article retrievals). It's resumed after all its in-flight tasks are done, and task.result has the results.
+	- The return value of the generator (e.g., doi_title) is kept in 'result'.
+	- If a task or the generator raises an exception (e.g., DownloadError), the job stops and the exception is kept in 'error'.
+	"""
+
+	def __init__(self, name, tasks, priority=0, max_concurrency=4, downloader=None):
+		self.name = name
+		self.tasks = tasks
+		self.priority = priority	# lower values go first.
+		self.max_concurrency = max_concurrency
+		self.downloader = downloader	# its quota is checked before a task is started.
+
+		self.next_task = None
+		self.in_flight = 0
+		self.num_of_dispatched = 0
+		self.is_waiting = False
+		self.is_exhausted = False
+		self.is_finished = False	# the job is done, and it's reported.
+		self.result = None
+		self.error = None
+
+
+	def peek(self):
+		""" Return the next task, or None if the job is waiting for its in-flight tasks or it has no more tasks """
+		while self.next_task is None and not self.is_exhausted:
+			if self.is_waiting:
+				if self.in_flight > 0:
+					return None
+				self.is_waiting = False
+
+			try:
+				task = next(self.tasks)
+			except StopIteration as e:
+				self.is_exhausted = True
+				self.result = e.value
+				return None
+			except Exception as e:
+				self.stop(e)
+				return None
+
+			if task is None:
+				self.is_waiting = True
+			else:
+				self.next_task = task
+
+		return self.next_task
+
+
+	def pop(self):
+		task = self.next_task
+		self.next_task = None
+		self.in_flight += 1
+		self.num_of_dispatched += 1
+
+		return task
+
+
+	def stop(self, error):
+		""" Stop the job. Tasks that are not started are dropped, and the generator is closed (its checkpoint remains for the next run). """
+		if self.error is None:
+			self.error = error
+		self.next_task = None
+		self.is_exhausted = True
+		self.tasks.close()
+
+
+	def is_done(self):
+		return self.is_exhausted and self.in_flight == 0
+
+
+class QuotaExhaustedError(Exception):
+	""" The publisher's request quota (e.g., Elsevier weekly quota) is used up. The crawl is resumed in the next quota window. """
+
+
+class CrawlScheduler:
+	"""
+	Run crawl jobs of all publishers (and other work such as figure objects) in a shared pool of workers.
+
+	Note:
+	- Tasks are interleaved across hosts. A task starts only when its host has a free slot ('max_per_host')
+	  and its rate limiter allows a request, so workers don't sit in one host's mandatory delay while another host has work ready.
+	- Jobs are ordered by priority (e.g., XAS project before COVID-19 backfill), and jobs of the same priority by the number of started tasks (fair share).
+	  A job of lower priority gets the slots that jobs of higher priority can't use (e.g., other hosts, or while they wait for search results).
+	- A job stops when its publisher's quota (e.g., 'Quota/Elsevier = 20000, 7') is used up, and the next run resumes it from the checkpoint.
+
+	References:
+	- https://en.wikipedia.org/wiki/Fair-share_scheduling
+	- https://dev.elsevier.com/api_key_settings.html
+	"""
+
+	def __init__(self, max_workers=16):
+		self.max_workers = max_workers
+		self.jobs = []
+		self.host_in_flight = {}	# key: host, value: the number of in-flight tasks
+
+
+	def add(self, name, tasks, priority=0, max_concurrency=4, downloader=None):
+		""" Add a job (a generator of tasks), and return the job (CrawlJob) """
+		job = CrawlJob(name, tasks, priority, max_concurrency, downloader)
+		self.jobs.append(job)
+
+		return job
+
+
+	def dispatch(self, executor, futures):
+		""" Start tasks that are ready, and return the delays (seconds) of the rate limiters that held tasks back """
+		delays = []
+
+		for job in sorted(self.jobs, key=lambda x: (x.priority, x.num_of_dispatched)):
+			while len(futures) < self.max_workers and job.in_flight < job.max_concurrency:
+				task = job.peek()
+				if task is None:
+					break
+
+				if job.downloader is not None and job.downloader.get_quota_remaining() is not None and job.downloader.get_quota_remaining() <= 0:
+					logger.error(f'>> <{job.name}> quota exhausted')
+					job.stop(QuotaExhaustedError(job.name))
+					break
+
+				if self.host_in_flight.get(task.host, 0) >= task.max_per_host:
+					break
+
+				delay = task.rate_limiter.try_acquire() if task.rate_limiter is not None else 0
+				if delay > 0:
+					delays.append(delay)
+					break
+
+				job.pop()
+				self.host_in_flight[task.host] = self.host_in_flight.get(task.host, 0) + 1
+				futures[executor.submit(self.run_task, task)] = (job, task)
+
+		return delays
+
+
+	@staticmethod
+	def run_task(task):
+		""" Run a task in a worker thread. Its first request uses the token taken in dispatch(). """
+		if task.rate_limiter is None:
+			return task.run()
+
+		with task.rate_limiter.reserved():
+			return task.run()
+
+
+	def complete(self, future, job, task):
+		job.in_flight -= 1
+		self.host_in_flight[task.host] -= 1
+
+		try:
+			task.result = future.result()
+			if task.callback is not None and job.error is None:
+				task.callback(task.result)
+		except Exception as e:
+			logger.error(f'>> <{job.name}> crawl stopped: {e}')
+			job.stop(e)
+
+
+	def run(self):
+		""" Run all jobs until they're done """
+		futures = {}	# key: future, value: (job, task)
+
+		start_time = time.time()
+
+		with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			while True:
+				delays = self.dispatch(executor, futures)
+
+				for job in [x for x in self.jobs if x.is_done() and not x.is_finished]:
+					job.is_finished = True
+					if job.downloader is not None:
+						job.downloader.save_quota()
+					print(f'<Scheduler> {job.name} - #Tasks: {job.num_of_dispatched}' + (f' (stopped: {job.error})' if job.error is not None else ''))
+
+				if len(futures) == 0:
+					if all(x.is_done() for x in self.jobs):
+						break
+					time.sleep(min(delays) if len(delays) > 0 else 0.1)	# all ready tasks are held back by rate limits.
+					continue
+
+				done, _ = wait(futures, timeout=min(delays) if len(delays) > 0 else None, return_when=FIRST_COMPLETED)
+				for future in done:
+					self.complete(future, *futures.pop(future))
+
+		print(f'<Scheduler> #Jobs: {len(self.jobs)} | {time.time() - start_time:.1f} sec')
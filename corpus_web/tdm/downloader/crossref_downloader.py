@@ -1,8 +1,15 @@
 import sys
+import time
 import json
+import queue
+import threading
 import requests
 from time import sleep
-from base_downloader import BaseDownloader
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import article_dir
+from document_validator import InvalidDocumentError
 import logging
 
 logger = logging.getLogger(__name__)
@@ -37,8 +44,8 @@ class CrossrefDownloader(BaseDownloader):
 	- IOP Science: https://iopscience.iop.org/info/page/text-and-data-mining
 	"""
 		
-	'''
-	pubisher_preDOIs = {
+	# DOI prefixes of publishers. It's used to route DOIs to downloaders without a lookup (see bulk_ingest.py).
+	publisher_prefixes = {
 		"Elsevier": ['10.1016', '10.1006'],
 		"RSC": ['10.1039'],
 		# Springer (Biomed Central Ltd.)	10.1186
@@ -55,8 +62,32 @@ class CrossrefDownloader(BaseDownloader):
 		"AAAS": ['10.1126'],
 		"Emerald": ['10.1108', '10.5042']
 	}
-	'''
-
+	
+	# Crossref member ids of publishers whose TDM links are used. Crossref_Member_IDs (below) selects the members to be searched.
+	member_names = {
+		'16': "APS",
+		'292': "RSC",
+		'77': "ECS",
+		'316': "ACS",
+		'311': "Wiley",
+		'221': "AAAS",
+		'140': "Emerald",
+		'266': "IOP",
+		'329': "IUCr"
+	}
+	
+	# Crossref member ids of publishers that have their own downloaders.
+	member_publishers = {
+		'78': "Elsevier",
+		'297': "Springer",
+		'16': "APS"
+	}
+	
+	max_dois = 100	# the max number of DOIs in a single works lookup (doi filters are ORed).
+	
+	cursor_expiration = 5*60	# seconds
+	max_rows = 1000	# the max number of rows in a single query.
+	
 	def __init__(self):
 		super().__init__('Crossref')
 		'''
@@ -83,168 +114,310 @@ class CrossrefDownloader(BaseDownloader):
 				'140': "Emerald"
 				}
 
-	def retrieve_articles(self, query):
+
+	def auth_headers(self, item):
+		""" Wiley TDM links need the clickthrough token. File names of items start with their member (e.g., Wiley_101002xxx). """
+		if item.filename.startswith('Wiley_'):
+			return {'CR-Clickthrough-Client-Token': self.api_key}
+		
+		return None
+
+
+	def parse_item(self, item):
+		""" Return link, member and metadata of a search result item """
+		member_id = item['member']
+		member = self.member_names.get(member_id)
+		
+		link = []
+		# In case of Wiley, only use a link with 'text-mining' of intended-application element
+		# because Wiley has links with 'unspecified' types, and one of them is just an webpage, so it replaces a pdf file with an webpage.
+		if member == 'Wiley':
+			for l in item['link']:
+				if l.get('intended-application') == 'text-mining':
+					link.append(l)
+		else:
+			link = item['link']
+		
+		metadata = {}
+		metadata['uid'] = item['DOI'] if 'DOI' in item else None
+		metadata['publisher'] = item['publisher'] if 'publisher' in item else None
+		metadata['type'] = item['type']	if 'type' in item else None	# e.g., journal-article -> https://api.crossref.org/v1/types
+		metadata['title'] = item['title'] if 'title' in item else None
+		metadata['year'] = item['issued']['date-parts'][0][0] if 'issued' in item else None
+		metadata['author'] = []
+		if 'author' in item:
+			for author in item['author']:
+				if 'family' in author:
+					name = author['given'] + ' ' if 'given' in author else ''
+					name += author['family']
+					metadata['author'].append(name)
+		metadata['abstract'] = item['abstract'] if 'abstract' in item else None
+		
+		return {'link': link, 'member': member, 'metadata': metadata}
+
+
+	def search_member(self, query, member_id, cursor, on_page, since=None):
 		'''
+		Search articles of a member using cursor deep paging, and pass each page to on_page(member_id, article_info, next_cursor).
+		next_cursor is None for the last page.
+		
+		params
+		- since: start date (datetime.date) of the delta query. Only works indexed since the date are searched.
+		
 		Parameters:
 		- row: the default number of results are returned 20 at a time. The maximum number rows you can ask for in one query is 1000.
 		- cursor: used for deep paging
 		- sort: sort the results by score (relevance), published, is-referenced-by-count, ...
 		'''
-		max_rows = 1000
-
-		selected_members = ''
-		for id in self.Crossref_Member_IDs.keys():
-			selected_members += (',member:' + id)
-		
-		params = {'query.title': query, 'rows': max_rows, 'cursor': "*", 'sort': 'score',
-				  'filter': 'has-full-text:true' + selected_members,
+		params = {'query.title': query, 'rows': self.max_rows, 'cursor': cursor, 'sort': 'score',
+				  'filter': 'has-full-text:true,member:' + member_id,
 				  'mailto': 'gpark@bnl.gov'}
-
-		article_info = {}
-				
-		""" Search articles """
-		num_queries = 0
+		
+		if since is not None:
+			params['filter'] += ',from-index-date:' + since.isoformat()
+		
 		while True:
-			num_queries += 1
+			response = self.session.get('https://api.crossref.org/works', params=params, cache_ttl=self.cache_ttl)
+			
+			if response.status_code != 200:
+				self.display_error_msg(response, self.Crossref_Member_IDs[member_id])
+				raise DownloadError(self.publisher, response)
+			
+			message = response.json()["message"]
+			
+			''' debug
+			print(json.dumps(message, indent=4, sort_keys=True))
+			print('>> total_results:', message["total-results"])
+			'''
+			
+			article_info = {}
+			for item in message["items"]:
+				doi = item["DOI"].lower()
+				info = self.parse_item(item)
+				
+				if len(info['link']) != 0:
+					article_info[doi] = info
+				else:
+					logger.error(f'>> No links - Member: {info["member"]} / DOI : {doi}')
+			
+			# the last page has fewer items than rows.
+			if len(message["items"]) < self.max_rows:
+				on_page(member_id, article_info, None)
+				break
+			
+			params['cursor'] = message['next-cursor']
+			
+			on_page(member_id, article_info, params['cursor'])
+
 
-			response = requests.get('https://api.crossref.org/works', params=params)
+	def download_article(self, doi, info):
+		link = info['link']
+		member = info['member']
+		metadata = info['metadata']
+		
+		filename = member + '_'   # filename prefix is a publisher.
+		filename += ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+		destination = article_dir(self.path + member + "/", filename)	# e.g., <archive>/Wiley/
+		
+		headers = {'User-Agent': 'Mozilla/5.0'}
+		
+		pdf_flag = False				# check if a pdf file is already donwnloaded.
+										# It's to avoid duplicate downloads for the same pdf file.
+		is_article_downloaded = False	# this is to determine if doi needs to be removed.
+		
+		for l in link:
+			url = l.get('URL')
+			type = l.get('content-type')
+			
+			ext = ''
+			if type in ['application/pdf', 'unspecified']:
+				if pdf_flag is True:
+					continue
+				ext = '.pdf'
+			elif type == 'text/xml':
+				ext = '.xml'
+			elif type == 'text/html':
+				ext = '.html'
+			elif type == 'text/plain':
+				ext = '.txt'
+			else:
+				logger.error(f'>> undefined type: {type} | Member: {member} | URL: {url}')
+				continue
+			
+			item = FetchItem(doi, url, destination, filename, ext, headers=headers)	# recorded for the retry pass if the link fails.
+			
+			try:
+				response = self.session.get(url, **self.get_request_args(item))
+			except requests.exceptions.RequestException as e:
+				logger.error(f'>> Failed to download {doi}: {e} | Member: {member} | URL: {url}')
+				self.record_failure(item, 'request error')
+				continue
 			
 			if response.status_code == 200:
-				response = response.json()
-
-				total_results = response["message"]["total-results"]
+				try:
+					self.write_to_file(response, destination, filename, ext)
+				except InvalidDocumentError as e:	# e.g., a landing page instead of a pdf file. Try the other links.
+					logger.error(f'>> Invalid document: {e.reason} | Member: {member} | URL: {url}')
+					self.record_failure(item, 'invalid document: ' + e.reason)
+					continue
 				
-				''' debug
-				print(json.dumps(response, indent=4, sort_keys=True))
-				print('>> total_results:',total_results)
-				print('>> num_queries:',num_queries)
-				'''
-
-				for item in response["message"]["items"]:
-					doi = item["DOI"].lower()
-					
-					member_id = item['member']
-					member = self.Crossref_Member_IDs.get(member_id)
-						
-					link = []
-					# In case of Wiley, only use a link with 'text-mining' of intended-application element
-					# because Wiley has links with 'unspecified' types, and one of them is just an webpage, so it replaces a pdf file with an webpage.
-					if member == 'Wiley':
-						for l in item['link']:
-							if l.get('intended-application') == 'text-mining':
-								link.append(l)
-					else:
-						link = item['link']
-					
-					if len(link) != 0:
-						
-						print(doi)
-						
-						metadata = {}
-						metadata['uid'] = item['DOI'] if 'DOI' in item else None
-						metadata['publisher'] = item['publisher'] if 'publisher' in item else None
-						metadata['type'] = item['type']	if 'type' in item else None	# e.g., journal-article -> https://api.crossref.org/v1/types
-						metadata['title'] = item['title'] if 'title' in item else None
-						metadata['year'] = item['issued']['date-parts'][0][0] if 'issued' in item else None
-						metadata['author'] = []
-						if 'author' in item:
-							for author in item['author']:
-								if 'family' in author:
-									name = author['given'] + ' ' if 'given' in author else ''
-									name += author['family']
-									metadata['author'].append(name)
-						metadata['abstract'] = item['abstract'] if 'abstract' in item else None
-
-						article_info[doi] = {'link': link, 'member': member, 'metadata': metadata}
-					else:
-						logger.error(f'>> No links - Member: {member} / DOI : {doi}')
-
-				if total_results < (num_queries*max_rows):
-					break
-
-				params['cursor'] = response['message']['next-cursor']
+				# write metadata to file
+				with open(destination + filename + '.json', 'w') as outfile:
+					json.dump(metadata, outfile)
+				
+				if ext == '.pdf':
+					pdf_flag = True
+				
+				is_article_downloaded = True
+			
+			#elif response.status_code in [401, 403, 404]:	# 401: Not Authorized | 403: Forbidden | 404: Not Found
+			#	logger.error(f'>> ERROR code: {response.status_code} | Member: {member} | URL: {url}')
+			
+			#	BaseDownloader.existing_uids.remove(doi)
+			#	BaseDownloader.to_be_saved_uids.remove(doi)
 			else:
-				self.display_error_msg(response)
-				sys.exit()
+				self.display_error_msg(response, member)
+				self.record_failure(item, response.status_code)
 		
-		duplicate_removed_uids = self.check_uids(set(article_info.keys()))   # check if it's already downloaded.
+		# articles have multiple links where some link works, but other link doesn't work.
+		# Failed links of an article that is downloaded are skipped by the retry pass since its uid is registered.
+		# e.g., "http://link.aps.org/article/10.1103/PhysRevB.66.064209" -> 401 (unauthorized error)
+		#       "http://harvest.aps.org/v2/journals/articles/10.1103/PhysRevB.66.064209/fulltext" -> works
+		if is_article_downloaded is True:
+			self.update_uid(doi)	# add a new uid only if any link works.
 
-		article_info = {k: v for k, v in article_info.items() if k in duplicate_removed_uids}
+
+	def get_prefix_member(self, prefix):
+		""" Return the Crossref member id of a DOI prefix (e.g., 10.1016 -> 78), or None if the prefix isn't registered in Crossref """
+		response = self.session.get('https://api.crossref.org/prefixes/' + prefix, params={'mailto': 'gpark@bnl.gov'}, cache_ttl=30*self.cache_ttl)
+		
+		if response.status_code == 404:	# e.g., DataCite DOIs
+			return None
+		elif response.status_code != 200:
+			self.display_error_msg(response)
+			raise DownloadError(self.publisher, response)
 		
-		print('>>> number of items:', len(article_info))
+		return response.json()["message"]["member"].rsplit('/', 1)[-1]	# e.g., http://id.crossref.org/member/78
 
+
+	def retrieve_by_dois(self, dois):
+		"""
+		Download articles of the given DOIs through their TDM links, and return the set of DOIs that are not retrieved.
+		
+		Note:
+		- Works are looked up in batches of 'max_dois' (the same filter specified multiple times is ORed).
+		"""
+		dois = list(dois)
 		
-		""" Download articles """
-		for doi, info in article_info.items():
-			link = info['link']
-			member = info['member']
-			metadata = info['metadata']
+		article_info = {}
+		for i in range(0, len(dois), self.max_dois):
+			batch = dois[i:i + self.max_dois]
+			params = {'filter': ','.join('doi:' + x for x in batch), 'rows': len(batch), 'mailto': 'gpark@bnl.gov'}
 			
-			filename = member + '_'   # filename prefix is a publisher.
-			filename += ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
-			destination = BaseDownloader.archive_path + member + "/"
-
-			headers = {'User-Agent': 'Mozilla/5.0'}
+			response = self.session.get('https://api.crossref.org/works', params=params, cache_ttl=self.cache_ttl)
 			
-			if member == 'Wiley':
-				headers['CR-Clickthrough-Client-Token'] = self.api_key
-
-			pdf_flag = False				# check if a pdf file is already donwnloaded. 
-											# It's to avoid duplicate downloads for the same pdf file.
-			is_article_downloaded = False	# this is to determine if doi needs to be removed.
+			if response.status_code != 200:
+				self.display_error_msg(response)
+				raise DownloadError(self.publisher, response)
+			
+			for item in response.json()["message"]["items"]:
+				doi = item["DOI"].lower()
+				info = self.parse_item(item)
+				
+				if info['member'] is None or len(info['link']) == 0:
+					logger.error(f'>> No links - Member: {item["member"]} / DOI : {doi}')
+					continue
+				
+				article_info[doi] = info
 
-			for l in link:
-				url = l.get('URL')
-				type = l.get('content-type')
+		with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:	# failed links are recorded for the retry pass.
+			list(executor.map(lambda x: self.download_article(x, article_info[x]), article_info.keys()))
+		
+		return self.get_missing_dois(dois)
 
-				ext = ''
-				if type in ['application/pdf', 'unspecified']:
-					if pdf_flag is True:
-						continue
-					ext = '.pdf'
-				elif type == 'text/xml':
-					ext = '.xml'
-				elif type == 'text/html':
-					ext = '.html'
-				elif type == 'text/plain':
-					ext = '.txt'
-				else:
-					logger.error(f'>> undefined type: {type} | Member: {member} | URL: {url}')
-					sys.exit()
 
-				response = requests.get(url, headers=headers)
-				if response.status_code == 200:
-					self.write_to_file(response, destination, filename, ext)
-					
-					# write metadata to file
-					with open(destination + filename + '.json', 'w') as outfile:
-						json.dump(metadata, outfile)
-
-					if ext == '.pdf':
-						pdf_flag = True
-					
-					is_article_downloaded = True
-					
-					
-					print(response.headers)
-						
-				#elif response.status_code in [401, 403, 404]:	# 401: Not Authorized | 403: Forbidden | 404: Not Found
-				#	logger.error(f'>> ERROR code: {response.status_code} | Member: {member} | URL: {url}')
-					
-				#	BaseDownloader.existing_uids.remove(doi)
-				#	BaseDownloader.to_be_saved_uids.remove(doi)
+	def retrieve_articles(self, query, since=None):
+		"""
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
+		
+		Note:
+		- Members are searched concurrently, and each member is paged with its own cursor.
+		- Items are put into the download queue as pages arrive, so downloads overlap with the search.
+		- The checkpoint keeps the cursor of each member and the queued items that are not downloaded yet.
+		  Cursors expire after five minutes of inactivity, so an old checkpoint only keeps finished members and queued items, and paging starts over.
+		"""
+		checkpoint = self.get_checkpoint(query, sorted(self.Crossref_Member_IDs.keys()), str(since))	# resume the search if the previous run died.
+		state = checkpoint.load()
+		
+		done_members = set(state.get('done_members', []))
+		pending = state.get('pending', {})	# key: DOI, value: article info (link, member, metadata) - queued but not downloaded.
+		
+		cursors = {}	# key: member id, value: next cursor
+		if 'cursors' in state and time.time() - state['saved_at'] < self.cursor_expiration:
+			cursors = state['cursors']
+		
+		doi_queue = queue.Queue()
+		lock = threading.Lock()	# guards pending, cursors, done_members and the checkpoint.
+		
+		for doi in self.remove_duplicates(set(pending.keys())):	# resume queued items that are not downloaded yet.
+			doi_queue.put(doi)
+		
+		def on_page(member_id, article_info, next_cursor):
+			with lock:
+				new_uids = self.remove_duplicates(set(article_info.keys()).difference(pending.keys()))   # check if it's already downloaded or queued.
+				
+				for doi in new_uids:
+					pending[doi] = article_info[doi]
+					doi_queue.put(doi)
+				
+				if next_cursor is None:
+					done_members.add(member_id)
+					cursors.pop(member_id, None)
 				else:
-					self.display_error_msg(response, member)
-					#sys.exit()
-			
-			# articles have multiple links where some link works, but other link doesn't work.
-			# e.g., "http://link.aps.org/article/10.1103/PhysRevB.66.064209" -> 401 (unauthorized error)
-			#       "http://harvest.aps.org/v2/journals/articles/10.1103/PhysRevB.66.064209/fulltext" -> works
-			if is_article_downloaded is False:
-				if doi in BaseDownloader.existing_uids:
-					BaseDownloader.existing_uids.remove(doi)
-				if doi in BaseDownloader.to_be_saved_uids:
-					BaseDownloader.to_be_saved_uids.remove(doi)
-					
-					
-		self.save_uids()    # save new uids in the uid file.
+					cursors[member_id] = next_cursor
+				
+				checkpoint.save(cursors=cursors, done_members=list(done_members), pending=pending)
+		
+		def download_worker():
+			while True:
+				doi = doi_queue.get()
+				if doi is None:
+					break
+				
+				with lock:
+					info = pending[doi]
+				
+				self.download_article(doi, info)	# failed links are recorded for the retry pass.
+				
+				with lock:
+					pending.pop(doi, None)
+		
+		""" Search and download articles """
+		workers = [threading.Thread(target=download_worker) for _ in range(self.max_concurrency)]
+		for w in workers:
+			w.start()
+		
+		members = [x for x in self.Crossref_Member_IDs.keys() if x not in done_members]
+		errors = []
+		
+		with ThreadPoolExecutor(max_workers=max(len(members), 1)) as executor:
+			futures = {executor.submit(self.search_member, query, x, cursors.get(x, '*'), on_page, since): x for x in members}
+			
+			for future in as_completed(futures):
+				try:
+					future.result()
+				except (DownloadError, requests.exceptions.RequestException) as e:	# the other members continue.
+					logger.error(f'>> Search failed - Member: {self.Crossref_Member_IDs[futures[future]]} ({e})')
+					errors.append(e)
+		
+		for w in workers:
+			doi_queue.put(None)
+		for w in workers:
+			w.join()
+		
+		if len(errors) > 0:
+			checkpoint.save(cursors=cursors, done_members=list(done_members), pending=pending)
+			raise errors[0]	# the checkpoint remains, so the next run resumes the failed members.
+		
+		checkpoint.clear()
@@ -0,0 +1,101 @@
+from lxml import etree
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidDocumentError(Exception):
+	""" A downloaded document is not valid (e.g., an error page, a truncated XML), so it's not committed to the archive """
+
+	def __init__(self, reason):
+		super().__init__(reason)
+		self.reason = reason
+
+
+class DocumentValidator:
+	"""
+	Check a document while it's written, chunk by chunk, so the document is read once.
+
+	Note:
+	- XML documents are fed to an incremental parser (well-formedness check), and parsed elements are freed as they end,
+	  so memory doesn't grow with the document size. A truncated document fails when the parser is closed.
+	- PDF documents must start with the PDF header and end with the end-of-file marker.
+	- The content type of the response must match the extension (e.g., publishers return error pages as text/html with 200),
+	  and the size must be the same as Content-Length (if the body isn't content-encoded) and not less than 'min_size'.
+
+	References:
+	- https://lxml.de/parsing.html#incremental-event-parsing
+	- https://opensource.adobe.com/dc-acrobat-sdk-docs/pdfstandards/PDF32000_2008.pdf (7.5.2 File Header, 7.5.5 File Trailer)
+	"""
+
+	min_size = 64	# bytes
+
+	# expected content types of extensions. Other extensions (e.g., .json) are checked only for size.
+	content_types = {
+		'.xml': ['xml'],
+		'.nxml': ['xml'],
+		'.html': ['html'],
+		'.pdf': ['pdf', 'octet-stream'],
+		'.zip': ['zip', 'octet-stream'],
+	}
+
+	def __init__(self, extension, content_type=None, content_length=None):
+		self.extension = extension
+		self.content_type = content_type
+		self.content_length = content_length
+		self.size = 0
+		self.head = b''
+		self.tail = b''
+
+		self.xml_parser = None
+		if extension in ['.xml', '.nxml']:
+			self.xml_parser = etree.XMLPullParser(events=('end',), huge_tree=True)
+
+		if content_type is not None and extension in self.content_types:
+			if not any(x in content_type.lower() for x in self.content_types[extension]):
+				raise InvalidDocumentError(f'unexpected content type for {extension}: {content_type}')
+
+
+	def feed(self, chunk):
+		self.size += len(chunk)
+
+		if len(self.head) < 8:
+			self.head += chunk[:8]
+		self.tail = (self.tail + chunk)[-1024:]
+
+		if self.xml_parser is not None:
+			try:
+				self.xml_parser.feed(chunk)
+				for _, elem in self.xml_parser.read_events():
+					elem.clear()
+					parent = elem.getparent()
+					if parent is None:	# e.g., a comment or processing instruction before the root element.
+						continue
+					while elem.getprevious() is not None:	# free the preceding siblings as well.
+						del parent[0]
+			except etree.XMLSyntaxError as e:
+				raise InvalidDocumentError(f'malformed XML: {e}')
+
+
+	def close(self):
+		""" Finish the check. It raises InvalidDocumentError if the document isn't valid. """
+		if self.size < self.min_size:
+			raise InvalidDocumentError(f'too small: {self.size} bytes')
+
+		if self.content_length is not None and self.size != self.content_length:
+			raise InvalidDocumentError(f'truncated: {self.size} / {self.content_length} bytes')
+
+		if self.xml_parser is not None:
+			try:
+				self.xml_parser.close()
+			except etree.XMLSyntaxError as e:
+				raise InvalidDocumentError(f'malformed XML: {e}')
+
+		if self.extension == '.pdf':
+			if not self.head.startswith(b'%PDF-'):
+				raise InvalidDocumentError('no PDF header')
+			if b'%%EOF' not in self.tail:
+				raise InvalidDocumentError('no PDF end-of-file marker')
+
+		if self.extension == '.zip' and not self.head.startswith(b'PK'):
+			raise InvalidDocumentError('no ZIP signature')
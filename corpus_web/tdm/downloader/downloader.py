@@ -5,7 +5,9 @@ import json
 import requests
 import csv
 from datetime import date
+import logging
 
+from base_downloader import DownloadError
 from pmc_downloader import PMCDownloader
 from elsevier_downloader import ElsevierDownloader
 from springer_downloader import SpringerDownloader
@@ -14,6 +16,8 @@ from aaas_downloader import AAASDownloader
 from aps_downloader import APSDownloader
 from crossref_downloader import CrossrefDownloader
 from osti_downloader import OSTIDownloader
+from object_fetcher import ObjectFetcher
+from crawl_scheduler import CrawlScheduler, QuotaExhaustedError
 
 '''
 import chemdataextractor.scrape.pub.rsc as RSC
@@ -23,6 +27,8 @@ from chemdataextractor.doc import Document
 from chemdataextractor.reader.rsc import RscHtmlReader
 '''
 
+logger = logging.getLogger(__name__)
+
 
 def set_query(project):
 	terms = []
@@ -156,11 +162,9 @@ def download_APS(query):
 	ad = APSDownloader()
 	#for q in qs:
 	#	ad.retrieve_articles(q)
-	#ad.retrieve_all_open_access_articles()
-
-	# debug - the following request hangs and causes an 502 Bad Gateway error!!
-	response = requests.get('http://harvest.aps.org/v2/journals/articles?page=20&per_page=100&set=openaccess')
-	print(response.headers)
+	
+	# pages that hang (e.g., page 20 -> 502 Bad Gateway error) time out and are retried, and the rest are fetched in the next run.
+	ad.retrieve_all_open_access_articles()
 
 
 def update_download_result(download_history_file, doi_title, publisher=None):
@@ -180,62 +184,222 @@ def update_download_result(download_history_file, doi_title, publisher=None):
 				writer.writerow([publisher, title, "https://doi.org/" + doi])
 
 
-def update_lit_stat(lit_stat, publisher):
-	path = '/home/gpark/corpus_web/tdm/archive/' + publisher
-	num_of_papers = 0
-	for root, dirs, files in os.walk(path):
-		num_of_papers += len(dirs)
-	lit_stat[publisher] = num_of_papers
+def update_lit_stat(lit_stat, publisher, num_of_new_papers):
+	"""
+	Add the number of newly registered articles to the statistics.
+	The counts are maintained by the UID registry (stats table), so the archive directory is not walked.
+	"""
+	lit_stat[publisher] = lit_stat.get(publisher, 0) + num_of_new_papers
+		
+
+def run_downloader(downloader, *args, project=None, **kwargs):
+	"""
+	Run a downloader, and return doi_title.
+	
+	Note:
+	- An error of a publisher (e.g., an outage) is logged instead of stopping the whole run, so the other publishers continue.
+	  The checkpoint of the failed crawl remains, so the next run resumes it.
+	- Failed items recorded by the previous run are retried first.
+	- If a project is given, only the delta since the project's watermark is searched,
+	  and the watermark moves to the start date of this run only if the crawl succeeds.
+	"""
+	start_date = date.today()
+	
+	try:
+		downloader.retry_failures()
+		
+		if project is not None:
+			downloader.project = project
+			kwargs['since'] = downloader.load_watermark(project)
+			print(f'<{downloader.publisher}> {project} - since:', kwargs['since'])
+		
+		doi_title = downloader.retrieve_articles(*args, **kwargs)
+	except (DownloadError, requests.exceptions.RequestException, QuotaExhaustedError) as e:
+		logger.error(f'>> <{downloader.publisher}> crawl stopped: {e}')
+		return {}
+	
+	if project is not None:
+		downloader.save_watermark(project, start_date)
+	
+	return doi_title
+
+
+def iter_crawl_tasks(downloader, *args, project=None, **kwargs):
+	"""
+	Yield tasks of a crawl, and return doi_title. It's the work generator version of run_downloader() for the crawl scheduler.
+	An error stops the generator, so the watermark moves only if the crawl succeeds.
+	"""
+	start_date = date.today()
+	
+	yield from downloader.iter_retry_tasks()
+	
+	if project is not None:
+		downloader.project = project
+		kwargs['since'] = downloader.load_watermark(project)
+		print(f'<{downloader.publisher}> {project} - since:', kwargs['since'])
+	
+	doi_title = yield from downloader.iter_tasks(*args, **kwargs)
+	
+	if project is not None:
+		downloader.save_watermark(project, start_date)
+	
+	return doi_title
+
+
+def run_crawls(jobs, parallel=True, object_fetcher=None):
+	"""
+	Run crawl jobs, and return the list of doi_title in the same order as jobs.
+	
+	params
+	- jobs: list of (downloader, args, kwargs). kwargs can have 'priority' (lower values go first, e.g., XAS project before COVID-19 backfill).
+	- object_fetcher: if given, queued objects (e.g., figures) are fetched along with the crawls at the lowest priority.
+	
+	Note:
+	- All crawls are work generators (iter_tasks()) run by one scheduler (see CrawlScheduler), so requests are interleaved across hosts
+	  within each publisher's rate limit and quota. Each downloader has its own session and rate limiter, and the UID registry is shared through SQLite.
+	- Crawls of the same publisher for different projects need different downloaders that share a session (see BaseDownloader.share_session()).
+	"""
+	if not parallel:
+		return [run_downloader(downloader, *args, **{k: v for k, v in kwargs.items() if k != 'priority'}) for downloader, args, kwargs in jobs]
+	
+	scheduler = CrawlScheduler()
+	
+	crawl_jobs = []
+	for downloader, args, kwargs in jobs:
+		kwargs = dict(kwargs)
+		priority = kwargs.pop('priority', 0)
+		name = downloader.publisher + (f'/{kwargs["project"]}' if kwargs.get('project') is not None else '')
 		
+		crawl_jobs.append(scheduler.add(name, iter_crawl_tasks(downloader, *args, **kwargs), priority, downloader.max_concurrency, downloader))
+	
+	if object_fetcher is not None:
+		scheduler.add('Objects', object_fetcher.iter_tasks(), max(x.priority for x in crawl_jobs) + 1, object_fetcher.max_concurrency)
+	
+	scheduler.run()
+	
+	return [x.result if x.error is None and x.result is not None else {} for x in crawl_jobs]
+
+
+def run_workers(publishers, watch=False):
+	"""
+	Retrieve articles in the shared crawl frontier (see CrawlFrontier) along with other worker processes and machines.
+	
+	Usage:
+	- python downloader.py --worker [--watch] <publisher> [<publisher> ...]	# e.g., python downloader.py --worker Elsevier Springer
+	
+	Note:
+	- Searches are done by the main run, which adds articles to the frontier. Workers only claim and retrieve the articles.
+	  Each machine can use its own info file (TDM_INFO_FILE), e.g., its own API keys and rate limits, with the shared frontier, registry and archive.
+	- A worker stops when the frontier has no pending or leased items of its publishers (or keeps polling with --watch).
+	  Items leased by a dead worker are claimed again after their leases expire, and a stopped worker releases its leases.
+	"""
+	downloader_classes = {x.__name__.replace('Downloader', ''): x for x in [ElsevierDownloader, SpringerDownloader, RSCDownloader, PMCDownloader, 
+																		AAASDownloader, APSDownloader, CrossrefDownloader, OSTIDownloader]}
+	
+	downloaders = [downloader_classes[x]() for x in publishers]
+	for downloader in downloaders:
+		if downloader.frontier is None:
+			raise ValueError(f'<{downloader.publisher}> no frontier - set Frontier in the info file.')
+	
+	try:
+		while True:
+			scheduler = CrawlScheduler()
+			for downloader in downloaders:
+				scheduler.add(downloader.publisher, downloader.iter_frontier_tasks(), 0, downloader.max_concurrency, downloader)
+			scheduler.run()
+			
+			if not watch and not any(x.frontier.has_work(x.publisher) for x in downloaders):
+				break
+			
+			time.sleep(downloaders[0].poll_interval)	# wait for new items, or leases of other workers.
+	finally:
+		for downloader in downloaders:
+			num_of_released = downloader.frontier.release(downloader.worker_id)
+			if num_of_released > 0:
+				print(f'<{downloader.publisher}> {num_of_released} leased items are released.')
+	
+	for downloader in downloaders:
+		for (publisher, status), cnt in sorted(downloader.frontier.get_stats(downloader.publisher).items()):
+			print(f'<{publisher}> {status}: {cnt}')
+
 
 def main():
 	start_time = time.time()
 	
+	if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+		run_workers([x for x in sys.argv[2:] if x != '--watch'], '--watch' in sys.argv)
+		print("--- %s seconds ---" % (time.time() - start_time))
+		return
+	
 	# set queries based on project: 'XAS', 'GENESIS', 'COVID-19'
-	project = 'XAS'
-	keywords, query = set_query(project)
-	year = 2020
-	#year = None
-	
-	# instantiate downloaders
-	ed = ElsevierDownloader()
-	sd = SpringerDownloader()
-	rd = RSCDownloader()
-	pd = PMCDownloader()
-	aaasd = AAASDownloader()
+	# projects are in priority order, e.g., ['XAS', 'COVID-19'] -> XAS articles are retrieved before the COVID-19 backfill.
+	projects = ['XAS']
+	#year = 2020
+	year = None	# recency is handled by the watermarks of the project.
+	
+	parallel = True	# run publisher crawls concurrently.
+	fetch_objects = False	# fetch queued objects (e.g., figures) along with the crawls.
+	
+	downloader_classes = [ElsevierDownloader, SpringerDownloader, RSCDownloader, PMCDownloader, AAASDownloader]
+	
+	# instantiate downloaders per project. Downloaders of a publisher share a session, so they share its rate limit and quota.
+	downloaders = {}	# key: project, value: dict of key: downloader class - value: downloader
+	for project in projects:
+		downloaders[project] = {x: x() for x in downloader_classes}
+		
+		for cls, downloader in downloaders[project].items():
+			if project != projects[0]:
+				downloader.share_session(downloaders[projects[0]][cls])
 
 	fdate = date.today().strftime('%m-%d-%Y')
-	download_history_file = '/home/gpark/corpus_web/tdm/archive/download_history/' + project + '/' + fdate + '.csv'
 
 	with open('/home/gpark/corpus_web/tdm/archive/lit_stat.json', "r") as fp:	# load literature statistics.
 		lit_stat = json.load(fp)
 
-	# TODO: change it to sending the whole query once. query above syntax doesn't work, and OR doesn't work in search. 
-	doi_title = aaasd.retrieve_articles(keywords, year, enable_sleep=False)
-	update_download_result(download_history_file, doi_title, publisher='AAAS/Science')
-	update_lit_stat(lit_stat, 'AAAS')
+	ed = downloaders[projects[0]][ElsevierDownloader]
+	registry_stats = ed.uid_registry.get_stats()	# the number of articles per publisher before crawling.
 	
-	doi_title = ed.retrieve_articles(query, year)
-	update_download_result(download_history_file, doi_title, publisher='Elsevier')
-	update_lit_stat(lit_stat, 'Elsevier')
+	# (downloader, args, kwargs, publisher name in download history, download history file)
+	jobs = []
+	pmc_jobs = []
+	for priority, project in enumerate(projects):
+		keywords, query = set_query(project)
+		download_history_file = '/home/gpark/corpus_web/tdm/archive/download_history/' + project + '/' + fdate + '.csv'
+		
+		aaasd, ed, sd, rd, pd = [downloaders[project][x] for x in [AAASDownloader, ElsevierDownloader, SpringerDownloader, RSCDownloader, PMCDownloader]]
+		
+		jobs.extend([
+			# TODO: change it to sending the whole query once. query above syntax doesn't work, and OR doesn't work in search. 
+			(aaasd, (keywords, year), {'project': project, 'priority': priority}, 'AAAS/Science', download_history_file),
+			(ed, (query, year), {'project': project, 'priority': priority}, 'Elsevier', download_history_file),
+			(sd, (query, year), {'project': project, 'priority': priority}, 'Springer Nature', download_history_file),
+			(rd, (query,), {'project': project, 'priority': priority}, 'RSC', download_history_file),	# TODO: test more!!!
+		])
+		
+		pmc_jobs.append((pd, (query, year), {'project': project, 'priority': priority}, 'PMC', download_history_file))
 	
-	doi_title = sd.retrieve_articles(query, year)
-	update_download_result(download_history_file, doi_title, publisher='Springer Nature')
-	update_lit_stat(lit_stat, 'Springer')
-
-	doi_title = rd.retrieve_articles(query)	# TODO: handle year!!
-	update_download_result(download_history_file, doi_title, publisher='RSC')	# TODO: test more!!!
-	update_lit_stat(lit_stat, 'RSC')
+	results = run_crawls([x[:3] for x in jobs], parallel, ObjectFetcher() if fetch_objects else None)
 	
 	# download PMC articles last since it contains other publishers' articles.
-	doi_title = pd.retrieve_articles(query, year)
-	update_download_result(download_history_file, doi_title, publisher='PMC')
-	update_lit_stat(lit_stat, 'PMC')
+	# The other crawls are finished and their uids are in the registry at this point, so PMC skips them.
+	jobs.extend(pmc_jobs)
+	results.extend(run_crawls([x[:3] for x in pmc_jobs], parallel))
+	
+	# merge the results into the download history and the statistics.
+	new_registry_stats = ed.uid_registry.get_stats()
+	
+	for (downloader, _, _, publisher, download_history_file), doi_title in zip(jobs, results):
+		update_download_result(download_history_file, doi_title, publisher=publisher)
+	
+	for downloader in downloaders[projects[0]].values():	# the registry counts articles per publisher (archive directory).
+		update_lit_stat(lit_stat, downloader.publisher, new_registry_stats.get(downloader.publisher, 0) - registry_stats.get(downloader.publisher, 0))
 	
 	sorted_lit_stat = {k: v for k, v in sorted(lit_stat.items(), key=lambda x: x[1], reverse=True)}
 	
-	with open('/home/gpark/corpus_web/tdm/archive/lit_stat.json', "w") as fp:	# save updated literature statistics.
+	# save updated literature statistics. It's replaced at once, so the web server never reads a partially written file.
+	with open('/home/gpark/corpus_web/tdm/archive/lit_stat.json.tmp', "w") as fp:
 		json.dump(sorted_lit_stat, fp)
+	os.replace('/home/gpark/corpus_web/tdm/archive/lit_stat.json.tmp', '/home/gpark/corpus_web/tdm/archive/lit_stat.json')
 	
 	'''
 	download_APS(query)
@@ -1,10 +1,13 @@
 import os
 import sys
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import json
+import functools
 import requests
-from time import sleep
-from base_downloader import BaseDownloader
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import article_dir
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,7 +18,7 @@ class ElsevierDownloader(BaseDownloader):
 	Note:
 	- For performance reasons, a search request returns up to 200 results in a single response.
 	  Multiple requests can be used to collate more than 200 results -> the new version indicates that the max value is 100
-	- The max offset value is 6000, so if total results exceeed the number, then work-around it by spliting the number of results using date.
+	- The max offset value is 6000, so if total results exceeed the number, then work-around it by spliting the search into partitions (date ranges, years, query terms).
 	- PUT method (cf. GET) is highly recommended for ScienceDirect Search API.
 	- Don't use title for filename since titles contain special characters. Instead, use PII for filenames.
 	- Use PII (Elsevier's own internal document identifier) to collate articles instead of DOI because not all articles have a DOI.
@@ -28,13 +31,30 @@ class ElsevierDownloader(BaseDownloader):
 	- https://dev.elsevier.com/support.html
 	- https://dev.elsevier.com/tecdoc_text_mining.html
 	- https://dev.elsevier.com/tips/ScienceDirectSearchTips.htm
+	- https://dev.elsevier.com/api_key_settings.html
 	"""
-
+	
+	'''
+	consecutive requests without delay causes 429 error even though rate limit doesn't exceeds (check the limit in headers - 'X-RateLimit-Remaining')
+		<error-code>RATE_LIMIT_EXCEEEDED</error-code> 
+		<error-message>Rate of requests exceeds specified limits. Recommend lowering request rate and/or concurrency of requests.</error-message>
+	The rate limiter throttles requests to the throttling rate of the API, and it backs off when this 429 error occurs.
+	'''
+	requests_per_sec = 2
+	
+	search_url = "https://api.elsevier.com/content/search/sciencedirect"
+	max_rows = 100		# the max number of results in a single response.
+	max_offset = 6000	# the max offset value of the search API.
+	first_year = 1823	# the oldest publication year in ScienceDirect (The Lancet).
 	
 	def __init__(self):
 		super().__init__('Elsevier')
 
 	
+	def auth_headers(self, item):
+		return {'X-ELS-APIKEY': self.api_key}
+
+
 	def get_uid(self, response, uid, doi_title):
 		if "results" in response:
 			for item in response["results"]:
@@ -47,197 +67,261 @@ class ElsevierDownloader(BaseDownloader):
 					doi_title[item["doi"].lower()] = item["title"]
 
 
-	def retrieve_articles(self, query, year):
+	def search(self, partition, offset=0):
+		""" Search a partition (e.g., {'qs': query, 'date': '2019'}) from the offset, and return the JSON response """
 		search_headers = {'X-ELS-APIKEY': self.api_key,
 						  'Content-Type': 'application/json',
 						  'Accept': 'application/json'}
+		
+		params = dict(partition)
+		params['display'] = {'offset': offset, 'show': self.max_rows, 'sortBy': 'relevance'}
+		
+		# data must be json formatted.
+		s_response = self.session.put(self.search_url, headers=search_headers, data=json.dumps(params), cache_ttl=self.cache_ttl)	# search response
+		
+		if s_response.status_code != 200:
+			self.display_error_msg(s_response)
+			raise DownloadError(self.publisher, s_response)
+		
+		s_response = s_response.json()
+		
+		logger.debug(json.dumps(s_response, indent=4, sort_keys=True))
+		
+		return s_response
+
+
+	def split_partition(self, partition):
+		"""
+		Split a partition into sub-partitions that together cover the same results, or return None if it can't be split.
+		
+		Note:
+		- No date -> the whole date range, a date range (e.g., '2001-2020') -> two halves, a single year -> each OR term of the query.
+		  The API takes only years (or year ranges) for 'date', so a year can't be split by month.
+		"""
+		date = partition.get('date')
+		
+		if date is None:
+			return [dict(partition, date=f'{self.first_year}-{datetime.now().year + 1}')]	# some publications are released in the following year.
+		
+		if '-' in date:
+			start, end = [int(x) for x in date.split('-')]
+			mid = (start + end) // 2
+			return [dict(partition, date=self.date_range(start, mid)), dict(partition, date=self.date_range(mid + 1, end))]
+		
+		qs = partition['qs'].strip()
+		if qs.startswith('(') and qs.endswith(')'):
+			qs = qs[1:-1]
+		
+		terms = [x.strip() for x in qs.split(' OR ')]
+		if len(terms) > 1:
+			return [dict(partition, qs=x) for x in terms]
+		
+		return None
+
+
+	def date_range(self, start, end):
+		return str(start) if start == end else f'{start}-{end}'
+
+
+	def find_loaded_after(self, partition):
+		"""
+		Find the earliest 'loadedAfter' date with which the partition has results under the offset cap (binary search by day).
+		It's the last resort for a partition that can't be split, and results loaded before the date are not reachable.
+		"""
+		year = int(partition['date'])
+		lo = datetime(year - 1, 1, 1)	# articles are loaded to ScienceDirect before/after the publication year.
+		hi = datetime.now()
+		
+		while (hi - lo).days > 1:
+			mid = lo + (hi - lo) / 2
+			if self.search(dict(partition, loadedAfter=mid.isoformat(timespec='seconds') + 'Z'))['resultsFound'] > self.max_offset:	# Z is utc timezone
+				lo = mid
+			else:
+				hi = mid
+		
+		return dict(partition, loadedAfter=hi.isoformat(timespec='seconds') + 'Z')
+
 
-		max_rows = 100
+	def get_partitions(self, partition):
+		"""
+		Split a search into partitions each of which has results under the offset cap, and return list of (partition, first page).
+		
+		Note:
+		- Partitions are refined level by level, and the searches of a level are sent concurrently.
+		- The first page of a partition is the response of its count request, so it's not requested again.
+		"""
+		partitions = []
+		frontier = [partition]
+		
+		with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+			while len(frontier) > 0:
+				next_frontier = []
+				for p, s_response in zip(frontier, executor.map(self.search, frontier)):
+					total_results = s_response["resultsFound"]
+					
+					if total_results == 0:
+						continue
+					
+					if total_results <= self.max_offset:
+						partitions.append((p, s_response))
+						continue
+					
+					sub_partitions = self.split_partition(p)
+					if sub_partitions is not None:
+						next_frontier.extend(sub_partitions)
+						continue
+					
+					p = self.find_loaded_after(p)
+					s_response = self.search(p)
+					logger.warning(f'>> {total_results - s_response["resultsFound"]} results of {p} loaded before {p["loadedAfter"]} are skipped (offset cap: {self.max_offset})')
+					partitions.append((p, s_response))
+				
+				frontier = next_frontier
+		
+		return partitions
+
+
+	def search_partition(self, partition, s_response=None):
+		""" Collect uids of all results of a partition, and return uid, doi_title """
+		uid = {}		# key: PII, value: either DOI or PII (if DOI doesn't exist)
+		doi_title = {}
+		
+		if s_response is None:
+			s_response = self.search(partition)
+		
+		self.get_uid(s_response, uid, doi_title)
+		
+		for offset in range(self.max_rows, s_response["resultsFound"], self.max_rows):
+			self.get_uid(self.search(partition, offset), uid, doi_title)
+		
+		return uid, doi_title
+
+
+	def retrieve_by_dois(self, dois):
+		"""
+		Download articles of the given DOIs (e.g., a DOI list from collaborators), and return the set of DOIs that are not retrieved (see get_missing_dois()).
+		
+		Note:
+		- PIIs of the articles are unknown without a search, so DOIs (special characters removed) are used for dir/file names.
+		"""
+		dois = list(dois)
+		
+		items = []
+		for doi in dois:
+			file = ''.join(i for i in doi if i.isalnum()).lower()   # special characters are removed for filenames.
+			
+			items.append(FetchItem(doi, "https://api.elsevier.com/content/article/doi/" + doi, article_dir(self.path, file), file, ".xml"))
+		
+		self.fetch_articles(items)	# failed articles are recorded, and retried in the next run.
+		
+		return self.get_missing_dois(dois)
+
+
+	def retrieve_articles(self, query, year, since=None):
+		"""
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
+		  Only articles loaded to ScienceDirect after the date are searched.
+		
+		Note:
+		- It runs the work generator (iter_tasks()) of the crawl alone. The downloader script runs the generators of all publishers in a shared scheduler.
+		"""
+		return self.run_tasks(self.iter_tasks(query, year, since))
+
+
+	def iter_tasks(self, query, year, since=None):
+		"""
+		Yield tasks (CrawlTask) of a crawl, and return doi_title.
+		
+		Note:
+		- The search is split into partitions under the offset cap (see get_partitions()), and each partition is searched by a task,
+		  so the partitions are searched concurrently within the rate limit. The checkpoint keeps the partitions that are not searched yet.
+		- The same paper can appear in more than one partition (e.g., OR terms), and it's merged by PII.
+		- After all partitions are searched, each new article is retrieved by a task.
 		
-		'''
 		Parameters
 		- qs: The general search field for searching over all article / book chapter content (excluding references)
 		- '&subscribed=true' parameter doesn't work in search request
-		'''
-		params = {'qs': query,
-				  'display': {
-					  'offset': 0,
-					  'show': max_rows,
-					  'sortBy': 'relevance'
-					  }
-				 }
+		"""
+		partition = {'qs': query}
 		
 		if year is not None:
-			params['date'] = str(year)
+			partition['date'] = str(year)
 		
-		search_url = "https://api.elsevier.com/content/search/sciencedirect"
-
-		is_date_field_needed = False
-		s_response = requests.put(search_url, headers=search_headers, data=json.dumps(params))	# search response
+		if since is not None:
+			partition['loadedAfter'] = datetime(since.year, since.month, since.day).isoformat() + 'Z'	# Z is utc timezone
+		
+		checkpoint = self.get_checkpoint(query, year, str(since))	# resume the search if the previous run died.
+		state = checkpoint.load()
+		
+		uid = state.get('uid', {})				# key: PII, value: either DOI or PII (if DOI doesn't exist)
+		doi_title = state.get('doi_title', {})	# this is to save the history of downloads.
 		
-		if s_response.status_code == 200:
-			s_response = s_response.json()
+		if not state.get('search_done', False):
+			if 'partitions' in state:
+				partitions = [(x, None) for x in state['partitions']]
+			else:
+				task = self.make_task(self.search_url, functools.partial(self.get_partitions, partition), 'search')
+				yield task
+				yield None	# wait for the partitions.
+				partitions = task.result
 			
-			total_results = s_response["resultsFound"]	# check the number of results of the given query.
-			accumulated_results = 0
-			if total_results > 6000:    # offset max value is 6000. If the total results exceed the number, split results by year.
-				is_date_field_needed = True
-				current_date_time = datetime.now()
-				current_year = current_date_time.year + 1	# start searching from the following year (e.g., current year 2019, then 2020) because some publications are released in the following year.
-				params['date'] = str(current_year)
+			remaining = [x[0] for x in partitions]
 			
-			uid = {}		# key: PII, value: either DOI or PII (if DOI doesn't exist)
-			doi_title = {}	# this is to save the history of downloads.
+			print('<Elsevier> #Partitions:', len(remaining))
 			
-			finish_search = False # used for COVID-19 project
-
-			while True:
-				num_queries = 0
-				while True:
-					num_queries += 1
-					
-					'''
-					consecutive requests without delay causes 429 error even though rate limit doesn't exceeds (check the limit in headers - 'X-RateLimit-Remaining')
-						<error-code>RATE_LIMIT_EXCEEEDED</error-code> 
-						<error-message>Rate of requests exceeds specified limits. Recommend lowering request rate and/or concurrency of requests.</error-message>
-					Adding a time delay can avoid this 429 error.
-					'''
-					sleep(1)
-
-					# data must be json formatted.
-					s_response = requests.put(search_url, headers=search_headers, data=json.dumps(params))
-
-					if s_response.status_code == 200:
-						s_response = s_response.json()
-
-						logger.debug(json.dumps(s_response, indent=4, sort_keys=True))
-
-						if s_response["resultsFound"] == 0:
-							break
-						
-						""" START - Special case of COVID-19
-						The number of COVID related articles exceeds 6000 in 2020. 
-						So, retrieve the most recent articles up to 6000 by month.
-						"""
-						total_results_in_year = s_response["resultsFound"]	# debugging
-						accumulated_results_in_year = 0		# debugging
-						if total_results_in_year > 6000:    # offset max value is 6000
-							params['date'] = None
-							params['sortBy'] = 'date'
-							params['loadedAfter'] = datetime(current_year, current_date_time.month, 1).isoformat() # year, month, day
-							params['loadedAfter'] += 'Z'	# Z is utc timezone
-							params['display']['offset'] = 0	# reset offset
-							
-							num_queries_in_month = 0
-							
-							while True:
-								num_queries_in_month += 1
-								
-								sleep(1)
-								s_r_by_month = requests.put(search_url, headers=search_headers, data=json.dumps(params)) # search response by month
-
-								if s_r_by_month.status_code == 200:
-									s_r_by_month = s_r_by_month.json()
-
-									logger.debug(json.dumps(s_r_by_month, indent=4, sort_keys=True))
-
-									if s_r_by_month["resultsFound"] == 0:
-										break
-									
-									self.get_uid(s_r_by_month, uid, doi_title)
-
-									if s_r_by_month["resultsFound"] <= (num_queries_in_month*max_rows):
-										break
-										
-									params['display']['offset'] += max_rows
-									
-									if params['display']['offset'] > 6000:
-										break
-								else:
-									self.display_error_msg(s_r_by_month)
-									sys.exit()
-							
-							# debugging
-							accumulated_results_in_year += s_r_by_month["resultsFound"]
-							print('total_results_in_year:', total_results_in_year, ' / accumulated_results_in_year:', accumulated_results_in_year, ' / loadedAfter:', params['loadedAfter'])
-							print('len(uid):', len(uid), ' / len(doi_title):', len(doi_title))
-							
-							finish_search = True
-							break
-							""" END - Special case of COVID-19 """
-						else:
-							self.get_uid(s_response, uid, doi_title)
-						
-						if s_response["resultsFound"] <= (num_queries*max_rows):
-							break
-
-						params['display']['offset'] += max_rows
-					else:
-						self.display_error_msg(s_response)
-						sys.exit()
-				
-				if finish_search:	# used for COVID-19 project
-					break
-				
-				accumulated_results += s_response["resultsFound"]
-				
-				'''
-				TODO: total_results must be the same as accumulated_results, but for some reason, they are different.
-				A possible reason is that the same paper appears in different years. 
-				'''
-				print('total_results:', total_results, ' / accumulated_results:', accumulated_results, ' / date:', params['date'])
-				if is_date_field_needed == False or total_results <= accumulated_results:
-					break
+			def on_searched(i, result):	# called in the scheduler thread, so the checkpoint is saved by one thread.
+				uid.update(result[0])
+				doi_title.update(result[1])
 				
-				current_year -= 1	# decrease date until it finds all articles.
-				params['date'] = str(current_year)
-				params['display']['offset'] = 0	# reset offset
+				remaining[i] = None
+				checkpoint.save(partitions=[x for x in remaining if x is not None], uid=uid, doi_title=doi_title)
 			
+			for i, (p, s_response) in enumerate(partitions):
+				yield self.make_task(self.search_url, functools.partial(self.search_partition, p, s_response), 'search', functools.partial(on_searched, i))
 			
-			print('<Elsevier> #UIDs w/  duplicates:', len(uid))
+			yield None	# wait for the searches.
+			
+			checkpoint.save(search_done=True, uid=uid, doi_title=doi_title)	# if downloads fail, the next run skips the search.
+		
+		print('<Elsevier> #UIDs w/  duplicates:', len(uid))
 
-			duplicate_removed_uid = self.remove_duplicates(set(uid.values()))   # skip already downloaded articles.
+		duplicate_removed_uid = self.remove_duplicates(set(uid.values()))   # skip already downloaded articles.
 
-			uid = {k: v for k, v in uid.items() if v in duplicate_removed_uid}
-			doi_title = {k: v for k, v in doi_title.items() if k in duplicate_removed_uid}
+		uid = {k: v for k, v in uid.items() if v in duplicate_removed_uid}
+		doi_title = {k: v for k, v in doi_title.items() if k in duplicate_removed_uid}
 
-			print('<Elsevier> #UIDs w/o duplicates:', len(uid))
+		print('<Elsevier> #UIDs w/o duplicates:', len(uid))
 
-			for pii, doi in uid.items():
-				
-				if pii in self.error_list:
-					continue
-				
-				retrieval_uri = "https://api.elsevier.com/content/article/pii/" + pii
-
-				retrieval_headers = {'X-ELS-APIKEY': self.api_key}
-
-				sleep(1)
-				r_response = requests.get(retrieval_uri, headers=retrieval_headers)	# retrieval response
-
-				if r_response.status_code == 200:
-					# doi for dir/file names
-					'''
-					file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
-					file = file.lower()	# lowercase 
-					file_dir = self.path + file + '/'
-					os.mkdir(file_dir)	# create a directory for each article.
-					self.write_to_file(r_response, file_dir, file, ".xml")
-					'''
-					# pii for dir/file names
-					file_dir = self.path + pii + '/'
-					if not os.path.exists(file_dir):
-						os.mkdir(file_dir)	# create a directory for each article.
-					self.write_to_file(r_response, file_dir, pii, ".xml")
-					
-					self.update_uid(doi)	# add a new uid - 02-12-2020
-				else:
-					self.display_error_msg(r_response)
-					sys.exit()
+		items = []
+		for pii, doi in uid.items():
+			
+			if pii in self.error_list:
+				continue
+			
+			retrieval_uri = "https://api.elsevier.com/content/article/pii/" + pii
 
-			#self.save_uids()    # save new uids in the uid file. -> changed to save uids right after write_to_file() since errors frequently occur between articles. - 02-12-2020
+			# doi for dir/file names
+			'''
+			file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+			file = file.lower()	# lowercase 
+			file_dir = article_dir(self.path, file)
+			'''
+			# pii for dir/file names
+			file_dir = article_dir(self.path, pii)
 			
-			return doi_title
-		else:
-			self.display_error_msg(s_response)
-			sys.exit()
+			items.append(FetchItem(doi, retrieval_uri, file_dir, pii, ".xml"))
+		
+		def on_fetched(item, is_fetched):
+			if not is_fetched:
+				doi_title.pop(item.uid, None)
+		
+		# retrieve articles concurrently. Each article is written to its directory, and then its uid is added. - 02-12-2020
+		yield from self.iter_fetch_tasks(items, on_fetched)
+		yield None	# wait for the retrievals.
+		
+		checkpoint.clear()
+
+		#self.save_uids()    # save new uids in the uid file. -> changed to save uids right after write_to_file() since errors frequently occur between articles. - 02-12-2020
+		
+		return doi_title
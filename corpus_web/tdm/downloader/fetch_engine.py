@@ -0,0 +1,117 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FetchItem:
+	"""
+	A work item of the fetch engine.
+
+	params
+	- uid: unique identifier of the article (e.g., DOI) that is registered after the article is written.
+	- url: retrieval URL.
+	- destination: directory where the file is written.
+	- filename, extension: file name and extension (e.g., '.xml').
+	- headers, params: request headers and query parameters. Credentials (e.g., API keys) aren't kept here since items are serialized
+	  (the crawl frontier, the failed list). Downloaders add them when the request is sent (see BaseDownloader.auth_headers()).
+	"""
+
+	def __init__(self, uid, url, destination, filename, extension, headers=None, params=None):
+		self.uid = uid
+		self.url = url
+		self.destination = destination
+		self.filename = filename
+		self.extension = extension
+		self.headers = headers
+		self.params = params
+
+
+	def __repr__(self):
+		return f'FetchItem({self.uid}, {self.url})'
+
+
+	def to_dict(self):
+		return dict(self.__dict__)
+
+
+	@classmethod
+	def from_dict(cls, d):
+		return cls(**d)
+
+
+class FetchEngine:
+	"""
+	Fetch articles concurrently using asyncio.
+
+	Note:
+	- Requests are sent by the publisher's pooled session in worker threads, so the session's rate limiter still applies to every request.
+	- The total number of in-flight requests is capped by 'max_concurrency', and the number of in-flight requests to one host by 'max_per_host'.
+	- Callbacks are called in the event loop thread one at a time, so writing files and updating uids are never run concurrently.
+
+	References:
+	- https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.loop.run_in_executor
+	- https://docs.python.org/3/library/asyncio-sync.html#asyncio.Semaphore
+	"""
+
+	def __init__(self, session, max_concurrency=4, max_per_host=2, request_args=None):
+		"""
+		params
+		- request_args: function(item) that returns kwargs of the request (e.g., headers with an API key). By default, the item's headers and params are sent.
+		"""
+		self.session = session
+		self.max_concurrency = max_concurrency
+		self.max_per_host = max_per_host
+		self.request_args = request_args if request_args is not None else lambda item: {'headers': item.headers, 'params': item.params}
+
+
+	def run(self, items, on_success, on_error=None):
+		"""
+		Fetch all items, and return the list of items that failed.
+
+		params
+		- on_success: function(item, response) called for 200 responses. If it returns False (e.g., the document isn't valid), the item is counted as failed.
+		- on_error: function(item, response) called for the other responses. response is None if the request raised an exception.
+		"""
+		items = list(items)
+		if len(items) == 0:
+			return []
+
+		return asyncio.run(self._run(items, on_success, on_error))
+
+
+	async def _run(self, items, on_success, on_error):
+		loop = asyncio.get_running_loop()
+
+		self._semaphore = asyncio.Semaphore(self.max_concurrency)
+		self._host_semaphores = {}
+
+		with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+			results = await asyncio.gather(*[self._fetch(loop, executor, item, on_success, on_error) for item in items])
+
+		return [item for item, is_fetched in zip(items, results) if not is_fetched]
+
+
+	async def _fetch(self, loop, executor, item, on_success, on_error):
+		host = urlparse(item.url).netloc
+		if host not in self._host_semaphores:
+			self._host_semaphores[host] = asyncio.Semaphore(self.max_per_host)
+
+		request = functools.partial(self.session.get, item.url, **self.request_args(item))
+
+		async with self._semaphore, self._host_semaphores[host]:
+			try:
+				response = await loop.run_in_executor(executor, request)
+			except Exception as e:
+				logger.error(f'>> Request failed: {item.url} ({e})')
+				response = None
+
+		if response is not None and response.status_code == 200:
+			return on_success(item, response) is not False
+
+		if on_error is not None:
+			on_error(item, response)
+		return False
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPCache:
+	"""
+	On-disk cache of HTTP responses (e.g., search pages, metadata lookups).
+
+	Note:
+	- A response is keyed by the method, the full URL (including query parameters) and the request body (e.g., Elsevier's PUT search).
+	- Bodies are stored as files, and an SQLite table keeps the index (headers, validators, size, access time).
+	- A fresh entry (younger than the TTL of the request) is returned without a request. A stale entry with an ETag or Last-Modified
+	  is revalidated with a conditional GET, and a 304 response refreshes it.
+	- The total size of the cache is bounded, and the least recently used entries are evicted first.
+
+	References:
+	- https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+	- https://www.sqlite.org/wal.html
+	"""
+
+	# hop-by-hop, content encoding and length headers aren't valid for the stored (decoded) body.
+	excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive']
+
+	def __init__(self, cache_dir, max_size=1024**3):
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+
+		self.cache_dir = cache_dir
+		self.max_size = max_size	# bytes
+		self._lock = threading.Lock()	# the connection is shared by threads of a process.
+		self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.db'), timeout=60, isolation_level=None, check_same_thread=False)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, '
+						  'stored_at REAL, accessed_at REAL, size INTEGER)')
+		self.conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+
+
+	def make_key(self, request):
+		""" Return the cache key of a prepared request """
+		body = request.body if request.body is not None else b''
+		if isinstance(body, str):
+			body = body.encode()
+
+		return hashlib.sha256(request.method.encode() + b' ' + request.url.encode() + b'\n' + body).hexdigest()
+
+
+	def get_file(self, key):
+		return os.path.join(self.cache_dir, key[:2], key)
+
+
+	def get(self, key):
+		""" Return (response, age in seconds) of a cached entry, or (None, None) """
+		with self._lock:
+			row = self.conn.execute('SELECT url, status, headers, stored_at FROM entries WHERE key = ?', (key,)).fetchone()
+			if row is None:
+				return None, None
+
+			self.conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), key))
+
+		url, status, headers, stored_at = row
+
+		try:
+			with open(self.get_file(key), 'rb') as f:
+				content = f.read()
+		except OSError:	# the body was evicted by another process.
+			return None, None
+
+		response = requests.Response()
+		response.status_code = status
+		response.headers = CaseInsensitiveDict(json.loads(headers))
+		response.url = url
+		response.encoding = get_encoding_from_headers(response.headers)
+		response._content = content
+		response._content_consumed = True
+		response.from_cache = True
+
+		return response, time.time() - stored_at
+
+
+	def put(self, key, response):
+		content = response.content
+		headers = {k: v for k, v in response.headers.items() if k.lower() not in self.excluded_headers}
+
+		file = self.get_file(key)
+		if not os.path.exists(os.path.dirname(file)):
+			os.makedirs(os.path.dirname(file), exist_ok=True)
+
+		tmp_file = file + '.tmp.' + str(threading.get_ident())
+		with open(tmp_file, 'wb') as f:
+			f.write(content)
+		os.replace(tmp_file, file)
+
+		now = time.time()
+		with self._lock:
+			self.conn.execute('INSERT OR REPLACE INTO entries (key, url, status, headers, stored_at, accessed_at, size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+							  (key, response.url, response.status_code, json.dumps(headers), now, now, len(content)))
+
+		self.evict()
+
+
+	def refresh(self, key):
+		""" Mark an entry as fresh (e.g., after a 304 Not Modified response) """
+		with self._lock:
+			now = time.time()
+			self.conn.execute('UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+
+
+	def evict(self):
+		""" Remove the least recently used entries until the total size is under the limit """
+		with self._lock:
+			total_size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+			if total_size <= self.max_size:
+				return
+
+			evicted = []
+			for key, size in self.conn.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall():
+				if total_size <= self.max_size:
+					break
+				evicted.append(key)
+				total_size -= size
+
+			self.conn.executemany('DELETE FROM entries WHERE key = ?', [(x,) for x in evicted])
+
+		for key in evicted:
+			try:
+				os.remove(self.get_file(key))
+			except OSError:
+				pass
+
+		logger.debug(f'>> Evicted {len(evicted)} cache entries')
+
+
+	def clear(self):
+		with self._lock:
+			keys = [x[0] for x in self.conn.execute('SELECT key FROM entries').fetchall()]
+			self.conn.execute('DELETE FROM entries')
+
+		for key in keys:
+			try:
+				os.remove(self.get_file(key))
+			except OSError:
+				pass
+
+
+	def close(self):
+		self.conn.close()
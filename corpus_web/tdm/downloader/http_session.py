@@ -0,0 +1,136 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from retry import RetryPolicy, CircuitBreaker
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# mailto User-Agent (originally used for RSC) that identifies the crawler to publishers.
+DEFAULT_HEADERS = {'User-Agent': 'TDMCrawler; mailto: gpark@bnl.gov; BNL CSI Literature mining project'}
+
+DEFAULT_TIMEOUT = (10, 60)	# (connect, read) timeout in seconds.
+
+DEFAULT_POOL_SIZE = 10	# the max number of keep-alive connections per host.
+
+
+class PooledSession(requests.Session):
+	"""
+	Note:
+	- A requests.Session keeps TCP+TLS connections alive and reuses them for the same host,
+	  so consecutive requests to a publisher don't open a new connection every time.
+	- requests doesn't support a session-wide timeout, so the default is applied here unless a request specifies its own.
+	- If a rate limiter is given, every request waits for a token and the limiter adapts to the response headers.
+	- Transient errors (connection errors, timeouts, 429, 5xx) are retried by the retry policy,
+	  and each host has a circuit breaker that pauses requests to the host after consecutive failures.
+	  If the budget runs out, the last response is returned (or the last exception is raised) as usual.
+	- If an HTTP cache is given, a request with 'cache_ttl' (seconds) is served from the cache while the cached response is fresh,
+	  and revalidated with a conditional GET when it's stale. Requests without 'cache_ttl' (e.g., article downloads) bypass the cache.
+
+	References:
+	- https://requests.readthedocs.io/en/master/user/advanced/#session-objects
+	- https://requests.readthedocs.io/en/master/user/advanced/#timeouts
+	"""
+
+	def __init__(self, headers=None, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE, rate_limiter=None, retry_policy=None, cache=None):
+		super().__init__()
+		self.timeout = timeout
+		self.cache = cache
+		self.rate_limiter = rate_limiter
+		self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+		self.circuit_breakers = {}	# key: host, value: CircuitBreaker
+		self.num_of_retries = 0
+		self.num_of_requests = 0	# requests sent to servers (including retries, excluding cache hits). It's counted against quotas.
+
+		self.headers.update(DEFAULT_HEADERS)
+		if headers is not None:
+			self.headers.update(headers)
+
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+		self.mount('https://', adapter)
+		self.mount('http://', adapter)
+
+
+	def request(self, method, url, **kwargs):
+		cache_ttl = kwargs.pop('cache_ttl', None)
+		
+		if cache_ttl is None or self.cache is None or kwargs.get('stream'):
+			return self.send_with_retry(method, url, **kwargs)
+		
+		prepared = self.prepare_request(requests.Request(method, url, headers=kwargs.get('headers'), params=kwargs.get('params'),
+														 data=kwargs.get('data'), json=kwargs.get('json')))
+		key = self.cache.make_key(prepared)
+		
+		cached, age = self.cache.get(key)
+		if cached is not None and age < cache_ttl:
+			return cached
+		
+		if cached is not None:	# revalidate the stale response.
+			headers = dict(kwargs.get('headers') or {})
+			if 'ETag' in cached.headers:
+				headers['If-None-Match'] = cached.headers['ETag']
+			if 'Last-Modified' in cached.headers:
+				headers['If-Modified-Since'] = cached.headers['Last-Modified']
+			kwargs['headers'] = headers
+		
+		response = self.send_with_retry(method, url, **kwargs)
+		
+		if response.status_code == 304 and cached is not None:
+			self.cache.refresh(key)
+			return cached
+		
+		if response.status_code == 200:
+			self.cache.put(key, response)
+		
+		return response
+	
+	
+	def send_with_retry(self, method, url, **kwargs):
+		if kwargs.get('timeout') is None:
+			kwargs['timeout'] = self.timeout
+
+		host = urlparse(url).netloc
+		breaker = self.circuit_breakers.setdefault(host, CircuitBreaker())
+
+		attempt = 0
+		while True:
+			attempt += 1
+			breaker.before_request(host)	# raise CircuitOpenError if the host is paused.
+
+			if self.rate_limiter is not None:
+				self.rate_limiter.acquire()
+
+			self.num_of_requests += 1
+			try:
+				response = super().request(method, url, **kwargs)
+			except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+				breaker.record_failure(host)
+				if attempt >= self.retry_policy.max_attempts:
+					raise
+				logger.debug(f'>> Retry ({attempt}/{self.retry_policy.max_attempts}) {url}: {e}')
+				self.num_of_retries += 1
+				self.retry_policy.backoff(attempt)
+				continue
+
+			if self.rate_limiter is not None:
+				self.rate_limiter.update(response)
+
+			if not self.retry_policy.is_retryable(response):
+				breaker.record_success()
+				return response
+
+			if response.status_code != 429:	# 429 is handled by the rate limiter, and it doesn't mean the host is down.
+				breaker.record_failure(host)
+			if attempt >= self.retry_policy.max_attempts:
+				return response
+
+			logger.debug(f'>> Retry ({attempt}/{self.retry_policy.max_attempts}) {url}: {response.status_code}')
+			self.num_of_retries += 1
+			response.close()	# release the connection to the pool.
+			self.retry_policy.backoff(attempt)
+
+
+def create_session(headers=None, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE, rate_limiter=None, retry_policy=None, cache=None):
+	""" Create a connection-pooled session with keep-alive, default timeouts and default headers """
+	return PooledSession(headers=headers, timeout=timeout, pool_size=pool_size, rate_limiter=rate_limiter, retry_policy=retry_policy, cache=cache)
@@ -0,0 +1,448 @@
+import io
+import json
+import time
+import random
+import hashlib
+import tarfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape, quoteattr
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MockPublisherServer(ThreadingHTTPServer):
+	"""
+	Local stand-in of publisher APIs for benchmarks (see benchmark.py). A request to https://<host>/<path> is sent to http://127.0.0.1:<port>/<host>/<path>.
+
+	Note:
+	- Endpoints: Elsevier search and retrieval, Springer JATS search, PMC eutils (esearch, esummary), ID converter, OA service and OA packages,
+	  RSC search and article HTML, Crossref works and TDM links (Emerald PDFs).
+	- Each publisher has 'num_of_articles' articles of about 'article_size' bytes. Articles are generated from their index on every request,
+	  so runs are reproducible and documents are valid for the downloaders' validators.
+	- Every request waits 'latency' seconds (+-50%), and it fails with 429 (with Retry-After) or 503 at the given rates.
+	- Requests, bytes of response bodies and injected errors are counted per host.
+	"""
+
+	daemon_threads = True
+
+	elsevier_host = 'api.elsevier.com'
+	springer_host = 'spdi.public.springernature.app'
+	eutils_host = 'eutils.ncbi.nlm.nih.gov'
+	ncbi_host = 'www.ncbi.nlm.nih.gov'
+	pmc_ftp_host = 'ftp.ncbi.nlm.nih.gov'
+	rsc_host = 'pubs.rsc.org'
+	crossref_host = 'api.crossref.org'
+	emerald_host = 'www.emerald.com'
+
+	pmc_id_base = 9000000	# PMCIDs are PMC9000000, PMC9000001, ...
+
+	def __init__(self, port=0, num_of_articles=100, article_size=20*1024, latency=0.05, error_429_rate=0.0, error_5xx_rate=0.0, retry_after=1, seed=None):
+		"""
+		params
+		- port: 0 means any free port (see 'port').
+		- article_size: bytes of an article body.
+		- latency: seconds of server think time per request.
+		- error_429_rate, error_5xx_rate: the ratio of requests that fail with 429 and 503.
+		- retry_after: Retry-After (seconds) of 429 responses.
+		"""
+		super().__init__(('127.0.0.1', port), MockPublisherHandler)
+		self.port = self.server_address[1]
+		self.num_of_articles = num_of_articles
+		self.article_size = article_size
+		self.latency = latency
+		self.error_429_rate = error_429_rate
+		self.error_5xx_rate = error_5xx_rate
+		self.retry_after = retry_after
+		self.random = random.Random(seed)
+
+		self.counters = {}	# key: host, value: dict of requests, bytes, 429, 5xx
+		self._lock = threading.Lock()
+		self._thread = None
+
+
+	def start(self):
+		""" Serve requests in a background thread, and return the base URL """
+		self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+		self._thread.start()
+
+		return f'http://127.0.0.1:{self.port}'
+
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+	def handle_error(self, request, client_address):
+		""" Clients drop keep-alive connections when they're done (e.g., ConnectionResetError), so errors are logged at debug instead of printing tracebacks """
+		logger.debug(f'>> Mock server: connection error from {client_address}', exc_info=True)
+
+
+	def count(self, host, status, num_of_bytes):
+		with self._lock:
+			counter = self.counters.setdefault(host, {'requests': 0, 'bytes': 0, '429': 0, '5xx': 0})
+			counter['requests'] += 1
+			counter['bytes'] += num_of_bytes
+			if status == 429:
+				counter['429'] += 1
+			elif status >= 500:
+				counter['5xx'] += 1
+
+
+	def get_counters(self, hosts):
+		""" Return the sum of the counters of the hosts """
+		total = {'requests': 0, 'bytes': 0, '429': 0, '5xx': 0}
+		with self._lock:
+			for host in hosts:
+				for k, v in self.counters.get(host, {}).items():
+					total[k] += v
+
+		return total
+
+
+	def get_fault(self):
+		""" Return the status code of an injected error, or None """
+		x = self.random.random()
+		if x < self.error_429_rate:
+			return 429
+		if x < self.error_429_rate + self.error_5xx_rate:
+			return 503
+
+		return None
+
+
+	def get_latency(self):
+		return self.latency*self.random.uniform(0.5, 1.5)
+
+
+	def padding(self, i, size=None):
+		""" Return text of about 'size' bytes for the article i. Hex digests are not as compressible as repeated text, so packages have realistic sizes. """
+		size = self.article_size if size is None else size
+
+		words = []
+		num_of_bytes = 0
+		while num_of_bytes < size:
+			word = hashlib.sha1(f'{i}-{len(words)}'.encode()).hexdigest()
+			words.append(word)
+			num_of_bytes += len(word) + 1
+
+		return ' '.join(words)
+
+
+	def article_range(self, start, rows):
+		return range(start, min(start + rows, self.num_of_articles)) if start >= 0 else range(0)
+
+
+	def route(self, method, host, path, query, body):
+		""" Return (status code, body, content type, headers) of a request """
+		if host == self.elsevier_host:
+			if method == 'PUT' and path == '/content/search/sciencedirect':
+				return self.elsevier_search(json.loads(body))
+			if method == 'GET' and path.startswith('/content/article/pii/'):
+				return self.elsevier_article(path.rsplit('/', 1)[-1])
+
+		elif host == self.springer_host:
+			if method == 'GET' and path == '/xmldata/jats':
+				return self.springer_search(query)
+
+		elif host == self.eutils_host:
+			if method == 'GET' and path == '/entrez/eutils/esearch.fcgi':
+				return self.pmc_search(query)
+			if method == 'GET' and path == '/entrez/eutils/esummary.fcgi':
+				return self.pmc_summary(query)
+
+		elif host == self.ncbi_host:
+			if method == 'GET' and path == '/pmc/utils/idconv/v1.0/':
+				return self.pmc_id_converter(query)
+			if method == 'GET' and path == '/pmc/utils/oa/oa.fcgi':
+				return self.pmc_oa_service(query)
+
+		elif host == self.pmc_ftp_host:
+			if method == 'GET' and path.startswith('/pub/pmc/oa_package/'):
+				return self.pmc_package(path.rsplit('/', 1)[-1].split('.', 1)[0])
+
+		elif host == self.rsc_host:
+			if method == 'GET' and path == '/en/results':
+				return self.rsc_search_page()
+			if method == 'POST' and path == '/en/search/journalresult':
+				return self.rsc_search({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+			if method == 'GET' and path.startswith('/en/content/articlehtml/'):
+				return self.rsc_article(path.rsplit('/', 1)[-1])
+
+		elif host == self.crossref_host:
+			if method == 'GET' and path == '/works':
+				return self.crossref_works(query)
+
+		elif host == self.emerald_host:
+			if method == 'GET' and path.endswith('/full/pdf'):
+				return self.emerald_pdf(path)
+
+		return 404, b'Not Found', 'text/plain', {}
+
+
+	def article_xml(self, tag, i, doi, title):
+		return (f'<{tag}><front><article-meta><article-id pub-id-type="doi">{escape(doi)}</article-id>'
+				f'<title-group><article-title>{escape(title)}</article-title></title-group></article-meta></front>'
+				f'<body><sec><p>{self.padding(i)}</p></sec></body></{tag}>')
+
+
+	def index_of(self, key, prefix):
+		""" Return the article index of a key (e.g., bench12 -> 12), or None if it's not an article of this server """
+		if not key.startswith(prefix) or not key[len(prefix):].isdigit():
+			return None
+
+		i = int(key[len(prefix):])
+
+		return i if i < self.num_of_articles else None
+
+
+	# Elsevier endpoints
+	def elsevier_search(self, params):
+		display = params.get('display', {})
+		offset = int(display.get('offset', 0))
+		show = int(display.get('show', 25))
+
+		results = [{'pii': f'S{i:016d}', 'doi': f'10.1016/j.bench.{i}', 'title': f'Elsevier benchmark article {i}'} for i in self.article_range(offset, show)]
+
+		return 200, json.dumps({'resultsFound': self.num_of_articles, 'results': results}).encode(), 'application/json', {}
+
+
+	def elsevier_article(self, pii):
+		i = self.index_of(pii, 'S')
+		if i is None:
+			return 404, b'<service-error><status><statusCode>RESOURCE_NOT_FOUND</statusCode></status></service-error>', 'text/xml', {}
+
+		body = ('<?xml version="1.0" encoding="UTF-8"?><full-text-retrieval-response><coredata>'
+				f'<pii>{pii}</pii><doi>10.1016/j.bench.{i}</doi><title>Elsevier benchmark article {i}</title></coredata>'
+				f'<originalText><body><p>{self.padding(i)}</p></body></originalText></full-text-retrieval-response>')
+
+		return 200, body.encode(), 'text/xml;charset=UTF-8', {}
+
+
+	# Springer endpoints
+	def springer_search(self, query):
+		start = int(query.get('s', 1)) - 1	# s starts from 1.
+		rows = int(query.get('p', 10))
+
+		records = ''.join(self.article_xml('article', i, f'10.1007/bench-{i}', f'Springer benchmark article {i}') for i in self.article_range(start, rows))
+
+		body = (f'<?xml version="1.0" encoding="UTF-8"?><response><query>{escape(query.get("q", ""))}</query>'
+				f'<result><total>{self.num_of_articles}</total><start>{start + 1}</start><pageLength>{rows}</pageLength></result>'
+				f'<records>{records}</records></response>')
+
+		return 200, body.encode(), 'application/xml', {}
+
+
+	# PMC endpoints
+	def pmc_search(self, query):
+		start = int(query.get('retstart', 0))
+		rows = int(query.get('retmax', 20))
+
+		ids = [self.pmc_id_base + i for i in self.article_range(start, rows)]
+
+		body = (f'<?xml version="1.0" encoding="UTF-8"?><eSearchResult><Count>{self.num_of_articles}</Count><RetMax>{len(ids)}</RetMax>'
+				f'<RetStart>{start}</RetStart><IdList>' + ''.join(f'<Id>{x}</Id>' for x in ids) + '</IdList></eSearchResult>')
+
+		return 200, body.encode(), 'text/xml', {}
+
+
+	def pmc_summary(self, query):
+		doc_sums = []
+		for x in query.get('id', '').split(','):
+			i = self.pmc_index('PMC' + x)
+			if i is None:
+				continue
+
+			doc_sums.append(f'<DocSum><Id>{x}</Id><Item Name="Title" Type="String">PMC benchmark article {i}</Item>'
+							f'<Item Name="DOI" Type="String">10.5555/pmc-bench-{i}</Item></DocSum>')
+
+		body = '<?xml version="1.0" encoding="UTF-8"?><eSummaryResult>' + ''.join(doc_sums) + '</eSummaryResult>'
+
+		return 200, body.encode(), 'text/xml', {}
+
+
+	def pmc_id_converter(self, query):
+		records = []
+		for x in query.get('ids', '').split(','):
+			i = self.pmc_index(x) if x.startswith('PMC') else self.index_of(x.lower(), '10.5555/pmc-bench-')
+			if i is None:
+				records.append({'pmcid' if x.startswith('PMC') else 'doi': x, 'status': 'error', 'errmsg': 'invalid article id'})
+				continue
+
+			records.append({'pmcid': f'PMC{self.pmc_id_base + i}', 'pmid': str(self.pmc_id_base + i), 'doi': f'10.5555/pmc-bench-{i}'})
+
+		return 200, json.dumps({'status': 'ok', 'records': records}).encode(), 'application/json', {}
+
+
+	def pmc_index(self, pmc_id):
+		""" Return the article index of a PMCID (e.g., PMC9000012 -> 12), or None """
+		if not pmc_id.startswith('PMC') or not pmc_id[3:].isdigit():
+			return None
+
+		i = int(pmc_id[3:]) - self.pmc_id_base
+
+		return i if 0 <= i < self.num_of_articles else None
+
+
+	def pmc_package_path(self, pmc_id):
+		h = hashlib.md5(pmc_id.encode()).hexdigest()
+
+		return f'oa_package/{h[:2]}/{h[2:4]}/{pmc_id}.tar.gz'
+
+
+	def pmc_oa_service(self, query):
+		pmc_id = query.get('id', '')
+
+		if self.pmc_index(pmc_id) is None:
+			body = f'<OA><request id={quoteattr(pmc_id)}/><error code="idDoesNotExist">Invalid PMCID</error></OA>'
+		else:
+			body = (f'<OA><request id="{pmc_id}"/><records returned-count="1" total-count="1"><record id="{pmc_id}" license="CC BY">'
+					f'<link format="tgz" href="ftp://{self.pmc_ftp_host}/pub/pmc/{self.pmc_package_path(pmc_id)}"/></record></records></OA>')
+
+		return 200, body.encode(), 'text/xml', {}
+
+
+	def pmc_package(self, pmc_id):
+		i = self.pmc_index(pmc_id)
+		if i is None:
+			return 404, b'Not Found', 'text/plain', {}
+
+		nxml = ('<?xml version="1.0" encoding="UTF-8"?>' + self.article_xml('article', i, f'10.5555/pmc-bench-{i}', f'PMC benchmark article {i}')).encode()
+
+		buffer = io.BytesIO()
+		with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+			info = tarfile.TarInfo(f'{pmc_id}/{pmc_id}.nxml')
+			info.size = len(nxml)
+			info.mtime = 0
+			tar.addfile(info, io.BytesIO(nxml))
+
+		return 200, buffer.getvalue(), 'application/x-gzip', {}
+
+
+	# RSC endpoints
+	def rsc_search_page(self):
+		body = '<html><body><form><input id="SearchTerm" name="SearchTerm" type="hidden" value="benchmark-session"/></form></body></html>'
+
+		return 200, body.encode(), 'text/html; charset=utf-8', {}
+
+
+	def rsc_search(self, form):
+		rows = int(form.get('resultcount', 100))
+		start = (int(form.get('pageno', 1)) - 1)*rows
+
+		capsules = []
+		for i in self.article_range(start, rows):
+			capsules.append(f'<div class="capsule capsule--article"><h3 class="capsule__title">RSC benchmark article {i}</h3>'
+							f'<a href="https://doi.org/10.1039/bench{i}">https://doi.org/10.1039/bench{i}</a>'
+							f'<a href="/en/content/articlehtml/2020/bench/bench{i}">Article HTML</a></div>')
+
+		body = '<html><body>' + ''.join(capsules) + '</body></html>'
+
+		return 200, body.encode(), 'text/html; charset=utf-8', {}
+
+
+	def rsc_article(self, key):
+		i = self.index_of(key, 'bench')
+		if i is None:
+			return 404, b'<html><body>Not Found</body></html>', 'text/html', {}
+
+		body = f'<html><head><title>RSC benchmark article {i}</title></head><body><div id="wrapper"><p>{self.padding(i)}</p></div></body></html>'
+
+		return 200, body.encode(), 'text/html; charset=utf-8', {}
+
+
+	# Crossref endpoints
+	def crossref_works(self, query):
+		rows = int(query.get('rows', 20))
+		cursor = query.get('cursor', '*')
+		start = 0 if cursor == '*' else int(cursor.split(':', 1)[-1])
+
+		member = '140'
+		for x in query.get('filter', '').split(','):
+			if x.startswith('member:'):
+				member = x.split(':', 1)[1]
+
+		items = []
+		for i in self.article_range(start, rows):
+			doi = f'10.1108/bench-{i}'
+			items.append({'DOI': doi, 'member': member, 'publisher': 'Benchmark', 'type': 'journal-article',
+						  'title': [f'Crossref benchmark article {i}'], 'issued': {'date-parts': [[2020, 1, 1]]},
+						  'author': [{'given': 'Benchmark', 'family': 'Author'}],
+						  'link': [{'URL': f'https://{self.emerald_host}/insight/content/doi/{doi}/full/pdf', 'content-type': 'application/pdf',
+									'content-version': 'vor', 'intended-application': 'text-mining'}]})
+
+		message = {'total-results': self.num_of_articles, 'items': items, 'items-per-page': rows, 'next-cursor': f'benchmark:{start + rows}'}
+
+		return 200, json.dumps({'status': 'ok', 'message-type': 'work-list', 'message': message}).encode(), 'application/json', {}
+
+
+	def emerald_pdf(self, path):
+		i = self.index_of(path.split('/doi/', 1)[-1].rsplit('/full/', 1)[0], '10.1108/bench-')
+		if i is None:
+			return 404, b'<html><body>Not Found</body></html>', 'text/html', {}
+
+		body = f'%PDF-1.4\n% Crossref benchmark article {i}\n{self.padding(i)}\n%%EOF\n'
+
+		return 200, body.encode(), 'application/pdf', {}
+
+
+class MockPublisherHandler(BaseHTTPRequestHandler):
+
+	protocol_version = 'HTTP/1.1'	# keep-alive, so connections are reused by the pooled sessions as with the real servers.
+
+	def do_GET(self):
+		self.handle_request('GET')
+
+
+	def do_PUT(self):
+		self.handle_request('PUT')
+
+
+	def do_POST(self):
+		self.handle_request('POST')
+
+
+	def handle_request(self, method):
+		length = int(self.headers.get('Content-Length', 0))
+		body = self.rfile.read(length) if length > 0 else b''
+
+		url = urlsplit(self.path)
+		host, _, path = url.path.lstrip('/').partition('/')
+		query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+		time.sleep(self.server.get_latency())
+
+		fault = self.server.get_fault()
+		if fault == 429:
+			self.reply(host, 429, b'Rate of requests exceeds specified limits.', 'text/plain', {'Retry-After': str(self.server.retry_after)})
+			return
+		elif fault is not None:
+			self.reply(host, fault, b'Service Unavailable', 'text/plain', {})
+			return
+
+		try:
+			status, content, content_type, headers = self.server.route(method, host, '/' + path, query, body)
+		except Exception as e:	# e.g., malformed parameters
+			logger.error(f'>> Mock server error: {self.path} ({e})')
+			status, content, content_type, headers = 400, str(e).encode(), 'text/plain', {}
+
+		self.reply(host, status, content, content_type, headers)
+
+
+	def reply(self, host, status, content, content_type, headers):
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(content)))
+		for k, v in headers.items():
+			self.send_header(k, v)
+		self.end_headers()
+		self.wfile.write(content)
+
+		self.server.count(host, status, len(content))
+
+
+	def log_message(self, format, *args):
+		logger.debug('>> Mock server: ' + format % args)
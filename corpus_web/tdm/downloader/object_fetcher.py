@@ -0,0 +1,358 @@
+import os
+import sys
+import time
+import socket
+import sqlite3
+import threading
+import functools
+from datetime import datetime
+from urllib.parse import urlparse
+import logging
+
+from http_session import create_session
+from rate_limiter import RateLimiter
+from blob_store import BlobStore
+from document_validator import DocumentValidator, InvalidDocumentError
+from crawl_scheduler import CrawlTask, CrawlScheduler
+from base_downloader import info_file
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectQueue:
+	"""
+	Persistent work queue of objects (e.g., figures, attachments) of articles, which is also the manifest of fetched objects.
+
+	Note:
+	- An object is keyed by (article id, object id) (e.g., (PII, EID) for Elsevier, (article file name, figure file name) for RSC),
+	  so enqueuing an object that is already queued or fetched does nothing, and parsers don't need to list article directories.
+	- status: 'pending' -> 'fetching' -> 'done' (with the digest of the payload in the blob store) or back to 'pending' for a retry.
+	  An object that fails 'max_attempts' times is 'failed'.
+	- A claimed object is leased to its fetcher ('lease_owner') until 'leased_until'. Objects of a fetcher that died are put back to pending
+	  by the next claim after the lease expires, so objects that another live fetcher is downloading are never fetched twice.
+	- The database runs in WAL mode, so parsers enqueue objects while the fetcher runs in another process.
+
+	References:
+	- https://www.sqlite.org/wal.html
+	"""
+
+	max_attempts = 3
+
+	def __init__(self, db_file):
+		self.db_file = db_file
+		self._lock = threading.Lock()	# the connection is shared by threads of a process.
+		self.conn = sqlite3.connect(db_file, timeout=60, isolation_level=None, check_same_thread=False)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute('PRAGMA synchronous=NORMAL')
+		self.conn.execute('CREATE TABLE IF NOT EXISTS objects (article_id TEXT, object_id TEXT, publisher TEXT, url TEXT, file TEXT, '
+						  'status TEXT, attempts INTEGER, error TEXT, digest TEXT, updated TEXT, lease_owner TEXT, leased_until REAL, '
+						  'PRIMARY KEY (article_id, object_id))')
+
+		columns = [x[1] for x in self.conn.execute('PRAGMA table_info(objects)')]
+		if 'leased_until' not in columns:	# queue created before leases.
+			self.conn.execute('ALTER TABLE objects ADD COLUMN lease_owner TEXT')
+			self.conn.execute('ALTER TABLE objects ADD COLUMN leased_until REAL')
+		self.conn.execute('CREATE INDEX IF NOT EXISTS objects_status ON objects (status)')
+
+
+	def enqueue(self, publisher, article_id, objects):
+		"""
+		Add objects of an article, and return the number of newly queued objects.
+
+		params
+		- objects: list of (object id, URL, file path)
+		"""
+		updated = datetime.now().isoformat(timespec='seconds')
+		rows = [(article_id, object_id, publisher, url, file, updated) for object_id, url, file in objects]
+
+		with self._lock:
+			self.conn.execute('BEGIN IMMEDIATE')
+			try:
+				before = self.conn.total_changes
+				self.conn.executemany("INSERT OR IGNORE INTO objects (article_id, object_id, publisher, url, file, status, attempts, updated) "
+									  "VALUES (?, ?, ?, ?, ?, 'pending', 0, ?)", rows)
+				num_of_queued = self.conn.total_changes - before
+				self.conn.execute('COMMIT')
+			except Exception:
+				self.conn.execute('ROLLBACK')
+				raise
+
+		return num_of_queued
+
+
+	def claim(self, limit, owner, lease_time, publishers=None):
+		""" Lease up to 'limit' pending objects to the owner (a fetcher) for 'lease_time' seconds, and return them as a list of dict """
+		now = time.time()
+
+		query = "SELECT article_id, object_id, publisher, url, file, attempts FROM objects WHERE status = 'pending'"
+		args = []
+		if publishers is not None:
+			query += ' AND publisher IN (' + ','.join(['?']*len(publishers)) + ')'
+			args += list(publishers)
+		query += ' LIMIT ?'
+		args.append(limit)
+
+		with self._lock:
+			self.conn.execute('BEGIN IMMEDIATE')	# no other fetcher claims the same objects.
+			try:
+				self.requeue_expired(now)
+
+				rows = self.conn.execute(query, args).fetchall()
+				self.conn.executemany("UPDATE objects SET status = 'fetching', lease_owner = ?, leased_until = ? WHERE article_id = ? AND object_id = ?",
+									  [(owner, now + lease_time) + x[:2] for x in rows])
+				self.conn.execute('COMMIT')
+			except Exception:
+				self.conn.execute('ROLLBACK')
+				raise
+
+		keys = ['article_id', 'object_id', 'publisher', 'url', 'file', 'attempts']
+		return [dict(zip(keys, x)) for x in rows]
+
+
+	def requeue_expired(self, now):
+		"""
+		Put objects whose leases expired (e.g., their fetcher died) back to pending, or mark them as 'failed' after 'max_attempts' attempts.
+		Objects claimed before leases were added have no expiry, and they're put back too. It's called in the claim transaction.
+		"""
+		cur = self.conn.execute("UPDATE objects SET attempts = attempts + 1, error = 'lease expired', lease_owner = NULL, leased_until = NULL, "
+								"status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+								"WHERE status = 'fetching' AND (leased_until IS NULL OR leased_until < ?)", (self.max_attempts, now))
+		if cur.rowcount > 0:
+			logger.error(f'>> {cur.rowcount} objects of expired leases are queued again')
+
+
+	def release(self, owner):
+		""" Put objects leased to the owner back to pending (e.g., when the fetcher stops), and return the number of released objects """
+		with self._lock:
+			cur = self.conn.execute("UPDATE objects SET status = 'pending', lease_owner = NULL, leased_until = NULL WHERE status = 'fetching' AND lease_owner = ?",
+									(owner,))
+			return cur.rowcount
+
+
+	def mark_done(self, article_id, object_id, digest):
+		with self._lock:
+			self.conn.execute("UPDATE objects SET status = 'done', digest = ?, error = NULL, lease_owner = NULL, leased_until = NULL, updated = ? WHERE article_id = ? AND object_id = ?",
+							  (digest, datetime.now().isoformat(timespec='seconds'), article_id, object_id))
+
+
+	def mark_failed(self, article_id, object_id, error):
+		""" Put the object back to the queue, or mark it as 'failed' after 'max_attempts' attempts """
+		with self._lock:
+			self.conn.execute("UPDATE objects SET attempts = attempts + 1, error = ?, updated = ?, lease_owner = NULL, leased_until = NULL, "
+							  "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END WHERE article_id = ? AND object_id = ?",
+							  (str(error), datetime.now().isoformat(timespec='seconds'), self.max_attempts, article_id, object_id))
+
+
+	def reset(self):
+		""" Put 'failed' objects back to the queue for another try. Leased objects are put back by claim() after their leases expire. """
+		with self._lock:
+			cur = self.conn.execute("UPDATE objects SET status = 'pending', attempts = 0 WHERE status = 'failed'")
+			return cur.rowcount
+
+
+	def get_manifest(self, article_id):
+		""" Return dict of key: object id - value: (status, file, digest) of an article """
+		with self._lock:
+			rows = self.conn.execute('SELECT object_id, status, file, digest FROM objects WHERE article_id = ?', (article_id,)).fetchall()
+
+		return {x[0]: tuple(x[1:]) for x in rows}
+
+
+	def get_stats(self):
+		""" Return dict of key: (publisher, status) - value: the number of objects """
+		with self._lock:
+			rows = self.conn.execute('SELECT publisher, status, COUNT(*) FROM objects GROUP BY publisher, status').fetchall()
+
+		return {(x[0], x[1]): x[2] for x in rows}
+
+
+class ObjectFetcher:
+	"""
+	Fetch queued objects of articles, which are enqueued by parsers (e.g., ElsevierParser.get_object()), independently of parsing.
+
+	Note:
+	- Each host has its own pooled session, rate limiter and the number of concurrent requests ('host_limits'),
+	  and objects are tasks of the crawl scheduler, so a slow or throttled host doesn't hold up the others.
+	  The downloader script can run the objects along with crawls (see iter_tasks()).
+	- Objects are validated while they're written and stored in the blob store (identical objects such as publisher logos are stored once),
+	  and the digest is recorded in the manifest.
+	- Objects are claimed with a lease of 'lease_time' seconds. A fetcher that stops releases its objects, and objects of a fetcher that died
+	  are claimed again after the lease expires. So it's safe to stop and run it again, and to run several fetchers (or a fetcher and parsers) at the same time.
+
+	Usage:
+	- python object_fetcher.py [publisher ...]	# fetch pending objects (of the given publishers), and exit.
+	- python object_fetcher.py --watch [publisher ...]	# keep fetching objects enqueued by running parsers.
+	"""
+
+	# key: host, value: (the number of concurrent requests, requests per second)
+	host_limits = {
+		'api.elsevier.com': (4, 5),
+		'pubs.rsc.org': (2, 1),
+	}
+	default_limit = (2, 1)
+	max_concurrency = 8	# the total number of concurrent requests.
+
+	batch_size = 500	# the number of objects claimed at once.
+	lease_time = 30*60	# seconds - a batch must be fetched within the lease (e.g., 500 objects at 1 request per second take about 8 minutes).
+	poll_interval = 60	# seconds - interval of checking the queue in the watch mode.
+	chunk_size = 64*1024	# bytes
+
+	def __init__(self):
+		self.api_keys = {}
+		self.host_limits = dict(self.host_limits)
+		self.queue_file = None
+		self.blob_dir = None
+
+		# get keys, uid list, and queue and blob store paths.
+		with open(info_file, 'r') as f:
+			for line in f.readlines():
+				if line.startswith('API_key'):
+					key = line.split('=', 1)[0].split('/')[1].strip()
+					self.api_keys[key] = line.split('=', 1)[1].strip()
+				elif line.startswith('UID_list'):
+					self.uid_list = line.split('=', 1)[1].strip()
+				elif line.startswith('Object_queue'):
+					self.queue_file = line.split('=', 1)[1].strip()
+				elif line.startswith('Blob_store'):
+					self.blob_dir = line.split('=', 1)[1].strip()
+				elif line.startswith('Object_limit'):
+					key = line.split('=', 1)[0].split('/')[1].strip()
+					val = [x.strip() for x in line.split('=', 1)[1].split(',')]
+					self.host_limits[key] = (int(val[0]), float(val[1]))
+
+		if self.queue_file is None:
+			self.queue_file = os.path.join(os.path.dirname(self.uid_list), 'objects.db')
+		self.queue = ObjectQueue(self.queue_file)
+
+		if self.blob_dir is None:
+			self.blob_dir = os.path.join(os.path.dirname(self.uid_list), 'blobs')
+		self.blob_store = BlobStore(self.blob_dir)
+
+		# headers of object requests per publisher.
+		self.publisher_headers = {'Elsevier': {'X-ELS-APIKEY': self.api_keys.get('Elsevier')}}
+
+		self.worker_id = socket.gethostname() + ':' + str(os.getpid())	# the owner of leased objects.
+		self.sessions = {}	# key: host, value: session
+		self.num_of_fetched = 0
+		self.num_of_failed = 0
+
+
+	def get_session(self, host):
+		if host not in self.sessions:
+			num_of_workers, rate = self.host_limits.get(host, self.default_limit)
+			self.sessions[host] = create_session(pool_size=num_of_workers, rate_limiter=RateLimiter(rate, num_of_workers))
+
+		return self.sessions[host]
+
+
+	def fetch(self, session, obj):
+		""" Fetch an object, store it, and return True if it's fetched """
+		try:
+			response = session.get(obj['url'], headers=self.publisher_headers.get(obj['publisher']), stream=True)
+		except Exception as e:	# e.g., connection errors, CircuitOpenError
+			logger.error(f'>> Request failed: {obj["url"]} ({e})')
+			self.queue.mark_failed(obj['article_id'], obj['object_id'], e)
+			return False
+
+		if response.status_code != 200:
+			logger.error(f'>> ERROR Code: {response.status_code} | URL: {response.url}')
+			self.queue.mark_failed(obj['article_id'], obj['object_id'], response.status_code)
+			response.close()
+			return False
+
+		content_length = None
+		if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+			content_length = int(response.headers['Content-Length'])
+
+		try:
+			validator = DocumentValidator(os.path.splitext(obj['file'])[1].lower(), response.headers.get('Content-Type'), content_length)
+
+			os.makedirs(os.path.dirname(obj['file']), exist_ok=True)
+			digest, _ = self.blob_store.put(response.iter_content(self.chunk_size), obj['file'], validator)	# identical objects are stored once.
+		except InvalidDocumentError as e:
+			logger.error(f'>> Invalid object: {obj["url"]} ({e.reason})')
+			self.queue.mark_failed(obj['article_id'], obj['object_id'], 'invalid document: ' + e.reason)
+			return False
+		except Exception as e:	# e.g., the connection is dropped while the body is read.
+			logger.error(f'>> Failed to fetch {obj["url"]}: {e}')
+			self.queue.mark_failed(obj['article_id'], obj['object_id'], e)
+			return False
+		finally:
+			response.close()
+
+		self.queue.mark_done(obj['article_id'], obj['object_id'], digest)
+
+		return True
+
+
+	def iter_tasks(self, publishers=None):
+		"""
+		Yield a task (CrawlTask) per pending object until the queue is empty. It's the work generator of objects for the crawl scheduler.
+
+		params
+		- publishers: list of publishers whose objects are fetched. None means all publishers.
+		"""
+		def on_fetched(is_fetched):
+			if is_fetched:
+				self.num_of_fetched += 1
+			else:
+				self.num_of_failed += 1
+
+		try:
+			while True:
+				objects = self.queue.claim(self.batch_size, self.worker_id, self.lease_time, publishers)
+
+				if len(objects) == 0:
+					break
+
+				for obj in objects:
+					host = urlparse(obj['url']).netloc
+					session = self.get_session(host)
+
+					yield CrawlTask('Objects', obj['url'], functools.partial(self.fetch, session, obj), 'object', on_fetched,
+									session.rate_limiter, self.host_limits.get(host, self.default_limit)[0])
+
+				yield None	# failed objects are back in the queue, so the next batch is claimed after this batch.
+
+				print(f'<ObjectFetcher> #Fetched: {self.num_of_fetched} / #Failed attempts: {self.num_of_failed}')
+		finally:	# e.g., the scheduler stopped the job. Objects that are not started are released for other fetchers.
+			num_of_released = self.queue.release(self.worker_id)
+			if num_of_released > 0:
+				print(f'<ObjectFetcher> {num_of_released} claimed objects are released.')
+
+
+	def run(self, publishers=None, watch=False):
+		"""
+		Fetch pending objects until the queue is empty.
+
+		params
+		- publishers: list of publishers whose objects are fetched. None means all publishers.
+		- watch: if True, keep checking the queue for new objects instead of returning.
+		"""
+		while True:
+			scheduler = CrawlScheduler(self.max_concurrency)
+			scheduler.add('Objects', self.iter_tasks(publishers), max_concurrency=self.max_concurrency)
+			scheduler.run()
+
+			if not watch:
+				break
+
+			time.sleep(self.poll_interval)
+
+		for (publisher, status), cnt in sorted(self.queue.get_stats().items(), key=lambda x: (str(x[0][0]), x[0][1])):
+			print(f'<ObjectFetcher> {publisher} - {status}: {cnt}')
+
+
+def main():
+	start_time = time.time()
+
+	watch = '--watch' in sys.argv
+	publishers = [x for x in sys.argv[1:] if x != '--watch']
+
+	ObjectFetcher().run(publishers if len(publishers) > 0 else None, watch)
+
+	print("--- %s seconds ---" % (time.time() - start_time))
+
+
+if __name__ == "__main__":
+	main()
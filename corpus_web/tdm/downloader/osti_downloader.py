@@ -1,7 +1,12 @@
 import sys
 import json
+import queue
+import threading
 import requests
-from base_downloader import BaseDownloader
+from concurrent.futures import ThreadPoolExecutor
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import article_dir
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,8 +24,17 @@ class OSTIDownloader(BaseDownloader):
 	- 
 	"""
 
+	search_url = "https://www.osti.gov/api/v1/records"
+	
+	search_headers = {'Content-Type': 'application/json',
+					  'Accept': 'application/json'}
+	
+	metadata_batch_size = 100	# the number of metadata written at once.
+
 	def __init__(self):
-		self.destination = BaseDownloader.archive_path + "OSTI/"
+		super().__init__('OSTI')
+		self.destination = self.path
+		self.metadata_file = self.destination + 'metadata.jsonl'	# metadata of downloaded articles (one JSON object per line).
 	
 	
 	def update_dict(self, key, dict):
@@ -35,154 +49,191 @@ class OSTIDownloader(BaseDownloader):
 		
 		
 
-	def retrieve_articles(self, query):
+	def search_page(self, page):
+		""" Fetch a search page, and return (records, next page number or None) """
+		s_response = self.session.get(self.search_url, headers=self.search_headers, params=dict(self.search_params, page=page), cache_ttl=self.cache_ttl)
+		
+		if s_response.status_code != 200:
+			self.display_error_msg(s_response)
+			raise DownloadError(self.publisher, s_response)
+		
+		''' link example
+		<https://www.osti.gov/api/v1/records?fulltext=%28%28%22solid+state+synthesis%22+OR+%22solution+phase+synthesis%22+OR+%22melt+synthesis%22+OR+%22hydrothermal+reaction%22%29%29&page=2>; rel="next",
+		<https://www.osti.gov/api/v1/records?fulltext=%28%28%22solid+state+synthesis%22+OR+%22solution+phase+synthesis%22+OR+%22melt+synthesis%22+OR+%22hydrothermal+reaction%22%29%29&page=85>; rel="last"
 		'''
-		Parameters:
-		- fulltext: Searches the article full text (if available) for the provided terms
+		next_page = None
+		for x in s_response.headers.get('Link', '').split(','):
+			if x.endswith('rel="next"'):
+				next_page = x.split(';')[0].strip(' <>')
+				next_page = next_page.split('page=')[1]
+				break
+		
+		return s_response.json(), next_page
+
+
+	def get_article_info(self, item):
+		""" Return (DOI, article info) of a search record, or (None, None) if it has no DOI or full text """
+		if item["doi"] == "":
+			return None, None
+		
+		fulltext_link = ''
+		for x in item["links"]:
+			if x["rel"] == "fulltext":
+				fulltext_link = x["href"]
+				break
+		
+		if fulltext_link == '':
+			return None, None
+		
+		doi = item["doi"].lower()
+		
+		metadata = {}
+		metadata['uid'] = doi
+		metadata['publisher'] = item['publisher'] if 'publisher' in item else None
+		metadata['type'] = item['product_type']	if 'product_type' in item else None	# e.g., journal-article -> https://api.crossref.org/v1/types
+		metadata['title'] = item['title'] if 'title' in item else None
+		metadata['year'] = item['publication_date'] if 'publication_date' in item else None
+		metadata['author'] = []
+		if 'authors' in item:
+			for author in item['authors']:
+				metadata['author'].append(author)
+		metadata['abstract'] = item['description'] if 'description' in item else None
+		
+		return doi, {'link': fulltext_link, 'metadata': metadata}
+
+
+	def write_metadata(self, metadata_list):
+		""" Append metadata of downloaded articles to the metadata file (one JSON object per line) in a single write """
+		if len(metadata_list) == 0:
+			return
+		
+		with open(self.metadata_file, 'a') as outfile:
+			outfile.write(''.join(json.dumps(x) + '\n' for x in metadata_list))
+
+
+	def retrieve_articles(self, query, since=None):
 		'''
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
 		
-		""" Search articles """
-		search_url = "https://www.osti.gov/api/v1/records"
+		Parameters:
+		- fulltext: Searches the article full text (if available) for the provided terms
+		- entry_date_start: records added to OSTI since the date (MM/DD/YYYY)
 		
-		search_headers = {'Content-Type': 'application/json',
-						  'Accept': 'application/json'}
-						  
-		params = {'fulltext': '(' + query + ')', 'page': 1}
+		Note:
+		- Search stage: the next page is requested (prefetched) as soon as the current page arrives, and new articles of the page are queued.
+		- Download stage: a pool of workers downloads full texts from the queue while the search continues.
+		- Metadata of downloaded articles is written to the metadata file in batches.
+		- The checkpoint keeps the next page and the queued articles that are not downloaded yet.
+		'''
+		self.search_params = {'fulltext': '(' + query + ')'}
 		
-		article_info = {}
+		if since is not None:
+			self.search_params['entry_date_start'] = since.strftime('%m/%d/%Y')
 		
+		checkpoint = self.get_checkpoint(query, str(since))	# resume from the last page if the previous run died.
+		state = checkpoint.load()
 		
+		page = state.get('page', 1)
+		pending = state.get('pending', {})	# key: DOI, value: article info (link, metadata) - queued but not downloaded.
 		
 		publisher = {}	# debug
 		
+		doi_queue = queue.Queue()
+		lock = threading.Lock()	# guards pending, metadata_list and the checkpoint.
+		metadata_list = []	# metadata to be written.
 		
+		for doi in self.remove_duplicates(set(pending.keys())):	# resume queued articles that are not downloaded yet.
+			doi_queue.put(doi)
 		
-		
-		""" Search articles """
-		num_queries = 0
-		while True:
-			num_queries += 1
-			#print('num_queries:', num_queries)
-
-			s_response = requests.get(search_url, headers=search_headers, params=params)
+		def download_worker():
+			params = {'directFulltextAccess': 'BNL'}
 			
-			'''
-			print(s_response.url)
-			print(s_response.headers)
-			print(s_response.status_code)
-			print(s_response.text)
-			'''
-
-			if s_response.status_code == 200:
-				''' link example
-				<https://www.osti.gov/api/v1/records?fulltext=%28%28%22solid+state+synthesis%22+OR+%22solution+phase+synthesis%22+OR+%22melt+synthesis%22+OR+%22hydrothermal+reaction%22%29%29&page=2>; rel="next", 
-				<https://www.osti.gov/api/v1/records?fulltext=%28%28%22solid+state+synthesis%22+OR+%22solution+phase+synthesis%22+OR+%22melt+synthesis%22+OR+%22hydrothermal+reaction%22%29%29&page=85>; rel="last"
-				'''
-				next_page = ''
-				for x in s_response.headers['Link'].split(','):
-					if x.endswith('rel="next"'):
-						next_page = x.split(';')[0].strip(' <>')
-						next_page = next_page.split('page=')[1]
-						break
+			while True:
+				doi = doi_queue.get()
+				if doi is None:
+					break
 				
+				with lock:
+					info = pending[doi]
 				
-				print(s_response.headers['Link'])
+				filename = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+				item = FetchItem(doi, info['link'], article_dir(self.destination, filename), filename, '.pdf', params=params)
 				
+				try:
+					response = self.session.get(info['link'], params=params)
+				except requests.exceptions.RequestException as e:
+					logger.error(f'>> Failed to download {doi}: {e}')
+					response = None
 				
-				s_response = s_response.json()
-
-				print(json.dumps(s_response, indent=4, sort_keys=True))
+				is_saved = False
+				if response is not None and response.status_code == 200:
+					is_saved = self.save_article(item, response)	# an invalid document (e.g., an error page) is recorded as a failure.
+				else:
+					if response is not None:
+						self.display_error_msg(response)
+					self.record_failure(item, response.status_code if response is not None else 'request error')
 				
-				for item in s_response:
-					#print('title:', item["title"], '/ doi: https://doi.org/' + item["doi"])
+				with lock:
+					pending.pop(doi, None)
 					
-					if item["doi"] != "":
-						#print(item["doi"])
+					if is_saved:
+						metadata_list.append(info['metadata'])
 						
-						fulltext_link = ''
-						for x in item["links"]:
-							if x["rel"] == "fulltext":
-								fulltext_link = x["href"]
-								break
+						if len(metadata_list) >= self.metadata_batch_size:
+							self.write_metadata(metadata_list)
+							metadata_list.clear()
+		
+		workers = [threading.Thread(target=download_worker) for _ in range(self.max_concurrency)]
+		for w in workers:
+			w.start()
+		
+		""" Search articles """
+		try:
+			with ThreadPoolExecutor(max_workers=1) as executor:
+				future = executor.submit(self.search_page, page)
+				
+				while future is not None:
+					records, next_page = future.result()
+					
+					# prefetch the next page while the current page is processed.
+					future = executor.submit(self.search_page, next_page) if next_page is not None else None
+					
+					article_info = {}
+					for item in records:
+						doi, info = self.get_article_info(item)
+						if doi is None:
+							continue
 						
-						if fulltext_link != '':
-							doi = item["doi"].lower()
-							
-							metadata = {}
-							metadata['uid'] = doi
-							metadata['publisher'] = item['publisher'] if 'publisher' in item else None
-							metadata['type'] = item['product_type']	if 'product_type' in item else None	# e.g., journal-article -> https://api.crossref.org/v1/types
-							metadata['title'] = item['title'] if 'title' in item else None
-							metadata['year'] = item['publication_date'] if 'publication_date' in item else None
-							metadata['author'] = []
-							if 'authors' in item:
-								for author in item['authors']:
-									metadata['author'].append(author)
-							metadata['abstract'] = item['description'] if 'description' in item else None
-
-							article_info[doi] = {'link': fulltext_link, 'metadata': metadata}
-
-
-
-							# debug
-							if metadata['publisher'] is not None:
-								self.update_dict(metadata['publisher'], publisher)
-
-
-
-
-				if next_page == '':
-					break
-				else:
-					print('next_page:', next_page)
-					#search_url = next_page
+						article_info[doi] = info
+						
+						# debug
+						if info['metadata']['publisher'] is not None:
+							self.update_dict(info['metadata']['publisher'], publisher)
 					
-					params['page'] = next_page
-			else:
-				self.display_error_msg(s_response)
-				sys.exit()
-		
+					with lock:
+						duplicate_removed_uids = self.remove_duplicates(set(article_info.keys()).difference(pending.keys()))   # check if it's already downloaded or queued.
+						
+						for doi in duplicate_removed_uids:
+							pending[doi] = article_info[doi]
+							doi_queue.put(doi)
+						
+						if next_page is not None:
+							print('next_page:', next_page)
+							checkpoint.save(page=next_page, pending=pending)
+		finally:
+			for w in workers:
+				doi_queue.put(None)
+			for w in workers:
+				w.join()
+			
+			self.write_metadata(metadata_list)	# write the rest.
 		
 		# debug
 		for elem in sorted(publisher.items(), reverse=True, key=lambda tup: tup[1])[:]:
 			print(': '.join(map(str, elem)) +'\n')
 		
-
-		print('>>> BEFORE number of items:', len(article_info))
-		
-		duplicate_removed_uids = self.check_uids(set(article_info.keys()))   # check if it's already downloaded.
-
-		article_info = {k: v for k, v in article_info.items() if k in duplicate_removed_uids}
-		
-		print('>>> AFTER number of items:', len(article_info))
-		
-
-		""" Download articles """
-		for doi, info in article_info.items():
-			link = info['link']
-			metadata = info['metadata']
-			
-			filename = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
-			
-			params = {'directFulltextAccess': 'BNL'}
-
-			response = requests.get(link, params=params)
-			if response.status_code == 200:
-				
-				print(response.headers)
-				
-				self.write_to_file(response, self.destination, filename, ".pdf")
-
-				# write metadata to file
-				with open(self.destination + filename + '.json', 'w') as outfile:
-					json.dump(metadata, outfile)
-			else:
-				self.display_error_msg(response, member)
-				sys.exit()
-				
-			input()
-			
-		self.save_uids()    # save new uids in the uid file.
+		checkpoint.clear()
 		
 		
 		
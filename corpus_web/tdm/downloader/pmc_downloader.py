@@ -1,13 +1,19 @@
 import os
 import sys
+import time
 import json
+import functools
+from datetime import date
 import csv
 import tarfile
 import requests
 from requests.utils import quote
 from lxml import etree
 from ftplib import FTP
-from base_downloader import BaseDownloader
+from concurrent.futures import ThreadPoolExecutor
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import shard_dir
 import logging
 
 logger = logging.getLogger(__name__)
@@ -33,66 +39,260 @@ class PMCDownloader(BaseDownloader):
 	- https://www.ncbi.nlm.nih.gov/pmc/tools/articles-by-license/
 	- https://www.ncbi.nlm.nih.gov/pmc/tools/id-converter-api/
 	"""
-
+	
+	requests_per_sec = 10	# 10 requests per second with an API key.
+	
+	max_transfers = 4	# the number of parallel package downloads.
+	
+	oa_service_url = 'https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi'
+	oa_package_url = 'https://ftp.ncbi.nlm.nih.gov/pub/pmc/'
+	package_extension = '.tar.gz'	# extension of failed package items (FetchItem) in the failed list.
 
 	def __init__(self):
 		super().__init__('PMC')
+		
+		self.oa_file_list = self.path + 'oa_file_list.csv'	# https://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_file_list.csv
 
 
-	def download_files(self, uids):
+	def get_oa_package_paths(self, pmc_ids):
 		"""
-		params
-		- uids: dict of key: PMCID - value: either DOI or PMCID
+		Return dict of key: PMCID - value: path of the OA package (e.g., oa_package/8e/71/PMC5334499.tar.gz) relative to /pub/pmc.
 		
-		Comments:
-		- Use of OA service https://www.ncbi.nlm.nih.gov/pmc/tools/oa-service/ to get file paths instead of reading oa_file_list.
+		Note:
+		- If the OA file list (oa_file_list.csv) exists, it's used as an index, so no lookup requests are needed.
+		- Otherwise (or for PMCIDs not in the list, e.g., newly added ones), the OA service is queried concurrently.
+		  The OA service takes a single id per request, so lookups are run by a pool of threads sharing the session's rate limiter.
 		"""
-		ftp = FTP('ftp.ncbi.nlm.nih.gov')
-		ftp.login(user='anonymous', passwd='anonymous@anonymous.com')
-		ftp.cwd('/pub/pmc')
+		pmc_ids = set(pmc_ids)
+		paths = {}
+		
+		if os.path.exists(self.oa_file_list):
+			with open(self.oa_file_list, newline='') as f:
+				for row in csv.reader(f):
+					# row: File | Article Citation | Accession ID (PMCID) | Last Updated (YYYY-MM-DD HH:MM:SS) | PMID | License
+					if len(row) > 2 and row[2] in pmc_ids:
+						paths[row[2]] = row[0]
+		
+		def lookup(pmc_id):
+			response = self.session.get(self.oa_service_url, params={'id': pmc_id}, cache_ttl=self.cache_ttl)
+			if response.status_code != 200:
+				self.display_error_msg(response)
+				return pmc_id, None
+			
+			try:
+				root = etree.fromstring(response.content)
+			except etree.XMLSyntaxError as e:	# e.g., an HTML error page with status 200. It fails like an HTTP error, so the other lookups continue.
+				logger.error(f'>> Broken OA service response - {pmc_id}: {e}')
+				return pmc_id, None
+			
+			link = root.find('.//record/link[@format="tgz"]')	# e.g., PMC4486727 -> <error code="idIsNotOpenAccess">
+			if link is None:
+				return pmc_id, None
 
-		for pmc_id, doi in uids.items():
-			found = False
+			return pmc_id, link.get("href").split('/pmc/', 1)[-1]	# e.g., ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_package/8e/71/PMC5334499.tar.gz
+		
+		not_indexed = [x for x in pmc_ids if x not in paths]
+		
+		with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+			for pmc_id, path in executor.map(lookup, not_indexed):
+				if path is not None:
+					paths[pmc_id] = path
+		
+		return paths
 
-			response = requests.get('https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi?id=' + pmc_id)
 
-			if response.status_code == 200:
-				root = etree.fromstring(response.content)
+	def download_package(self, source):
+		"""
+		Download an OA package and extract it on the fly, and return the number of bytes received.
+		
+		Note:
+		- The tarball is read as a stream (mode 'r|gz') from the socket, so it's never written to disk as a temporary file.
+		- Each file of the package is stored in the blob store, so files identical to already downloaded ones (e.g., PDFs of articles
+		  mirrored from other publishers, common figures) take the space once.
+		"""
+		response = self.session.get(self.oa_package_url + source, stream=True)
+		if response.status_code != 200:
+			self.display_error_msg(response)
+			raise DownloadError(self.publisher, response)
+		
+		pmc_id = source.rsplit('/', 1)[-1].split('.', 1)[0]	# e.g., oa_package/8e/71/PMC5334499.tar.gz -> PMC5334499
+		
+		# the package has a top directory named by the PMCID, so it's extracted into the shard directory of the PMCID.
+		destination = os.path.normpath(shard_dir(self.path, pmc_id))
+		
+		with response, tarfile.open(fileobj=response.raw, mode='r|gz') as tar:
+			for member in tar:
+				file = os.path.normpath(os.path.join(destination, member.name))
+				if not member.isfile() or not file.startswith(os.path.join(destination, pmc_id, '')):	# skip links and paths outside the article directory (e.g., PMC123x/ for PMC123).
+					continue
 				
-				link = root.find('.//record/link[@format="tgz"]')
+				if not os.path.exists(os.path.dirname(file)):
+					os.makedirs(os.path.dirname(file))
 				
-				if link is not None:	# e.g., PMC4486727 -> <error code="idIsNotOpenAccess">
-					found = True
-					
-					link = link.get("href")	# e.g., ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_package/8e/71/PMC5334499.tar.gz
+				f = tar.extractfile(member)
+				self.blob_store.put(iter(lambda: f.read(64*1024), b''), file)
+			
+			return response.raw.tell()	# the number of bytes read from the socket.
 
-					source = link.split('/pmc/', 1)[-1]
-					filename = link.rsplit('/', 1)[-1]
 
-					f = open(self.path + filename, 'wb')
-					ftp.retrbinary('RETR ' + source, f.write, 1024)
-					f.close()
+	def fetch_package(self, pmc_id, source, uid):
+		"""
+		Download an OA package and add its uid, and return the number of bytes received (0 if it failed).
+		A failed package is recorded in the failed list, so the retry pass downloads it again (see fetch_article()).
+		"""
+		start_time = time.time()
+		try:
+			num_of_bytes = self.download_package(source)
+		except (DownloadError, requests.exceptions.RequestException, tarfile.TarError) as e:
+			logger.error(f'>> Failed to download {pmc_id}: {e}')
+			self.record_failure(FetchItem(uid, self.oa_package_url + source, shard_dir(self.path, pmc_id), pmc_id, self.package_extension), str(e))
+			return 0
+		
+		elapsed = time.time() - start_time
+		logger.info(f'>> {pmc_id}: {num_of_bytes/1024:.1f} KB in {elapsed:.2f} sec ({num_of_bytes/1024/max(elapsed, 1e-6):.1f} KB/s)')
+		
+		self.update_uid(uid)	# add a new uid - 02-12-2020
+		
+		return num_of_bytes
 
-					tar = tarfile.open(self.path + filename)
-					tar.extractall(self.path)
-					tar.close()
-					
-					os.remove(self.path + filename)
-					
-					self.update_uid(doi)	# add a new uid - 02-12-2020
-					
-			if found is False:
+
+	def fetch_article(self, item):
+		""" Retrieve a recorded failed item. A failed OA package is downloaded and extracted again instead of being written as a file. """
+		if item.extension == self.package_extension:
+			return self.fetch_package(item.filename, item.url[len(self.oa_package_url):], item.uid) > 0
+		
+		return super().fetch_article(item)
+
+
+	def download_files(self, uids):
+		"""
+		params
+		- uids: dict of key: PMCID - value: either DOI or PMCID
+		
+		Comments:
+		- OA packages are fetched over HTTPS from the PMC FTP server (it serves the same files) by a pool of parallel connections.
+		"""
+		paths = self.get_oa_package_paths(uids.keys())
+		
+		for pmc_id in uids:
+			if pmc_id not in paths:
 				logger.error(f'>>> This PMCID - {pmc_id} is not in the server!!!')
-				#BaseDownloader.existing_uids.remove(uids.get(pmc_id))
-				#BaseDownloader.to_be_saved_uids.remove(uids.get(pmc_id))
+		
+		start_time = time.time()
+		total_bytes = 0
+		
+		with ThreadPoolExecutor(max_workers=self.max_transfers) as executor:
+			for num_of_bytes in executor.map(lambda x: self.fetch_package(x, paths[x], uids[x]), paths.keys()):
+				total_bytes += num_of_bytes
+		
+		elapsed = time.time() - start_time
+		print(f'<PMC> #Packages: {len(paths)} | {total_bytes/1024/1024:.1f} MB in {elapsed:.1f} sec ({total_bytes/1024/1024/max(elapsed, 1e-6):.2f} MB/s)')
+
+
+	def retrieve_by_dois(self, dois):
+		"""
+		Download OA packages of the given DOIs (e.g., a DOI list from collaborators), and return the set of DOIs that are not retrieved
+		(e.g., not in PMC, or failed packages).
+		
+		Note:
+		- DOIs are converted to PMCIDs by the ID converter service, which allows for conversion of up to 200 IDs in a single request.
+		"""
+		id_converter_url = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/'
+		id_converter_params = {'tool': 'tdm_project', 'email': 'gpark@bnl.gov', 'format': 'json'}
+		
+		dois = list(dois)
+		uids = {}	# key: PMCID, value: DOI
+		
+		for i in range(0, len(dois), 200):
+			id_converter_params['ids'] = ','.join(dois[i:i + 200])
 			
-		ftp.quit()
+			response = self.session.get(id_converter_url, params=id_converter_params, cache_ttl=self.cache_ttl)
+			
+			if response.status_code != 200:
+				self.display_error_msg(response)
+				raise DownloadError(self.publisher, response)
+			
+			for item in response.json()['records']:
+				if 'pmcid' in item:	# e.g., {"doi": "...", "status": "error", "errmsg": "invalid article id"}
+					uids[item['pmcid']] = item['doi'].lower()
+		
+		self.download_files(uids)
+		
+		return self.get_missing_dois(dois)
+
+
+	def search_page(self, search_url, search_params, id_converter_url, id_converter_params):
+		"""
+		Search a page of PMCIDs and convert them to DOIs, and return (uids, the number of results in the page, the total number of results).
+		uids: dict of key: PMCID - value: either DOI or PMCID (if DOI doesn't exist)
+		"""
+		s_response = self.session.get(search_url, params=search_params, cache_ttl=self.cache_ttl)
+
+		if s_response.status_code != 200:
+			self.display_error_msg(s_response)
+			raise DownloadError(self.publisher, s_response)
+		
+		root = etree.fromstring(s_response.content)
+
+		id_list = [child.text for child in root.find('IdList')]
+		
+		pmc_ids = ','.join(['PMC' + x for x in id_list])
+		
+		id_converter_params = dict(id_converter_params, ids=pmc_ids)
+		
+		c_response = self.session.get(id_converter_url, params=id_converter_params, cache_ttl=self.cache_ttl)
+
+		if c_response.status_code != 200:
+			self.display_error_msg(c_response)
+			raise DownloadError(self.publisher, c_response)
+		
+		uids = {}
+		for item in c_response.json()['records']:
+			#logger.debug(f">>> pmcid: {item['pmcid']} | doi: {item['doi']}")
+			uids[item["pmcid"]] = item["doi"].lower() if 'doi' in item else item["pmcid"]
+		
+		# if the number of results is less than retmax, RetMax returns the number or remaining counts.
+		return uids, int(root.find('RetMax').text), int(root.find('Count').text)
+
+
+	def get_titles(self, summary_url, summary_params):
+		""" Return doi_title of the articles in the summary request """
+		doi_title = {}
+		
+		r = self.session.get(summary_url, params=summary_params, cache_ttl=self.cache_ttl)
+		if r.status_code == 200:
+			root = etree.fromstring(r.content)
+			for doc_sum in root.xpath('DocSum'):
+				doi = doc_sum.findtext('.//Item[@Name="DOI"]')
+				title = doc_sum.findtext('.//Item[@Name="Title"]')
+				doi_title[doi] = title
+		
+		return doi_title
+
+
+	def retrieve_articles(self, query, year, since=None):
+		"""
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
+		  If it's None, articles added in the last 3 days are searched.
+		
+		Note:
+		- It runs the work generator (iter_tasks()) of the crawl alone. The downloader script runs the generators of all publishers in a shared scheduler.
+		"""
+		return self.run_tasks(self.iter_tasks(query, year, since))
 
 
-	def retrieve_articles(self, query, year):
+	def iter_tasks(self, query, year, since=None):
+		"""
+		Yield tasks (CrawlTask) of a crawl, and return doi_title.
+		
+		Note:
+		- Search pages are tasks in order (a page and its ID conversion), and then each OA package is downloaded by a task.
+		  Packages are on the FTP server (another host), so up to 'max_transfers' packages are downloaded at once.
+		"""
 		#search_url = 'https://www.ncbi.nlm.nih.gov/pmc'
 		#params = {'term': query + ' AND cc license[filter]', 'retmax': 500}
-		#response = requests.get(search_url, params=params)
+		#response = self.session.get(search_url, params=params)
 
 		search_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi'
 		id_converter_url = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/'
@@ -114,51 +314,44 @@ class PMCDownloader(BaseDownloader):
 		#if year is not None:
 		#	search_params['term'] += ' AND ' + str(year) + '[pdat]'
 		
-		search_params['reldate'] = 3
+		# datetype 'edat' is the date an article was added to PMC.
+		if since is not None:
+			search_params['mindate'] = since.strftime('%Y/%m/%d')
+			search_params['maxdate'] = date.today().strftime('%Y/%m/%d')
+		else:
+			search_params['reldate'] = 3
 		search_params['datetype'] = 'edat'
 		
 		# retrieve data in batches of 200
 		# ID converter service allows for conversion of up to 200 IDs in a single request.
-		uids = {}	# key: PMCID, value: either DOI or PMCID (if DOI doesn't exist)
-		doi_title = {}	# this is to save the history of downloads.
+		# the key doesn't have maxdate (today), so a run that resumes on a later day finds the checkpoint.
+		checkpoint = self.get_checkpoint(query, year, str(since))	# resume from the last batch if the previous run died.
+		state = checkpoint.load()
+		
+		uids = state.get('uids', {})	# key: PMCID, value: either DOI or PMCID (if DOI doesn't exist)
+		
+		retstart = state.get('retstart', 0)
+		if retstart > 0:
+			search_params['retstart'] = retstart
 		
-		retstart = 0
 		while True:
-			s_response = requests.get(search_url, params=search_params)
-
-			if s_response.status_code == 200:
-				root = etree.fromstring(s_response.content)
-
-				id_list = [child.text for child in root.find('IdList')]
-				
-				pmc_ids = ','.join(['PMC' + x for x in id_list])
-				
-				id_converter_params['ids'] = pmc_ids
-				
-				c_response = requests.get(id_converter_url, params=id_converter_params)
-
-				if c_response.status_code == 200:
-					c_response = c_response.json()
-
-					for item in c_response['records']:
-						#logger.debug(f">>> pmcid: {item['pmcid']} | doi: {item['doi']}")
-						uids[item["pmcid"]] = item["doi"].lower() if 'doi' in item else item["pmcid"]
-					
-					# if the number of results is less than retmax, RetMax returns the number or remaining counts.
-					retstart += int(root.find('RetMax').text)
+			task = self.make_task(search_url, functools.partial(self.search_page, search_url, dict(search_params), id_converter_url, id_converter_params), 'search')
+			yield task
+			yield None	# the next page starts after this page.
+			
+			page_uids, num_of_results, count = task.result
+			uids.update(page_uids)
+			
+			retstart += num_of_results
 
-					#print('retstart:', retstart)
+			#print('retstart:', retstart)
 
-					if retstart == int(root.find('Count').text):
-						break
+			if retstart >= count:
+				break
 
-					search_params['retstart'] = retstart
-				else:
-					self.display_error_msg(c_response)
-					sys.exit()
-			else:
-				self.display_error_msg(s_response)
-				sys.exit()
+			search_params['retstart'] = retstart
+			
+			checkpoint.save(retstart=retstart, uids=uids)
 		
 		print('<PMC> #UIDs w/  duplicates:', len(uids))
 		
@@ -171,15 +364,27 @@ class PMCDownloader(BaseDownloader):
 		# find title of article.
 		ids_for_summary = ','.join([x.replace('PMC', '') for x in uids.keys()])
 		summary_params = {'api_key': self.api_key, 'db': 'pmc', 'id': ids_for_summary}
-		r = requests.get(summary_url, params=summary_params)
-		if r.status_code == 200:
-			root = etree.fromstring(r.content)
-			for doc_sum in root.xpath('DocSum'):
-				doi = doc_sum.findtext('.//Item[@Name="DOI"]')
-				title = doc_sum.findtext('.//Item[@Name="Title"]')
-				doi_title[doi] = title
+		title_task = self.make_task(summary_url, functools.partial(self.get_titles, summary_url, summary_params), 'search')
 		
-		self.download_files(uids)
+		paths_task = self.make_task(self.oa_service_url, functools.partial(self.get_oa_package_paths, uids.keys()), 'search')
+		
+		yield title_task
+		yield paths_task
+		yield None	# wait for titles and package paths.
+		
+		doi_title = title_task.result	# this is to save the history of downloads.
+		paths = paths_task.result
+		
+		for pmc_id in uids:
+			if pmc_id not in paths:
+				logger.error(f'>>> This PMCID - {pmc_id} is not in the server!!!')
+		
+		for pmc_id, source in paths.items():
+			yield self.make_task(self.oa_package_url + source, functools.partial(self.fetch_package, pmc_id, source, uids[pmc_id]), 'package', max_per_host=self.max_transfers)
+		
+		yield None	# wait for the packages.
+		
+		checkpoint.clear()
 		
 		#self.save_uids()    # save new uids in the uid file. -> changed to save uids right after write_to_file() since errors frequently occur between articles. - 02-12-2020
 		
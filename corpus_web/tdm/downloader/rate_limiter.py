@@ -0,0 +1,171 @@
+import time
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+	"""
+	Token bucket that throttles requests to a single publisher.
+
+	Note:
+	- Tokens are refilled at 'rate' tokens per second up to 'burst' tokens, and each request consumes a token.
+	- The rate adapts to the responses (AIMD): it is halved when the server returns 429,
+	  and it recovers to the configured rate step by step while requests succeed.
+	- 'Retry-After' and an exhausted 'X-RateLimit-Remaining' (with 'X-RateLimit-Reset') block all requests until the given time.
+	- It is thread-safe, so that concurrent workers of the same publisher share the limit.
+	- A scheduler can take a token when it starts a task (try_acquire), and the first request of the task in the worker thread uses it (reserved),
+	  so tasks that are started in the same tick don't block in acquire() waiting for the same token.
+
+	References:
+	- https://en.wikipedia.org/wiki/Token_bucket
+	- https://dev.elsevier.com/api_key_settings.html
+	- https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Retry-After
+	"""
+
+	min_rate = 0.01			# the lowest rate (one request every 100 seconds) when it backs off.
+	recovery_step = 0.1		# the ratio of the max rate restored after every successful response.
+
+	def __init__(self, rate=None, burst=1):
+		"""
+		params
+		- rate: the max number of requests per second. None means no limit.
+		- burst: the max number of requests that can be sent at once after an idle period.
+		"""
+		self.max_rate = rate
+		self.rate = rate
+		self.burst = max(1, burst)
+		self.tokens = self.burst
+		self.enabled = True
+		self.blocked_until = 0.0	# time.time() until when no request is allowed (e.g., Retry-After).
+
+		self._last_refill = time.monotonic()
+		self._lock = threading.Lock()
+		self._local = threading.local()	# 'has_token' is set in a worker thread that holds a reserved token.
+
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self._last_refill)*self.rate)
+		self._last_refill = now
+
+
+	def acquire(self):
+		""" Block until a request is allowed """
+		if not self.enabled:
+			return
+
+		if getattr(self._local, 'has_token', False):	# the token was taken by try_acquire().
+			self._local.has_token = False
+			return
+
+		while True:
+			with self._lock:
+				wait = self.blocked_until - time.time()
+
+				if wait <= 0 and self.rate is not None:
+					self._refill()
+					if self.tokens >= 1:
+						self.tokens -= 1
+						return
+					wait = (1 - self.tokens)/self.rate
+				elif wait <= 0:
+					return
+
+			time.sleep(wait)
+
+
+	def get_delay(self):
+		""" Return the seconds until a request is allowed (0 if it's allowed now) without consuming a token """
+		return self._get_delay(consume=False)
+
+
+	def try_acquire(self):
+		""" Consume a token and return 0 if a request is allowed now. Otherwise, return the seconds until it's allowed without consuming a token. """
+		return self._get_delay(consume=True)
+
+
+	def _get_delay(self, consume):
+		if not self.enabled:
+			return 0
+
+		with self._lock:
+			wait = self.blocked_until - time.time()
+			if wait > 0:
+				return wait
+
+			if self.rate is None:
+				return 0
+
+			self._refill()
+			if self.tokens < 1:
+				return (1 - self.tokens)/self.rate
+
+			if consume:
+				self.tokens -= 1
+			return 0
+
+
+	@contextmanager
+	def reserved(self):
+		"""
+		Let the first acquire() in this thread use the token taken by try_acquire().
+		The token is dropped if no request is sent (e.g., a cache hit).
+
+		Usage:
+		- with rate_limiter.reserved(): task.run()
+		"""
+		self._local.has_token = True
+		try:
+			yield
+		finally:
+			self._local.has_token = False
+
+
+	def update(self, response):
+		""" Adapt the rate to the rate limit headers of the response """
+		headers = response.headers
+
+		with self._lock:
+			delay = self.parse_retry_after(headers.get('Retry-After'))
+
+			remaining = headers.get('X-RateLimit-Remaining')
+			reset = headers.get('X-RateLimit-Reset')
+			if remaining is not None and remaining.strip().isdigit() and int(remaining) == 0 and reset is not None:
+				try:
+					delay = max(delay or 0, float(reset) - time.time())	# reset is epoch seconds.
+				except ValueError:
+					pass
+
+			if delay is not None and delay > 0:
+				self.blocked_until = max(self.blocked_until, time.time() + delay)
+				logger.debug(f'>> Rate limited for {delay:.1f} seconds: {response.url}')
+
+			if self.max_rate is None:
+				return
+
+			if response.status_code == 429:
+				self.rate = max(self.min_rate, self.rate/2)
+				self.tokens = 0
+				logger.debug(f'>> 429 Too Many Requests, decrease the rate to {self.rate:.3f} requests/sec')
+			elif response.status_code < 400 and self.rate < self.max_rate:
+				self.rate = min(self.max_rate, self.rate + self.max_rate*self.recovery_step)
+
+
+	@staticmethod
+	def parse_retry_after(value):
+		""" Retry-After is either seconds or an HTTP-date """
+		if value is None:
+			return None
+
+		value = value.strip()
+		if value.isdigit():
+			return float(value)
+
+		try:
+			return parsedate_to_datetime(value).timestamp() - time.time()
+		except (TypeError, ValueError):
+			return None
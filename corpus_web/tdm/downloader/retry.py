@@ -0,0 +1,90 @@
+import time
+import random
+import threading
+import requests
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+	""" Requests to the host are paused since it failed too many times in a row """
+
+
+class RetryPolicy:
+	"""
+	Exponential backoff with (full) jitter and a max-attempt budget.
+
+	Note:
+	- The delay before the n-th retry is a random value between 0 and min(max_delay, base_delay * 2^n),
+	  so that concurrent workers don't retry at the same time.
+	- Only transient errors are retried: connection errors, timeouts, 429 and 5xx gateway/server errors.
+
+	References:
+	- https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+	"""
+
+	retry_status_codes = {429, 500, 502, 503, 504}
+
+	def __init__(self, max_attempts=5, base_delay=1, max_delay=60):
+		self.max_attempts = max_attempts
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+
+
+	def is_retryable(self, response):
+		return response.status_code in self.retry_status_codes
+
+
+	def backoff(self, attempt):
+		""" Sleep before the next attempt (attempt starts from 1) """
+		delay = random.uniform(0, min(self.max_delay, self.base_delay*(2**attempt)))
+		time.sleep(delay)
+
+
+class CircuitBreaker:
+	"""
+	Per-host circuit breaker.
+
+	Note:
+	- closed: requests are sent as usual. After 'failure_threshold' consecutive failures, it opens.
+	- open: requests fail immediately with CircuitOpenError for 'reset_timeout' seconds, so one publisher's outage
+	  doesn't block the whole run while the other publishers continue.
+	- half-open: after the timeout, one trial request is allowed. Success closes the circuit, and failure opens it again.
+
+	References:
+	- https://martinfowler.com/bliki/CircuitBreaker.html
+	"""
+
+	def __init__(self, failure_threshold=5, reset_timeout=300):
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.failures = 0
+		self.opened_at = None
+		self._lock = threading.Lock()
+
+
+	def before_request(self, host):
+		with self._lock:
+			if self.opened_at is None:
+				return
+
+			if time.time() - self.opened_at < self.reset_timeout:
+				raise CircuitOpenError(f'Circuit is open for {host}')
+
+			self.opened_at = time.time()	# half-open: allow a trial request, and block the others until it finishes.
+
+
+	def record_success(self):
+		with self._lock:
+			self.failures = 0
+			self.opened_at = None
+
+
+	def record_failure(self, host):
+		with self._lock:
+			self.failures += 1
+			if self.failures >= self.failure_threshold:
+				if self.opened_at is None:
+					logger.error(f'>> Circuit opened for {host} after {self.failures} consecutive failures')
+				self.opened_at = time.time()
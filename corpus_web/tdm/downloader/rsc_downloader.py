@@ -4,8 +4,9 @@ import json
 import re
 import lxml
 import requests
-from time import sleep
-from base_downloader import BaseDownloader
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import article_dir
 
 import chemdataextractor.scrape.pub.rsc as RSC
 from chemdataextractor.scrape import Selector
@@ -30,40 +31,43 @@ class RSCDownloader(BaseDownloader):
 	- 
 	"""
 	
-	rsc_scraper = RSC.RscSearchScraper()
-
+	requests_per_sec = 0.1	# Keep delays to 10-20 seconds between requests.
+	
 	def __init__(self):
 		super().__init__('RSC')
-		self.sleep_sec = 10	# Keep delays to 10-20 seconds between requests.
 
 
-	def retrieve_articles(self, query):
+	def retrieve_articles(self, query, since=None):
 		'''
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
+		  The search doesn't take a date, so results are sorted by date, and paging stops at the first page with no new articles.
+		
 		Parameters:
 		- 
 		'''
 		params = {'Category': 'Journal', 
 				  'searchtext': query,	# don't use 'ExactText'
 				  'OpenAccess': 'false',
-				  'SortBy': 'Relevance',
+				  'SortBy': 'Relevance' if since is None else 'Latest',
 				  'PageSize': 100}
-				  
-		headers = {'User-Agent': 'TDMCrawler; mailto: gpark@bnl.gov; BNL CSI Literature mining project'}
 		
-		s_response = self.rsc_scraper.http.get('https://pubs.rsc.org/en/results', params=params, headers=headers)
+		s_response = self.session.get('https://pubs.rsc.org/en/results', params=params)
 		
-		all_new_doi_title = {}	# this is to save the history of downloads.
+		checkpoint = self.get_checkpoint(query, str(since))	# resume from the last page if the previous run died.
+		state = checkpoint.load()
+		
+		all_new_doi_title = state.get('doi_title', {})	# this is to save the history of downloads.
 		
 		if s_response.status_code == 200:
 			selector = Selector.from_html(s_response)
-			sessionkey = selector.css('#SearchTerm::attr("value")').extract()[0]
+			sessionkey = selector.css('#SearchTerm::attr("value")').extract()[0]	# a new session key is needed for every run.
 
-			page_num = 1
+			page_num = state.get('page_num', 1)
 			while True:
 				searchdata = {'searchterm': sessionkey, 'resultcount': 100, 'category': 'journal', 'pageno': page_num}
 				
-				sleep(self.sleep_sec)
-				s_response = self.rsc_scraper.http.post('https://pubs.rsc.org/en/search/journalresult', data=searchdata, headers=headers)
+				s_response = self.session.post('https://pubs.rsc.org/en/search/journalresult', data=searchdata)
 				
 				if s_response.status_code == 200:
 					doc = lxml.html.fromstring(s_response.text)
@@ -100,21 +104,16 @@ class RSCDownloader(BaseDownloader):
 					all_new_doi_title.update({k: v for k, v in doi_title.items() if k in duplicate_removed_uids})
 
 					""" Download articles """
+					items = []
 					for doi, html_link in article_info.items():
-						sleep(self.sleep_sec)
-						r_response = self.rsc_scraper.http.get(html_link, headers=headers)
-
-						if r_response.status_code == 200:
-							file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
-							file = file.lower()	# lowercase 
-							file_dir = self.path + file + '/'
-							os.mkdir(file_dir)	# create a directory for each article.
-							
-							self.write_to_file(r_response, file_dir, file, ".html")
-							self.update_uid(doi)	# add a new uid - 02-12-2020
-						else:
-							self.display_error_msg(r_response)
-							sys.exit()
+						file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+						file = file.lower()	# lowercase 
+						file_dir = article_dir(self.path, file)
+						
+						items.append(FetchItem(doi, html_link, file_dir, file, ".html"))
+					
+					for item in self.fetch_articles(items):
+						all_new_doi_title.pop(item.uid, None)
 					
 					num_of_results = len(articles)
 
@@ -122,16 +121,21 @@ class RSCDownloader(BaseDownloader):
 					
 					if num_of_results < 100:
 						break
+					elif since is not None and len(duplicate_removed_uids) == 0:	# the rest are older articles downloaded in the previous runs.
+						break
 					else:
 						page_num += 1
+						checkpoint.save(page_num=page_num, doi_title=all_new_doi_title)
 				else:
 					self.display_error_msg(s_response)
-					sys.exit()
+					raise DownloadError(self.publisher, s_response)
 
 			#self.save_uids()    # save new uids in the uid file. -> changed to save uids right after write_to_file() since errors frequently occur between articles. - 02-12-2020
 			
+			checkpoint.clear()
+			
 			return all_new_doi_title
 		else:
 			self.display_error_msg(s_response)
-			sys.exit()
+			raise DownloadError(self.publisher, s_response)
 
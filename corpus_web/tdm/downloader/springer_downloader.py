@@ -1,10 +1,14 @@
 import os
 import sys
 import json
+import functools
 import requests
 import time
 from time import sleep
-from base_downloader import BaseDownloader
+from datetime import date
+from base_downloader import BaseDownloader, DownloadError
+from fetch_engine import FetchItem
+from archive_layout import article_dir
 import logging
 
 from lxml import etree
@@ -27,8 +31,138 @@ class SpringerDownloader(BaseDownloader):
 		super().__init__('Springer')
 	
 	
-	def retrieve_articles(self, query, year):
+	def auth_params(self, item):
+		return {'api_key': self.api_key}
+	
+	
+	def save_record(self, record):
+		""" Write a new article (JATS record) to its directory, and return (DOI, title), or (None, None) if it's already downloaded """
+		doi = ''
+		title = ''
+		if record.tag == 'book-part-wrapper':
+			chapter = record.find('.//book-part[@book-part-type="chapter"]')
+			chapter_meta = chapter.find('.//book-part-meta')
+			doi = chapter_meta.findtext('.//book-part-id[@book-part-id-type="doi"]')
+			title = chapter_meta.findtext('.//title-group/title')
+		elif record.tag == 'article':
+			article_meta = record.find('.//article-meta')
+			doi = article_meta.findtext('.//article-id[@pub-id-type="doi"]')
+			title = article_meta.findtext('.//article-title')
+
+		if not doi or doi in self.uid_registry:	# skip already downloaded articles.
+			return None, None
+		
+		#print("--- New article: %s ---" % doi)
+		
+		file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+		file = file.lower()	# lowercase 
+		file_dir = article_dir(self.path, file)
+		if not os.path.exists(file_dir):
+			os.makedirs(file_dir)	# create a directory for each article.
+
+		str_val = etree.tostring(record, pretty_print=True)
+		self.blob_store.put([str_val], file_dir + file + '.xml')
+		self.update_uid(doi)	# add a new uid - 02-12-2020
+		
+		return doi, title
+	
+	
+	def iter_records(self, response):
+		"""
+		Parse a search response (requested with stream=True) record by record, and yield records (article or book-part-wrapper elements).
+		
+		Note:
+		- The response is parsed incrementally while it's read from the socket, so neither the response nor the whole tree is kept in memory.
+		- A record is freed after it's yielded (with the records before it), so memory doesn't grow with the number of records in a page.
+		
+		References:
+		- https://lxml.de/parsing.html#iterparse-and-iterwalk
+		"""
+		response.raw.decode_content = True	# e.g., gzip
+		
+		try:
+			for _, elem in etree.iterparse(response.raw, events=('end',), huge_tree=True):
+				parent = elem.getparent()
+				if parent is None or parent.tag != 'records':
+					continue
+				
+				yield elem
+				
+				elem.clear()
+				while elem.getprevious() is not None:
+					del parent[0]
+		except etree.XMLSyntaxError as e:	# e.g., the connection is dropped in the middle of the page.
+			logger.error(f'>> Broken search response: {e} | URL: {response.url}')
+			raise DownloadError(self.publisher, response)
+	
+	
+	def retrieve_by_dois(self, dois):
+		"""
+		Download articles of the given DOIs (e.g., a DOI list from collaborators), and return the set of DOIs that are not retrieved.
+		
+		Note:
+		- DOIs are ORed in a query, so a batch of up to 'max_rows' (the max number of results in a single response) articles is retrieved per request.
+		- DOIs are quoted since some of them have parentheses (see the class docstring).
+		"""
+		max_rows = 20
+		search_url = "https://spdi.public.springernature.app/xmldata/jats"
+		
+		dois = list(dois)
+		
+		for i in range(0, len(dois), max_rows):
+			params = {'q': ' OR '.join('doi:"' + x + '"' for x in dois[i:i + max_rows]), 's': 1, 'p': max_rows, 'api_key': self.api_key}
+			
+			response = self.session.get(search_url, params=params, stream=True)
+			
+			if response.status_code != 200:
+				self.display_error_msg(response)
+				raise DownloadError(self.publisher, response)
+			
+			with response:
+				for record in self.iter_records(response):
+					self.save_record(record)
+		
+		return self.get_missing_dois(dois)
+	
+	
+	def retrieve_page(self, search_url, params):
+		""" Retrieve a search page, save its new articles, and return doi_title of the page, or None if the page has no records (the end of results) """
+		response = self.session.get(search_url, params=params, stream=True)	# records are parsed and saved while the page is read.
+		
+		if response.status_code != 200:	# e.g., 504 Gateway Time-out after retries. The checkpoint keeps the page for the next run.
+			self.display_error_msg(response)
+			raise DownloadError(self.publisher, response)
+		
+		num_of_records = 0
+		doi_title = {}
+		
+		with response:
+			for record in self.iter_records(response):
+				num_of_records += 1
+				
+				doi, title = self.save_record(record)
+				
+				if doi is not None:
+					doi_title[doi] = title
+		
+		return doi_title if num_of_records > 0 else None
+	
+	
+	def retrieve_articles(self, query, year, since=None):
+		"""
+		params
+		- since: start date (datetime.date) of the delta query, which is the watermark of the last successful crawl.
+		
+		Note:
+		- It runs the work generator (iter_tasks()) of the crawl alone. The downloader script runs the generators of all publishers in a shared scheduler.
+		"""
+		return self.run_tasks(self.iter_tasks(query, year, since))
+	
+	
+	def iter_tasks(self, query, year, since=None):
 		'''
+		Yield tasks (CrawlTask) of a crawl, and return doi_title. Each search page is a task, and articles are saved from the page.
+		
 		Parameters
 		- s: Return results starting at the number specified.
 		- p: The maximum number of results returned in a single query is 20 in the case of Openaccess requests
@@ -38,77 +172,34 @@ class SpringerDownloader(BaseDownloader):
 		params = {'q': query, 's': 1, 'p': max_rows, 'api_key': self.api_key}
 		
 		if year is not None:
-			params['q'] += 'year:' + str(year)
+			params['q'] += ' year:' + str(year)
+		
+		if since is not None:	# articles published online since the date.
+			params['q'] += ' onlinedatefrom:' + since.isoformat() + ' onlinedateto:' + date.today().isoformat()
 
 		search_url = "https://spdi.public.springernature.app/xmldata/jats"
 		
-		doi_title = {}	# this is to save the history of downloads.
+		checkpoint = self.get_checkpoint(query, year, str(since))	# resume from the last page if the previous run died.
+		state = checkpoint.load()
+		
+		params['s'] = state.get('s', 1)
+		doi_title = state.get('doi_title', {})	# this is to save the history of downloads.
 		
-		num_queries = 0
 		while True:
-			num_queries += 1
-
-			response = requests.get(search_url, params=params)
-
-			'''
-			print(response.headers)
-			print(response.text)
+			task = self.make_task(search_url, functools.partial(self.retrieve_page, search_url, dict(params)), 'search')
+			yield task
+			yield None	# the next page starts after this page.
 			
-			with open('temp.txt', 'wb') as file:
-				for chunk in response.iter_content(2048):
-					file.write(chunk)
+			if task.result is None:
+				break
 			
-			input()
-			'''
+			doi_title.update(task.result)
 			
-			if response.status_code == 200:
-				root = etree.fromstring(response.text)
-				result = root.find('.//result')
-				records = root.find('.//records')
-				
-				if len(records) == 0:
-					break
-				
-				# debug
-				#for child in result:
-				#	print(child.tag + ': ' + child.text)
-
-				for record in records:
-					doi = ''
-					title = ''
-					if record.tag == 'book-part-wrapper':
-						chapter = record.find('.//book-part[@book-part-type="chapter"]')
-						chapter_meta = chapter.find('.//book-part-meta')
-						doi = chapter_meta.findtext('.//book-part-id[@book-part-id-type="doi"]')
-						title = chapter_meta.findtext('.//title-group/title')
-					elif record.tag == 'article':
-						article_meta = record.find('.//article-meta')
-						doi = article_meta.findtext('.//article-id[@pub-id-type="doi"]')
-						title = article_meta.findtext('.//article-title')
-
-					if doi != '' and doi not in self.existing_uids:	# skip already downloaded articles.
-						
-						#print("--- New article: %s ---" % doi)
-						
-						file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
-						file = file.lower()	# lowercase 
-						file_dir = self.path + file + '/'
-						if not os.path.exists(file_dir):
-							os.mkdir(file_dir)	# create a directory for each article.
-
-						str_val = etree.tostring(record, pretty_print=True)
-						with open(file_dir + file + '.xml', 'wb') as file:
-							file.write(str_val)
-						self.update_uid(doi)	# add a new uid - 02-12-2020
-						
-						doi_title[doi] = title
-						
-				params['s'] += max_rows
-			elif response.status_code == 504:
-				print('>> 504 Gateway Time-out:', doi)
-			else:
-				self.display_error_msg(response)
-				sys.exit()
+			params['s'] += max_rows
+			
+			checkpoint.save(s=params['s'], doi_title=doi_title)
+		
+		checkpoint.clear()
 		
 		return doi_title
 		
@@ -188,7 +279,7 @@ class SpringerDownloader(BaseDownloader):
 		while True:
 			num_queries += 1
 
-			s_response = requests.get(search_url, params=params)
+			s_response = self.session.get(search_url, params=params)
 
 			if s_response.status_code == 200:
 				s_response = s_response.json()
@@ -204,7 +295,7 @@ class SpringerDownloader(BaseDownloader):
 				params['s'] += max_rows
 			else:
 				self.display_error_msg(s_response)
-				sys.exit()
+				raise DownloadError(self.publisher, s_response)
 		
 		
 		print(len(dois))
@@ -215,28 +306,17 @@ class SpringerDownloader(BaseDownloader):
 		
 		input()
 		
+		items = []
 		for doi in dois:
-			retrieval_url = "http://api.springernature.com/openaccess/jats" + \
-							"?q=doi:" + doi + \
-							"&api_key=" + self.api_key
+			retrieval_url = "http://api.springernature.com/openaccess/jats"
 			
-			sleep(1)
-			r_response = requests.get(retrieval_url)
+			file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
+			file = file.lower()	# lowercase 
+			file_dir = article_dir(self.path, file)
 			
-			#print(r_response.headers)
-
-			if r_response.status_code == 200:
-				file = ''.join(i for i in doi if i.isalnum())   # special characters are removed for filenames.
-				file = file.lower()	# lowercase 
-				file_dir = self.path + file + '/'
-				os.mkdir(file_dir)	# create a directory for each article.
-				
-				self.write_to_file(r_response, file_dir, file, ".xml")
-				self.update_uid(doi)	# add a new uid - 02-12-2020
-			elif r_response.status_code == 504:
-				print('>> 504 Gateway Time-out:', doi)
-			else:
-				self.display_error_msg(r_response)
-				sys.exit()
+			items.append(FetchItem(doi, retrieval_url, file_dir, file, ".xml", params={'q': 'doi:' + doi}))
+		
+		for item in self.fetch_articles(items):
+			print('>> Failed:', item.uid)
 		
 		#self.save_uids()    # save new uids in the uid file. -> changed to save uids right after write_to_file() since errors frequently occur between articles. - 02-12-2020
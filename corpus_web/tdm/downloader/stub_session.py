@@ -0,0 +1,108 @@
+import io
+import os
+import json
+from unittest import mock
+
+import base_downloader
+
+
+class StubResponse:
+	""" Response of StubSession with the parts of requests.Response that downloaders use """
+
+	def __init__(self, status_code=200, content=b'', headers=None, url=''):
+		self.status_code = status_code
+		self.content = content
+		self.headers = dict(headers or {})
+		self.url = url
+		self.raw = io.BytesIO(content)
+
+
+	@property
+	def text(self):
+		return self.content.decode(errors='replace')
+
+
+	def json(self):
+		return json.loads(self.content)
+
+
+	def iter_content(self, chunk_size=1):
+		for i in range(0, len(self.content), chunk_size):
+			yield self.content[i:i + chunk_size]
+
+
+	def close(self):
+		pass
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
+
+
+class StubSession:
+	"""
+	Session for tests that returns canned responses instead of sending requests.
+
+	params
+	- handler: function(method, url, kwargs) that returns a StubResponse, or raises an exception (e.g., requests.exceptions.ConnectionError).
+	"""
+
+	def __init__(self, handler):
+		self.handler = handler
+		self.calls = []	# (method, url)
+		self.num_of_requests = 0
+		self.num_of_retries = 0
+
+
+	def request(self, method, url, **kwargs):
+		self.calls.append((method, url))
+		self.num_of_requests += 1
+
+		response = self.handler(method, url, kwargs)
+		response.url = response.url or url
+
+		return response
+
+
+	def get(self, url, **kwargs):
+		return self.request('GET', url, **kwargs)
+
+
+	def put(self, url, **kwargs):
+		return self.request('PUT', url, **kwargs)
+
+
+	def post(self, url, **kwargs):
+		return self.request('POST', url, **kwargs)
+
+
+def make_downloader(cls, root, session=None, options=None):
+	"""
+	Return a downloader (e.g., PMCDownloader) whose archive, registry and checkpoints are in the root directory (e.g., a temporary directory).
+
+	params
+	- options: additional lines of the info file (e.g., ['Frontier_journal_mode = DELETE']).
+	"""
+	names = ['AAAS', 'APS', 'Crossref', 'Elsevier', 'OSTI', 'PMC', 'RSC', 'Springer']
+
+	lines = ['UID_list = ' + os.path.join(root, 'uid_list.txt')]
+	for name in names:
+		lines.append(f'API_key/{name} = TEST_KEY')
+		lines.append(f'Path/{name} = ' + os.path.join(root, 'archive', name, ''))
+	lines.extend(options or [])
+
+	info_file = os.path.join(root, 'api_key_and_archive_info.txt')
+	with open(info_file, 'w') as f:
+		f.write('\n'.join(lines) + '\n')
+
+	with mock.patch.object(base_downloader, 'info_file', info_file):
+		downloader = cls()
+
+	if session is not None:
+		downloader.session = session
+
+	return downloader
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from archive_layout import article_dir, iter_article_dirs, iter_files, iter_articles, migrate
+
+
+def touch(path):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'w') as f:
+		f.write('x')
+
+
+class ArchiveLayoutTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.root = self.tmp_dir.name
+
+
+	def tearDown(self):
+		self.tmp_dir.cleanup()
+
+
+	def test_migrate(self):
+		touch(os.path.join(self.root, 'S001', 'S001.xml'))
+		touch(os.path.join(self.root, 'Emerald_a.pdf'))
+		touch(os.path.join(self.root, 'Emerald_a.json'))
+		touch(os.path.join(self.root, 'oa_file_list.csv'))
+
+		self.assertEqual(migrate(self.root), 3)
+		self.assertEqual(migrate(self.root), 0)	# it's safe to run it again.
+
+		self.assertTrue(os.path.isfile(article_dir(self.root, 'S001') + 'S001.xml'))
+		self.assertTrue(os.path.isfile(article_dir(self.root, 'Emerald_a') + 'Emerald_a.pdf'))
+		self.assertTrue(os.path.isfile(article_dir(self.root, 'Emerald_a') + 'Emerald_a.json'))
+		self.assertTrue(os.path.isfile(os.path.join(self.root, 'oa_file_list.csv')))
+		self.assertEqual(sorted(os.path.basename(x) for x in iter_article_dirs(self.root)), ['Emerald_a', 'S001'])
+
+
+	def test_iter_files_recurses_into_article_dirs(self):
+		dir = article_dir(self.root, '101a')
+		touch(dir + 'PMC1/PMC1.nxml')	# extracted from a PMC package.
+		touch(dir + 'PMC1/figures/f1.jpg')
+		touch(os.path.join(self.root, 'legacy.xml'))
+
+		walked = list(iter_files(self.root))
+
+		self.assertEqual(walked[0], (self.root, ['legacy.xml']))
+		files = [os.path.relpath(os.path.join(path, x), dir) for path, files in walked[1:] for x in files]
+		self.assertEqual(sorted(files), [os.path.join('PMC1', 'PMC1.nxml'), os.path.join('PMC1', 'figures', 'f1.jpg')])
+
+
+	def test_iter_articles(self):
+		touch(article_dir(self.root, 'S001') + 'S001.xml')
+		touch(article_dir(self.root, 'S001') + 'object.xml')	# a supplementary object.
+		touch(article_dir(self.root, 'S002') + 'S002.pdf')
+		touch(os.path.join(self.root, 'S003', 'S003.xml'))	# legacy article directory.
+		touch(os.path.join(self.root, 'S004.xml'))	# legacy flat file.
+
+		articles = [os.path.relpath(x, self.root) for x in iter_articles(self.root, '.xml')]
+
+		self.assertEqual(sorted(os.path.basename(x) for x in articles), ['S001.xml', 'S003.xml', 'S004.xml'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,91 @@
+import os
+import hashlib
+import tempfile
+import unittest
+
+from blob_store import BlobStore
+from document_validator import DocumentValidator, InvalidDocumentError
+
+
+XML = b'<root>' + b'<p>text</p>'*20 + b'</root>'
+
+
+class BlobStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+		self.archive = os.path.join(self.tmp_dir.name, 'archive')
+		os.makedirs(self.archive)
+
+
+	def tearDown(self):
+		self.tmp_dir.cleanup()
+
+
+	def file(self, name):
+		return os.path.join(self.archive, name)
+
+
+	def test_identical_payloads_are_stored_once(self):
+		digest, is_new = self.store.put([XML[:10], XML[10:]], self.file('a.xml'))
+		self.assertEqual(digest, hashlib.sha256(XML).hexdigest())
+		self.assertTrue(is_new)
+
+		self.assertEqual(self.store.put([XML], self.file('b.xml')), (digest, False))
+
+		self.assertTrue(self.store.is_shared(self.file('a.xml')))
+		self.assertEqual(os.stat(self.file('a.xml')).st_ino, os.stat(self.file('b.xml')).st_ino)
+		self.assertEqual(os.stat(self.store.get_path(digest)).st_nlink, 3)
+		self.assertEqual(os.listdir(self.store.tmp_dir), [])
+
+
+	def test_file_is_replaced(self):
+		self.store.put([XML], self.file('a.xml'))
+		self.store.put([XML + b'\n'], self.file('b.xml'))
+
+		self.store.put([XML + b'\n'], self.file('a.xml'))	# e.g., a new version of the article.
+
+		with open(self.file('a.xml'), 'rb') as f:
+			self.assertEqual(f.read(), XML + b'\n')
+		self.assertEqual(os.stat(self.store.get_path(hashlib.sha256(XML).hexdigest())).st_nlink, 1)
+
+
+	def test_invalid_payload_isnt_stored(self):
+		with self.assertRaises(InvalidDocumentError):
+			self.store.put([XML[:50]], self.file('a.xml'), DocumentValidator('.xml'))
+
+		self.assertFalse(os.path.exists(self.file('a.xml')))
+		self.assertEqual(os.listdir(self.store.tmp_dir), [])
+
+
+	def test_missing_directory_raises_the_real_error(self):
+		with self.assertRaises(FileNotFoundError):
+			self.store.put([XML], os.path.join(self.archive, 'missing', 'a.xml'))
+
+
+	def test_plain_file_isnt_shared(self):
+		with open(self.file('a.xml'), 'wb') as f:
+			f.write(XML)
+
+		self.assertFalse(self.store.is_shared(self.file('a.xml')))
+		self.assertIsNone(self.store.get_parsed(self.file('a.xml')))
+
+
+	def test_parsed_output_is_reused(self):
+		self.store.put([XML], self.file('a.xml'))
+		self.store.put([XML], self.file('b.xml'))
+		self.assertIsNone(self.store.get_parsed(self.file('b.xml')))
+
+		parsed_file = self.file('a.json')
+		with open(parsed_file, 'w') as f:
+			f.write('{"title": "a"}')
+		self.store.put_parsed(self.file('a.xml'), parsed_file)
+
+		parsed = self.store.get_parsed(self.file('b.xml'))
+		with open(parsed) as f:
+			self.assertEqual(f.read(), '{"title": "a"}')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from base_downloader import DownloadError
+from bulk_ingest import BulkIngester
+from stub_session import StubResponse
+
+
+class FakeDownloader:
+	""" Downloader that retrieves DOIs ending with 'ok', and fails a batch that has a DOI ending with 'down' """
+
+	def __init__(self):
+		self.batches = []
+
+
+	def retrieve_by_dois(self, dois):
+		self.batches.append(list(dois))
+
+		if any(x.endswith('down') for x in dois):
+			raise DownloadError('Fake', StubResponse(503))
+
+		return set(x for x in dois if not x.endswith('ok'))
+
+
+class BulkRetrieveTest(unittest.TestCase):
+
+	def setUp(self):
+		self.ingester = BulkIngester.__new__(BulkIngester)	# no downloaders (e.g., no info file) are needed.
+		self.ingester.batch_size = 2
+		self.downloader = FakeDownloader()
+		self.ingester.downloaders = {'Elsevier': self.downloader}
+
+
+	def test_missing_dois_are_collected(self):
+		missing_dois = self.ingester.retrieve('Elsevier', ['10.1/a-ok', '10.1/b', '10.1/c-ok', '10.1/d-ok', '10.1/e'])
+
+		self.assertEqual(len(self.downloader.batches), 3)
+		self.assertEqual(missing_dois, {'10.1/b', '10.1/e'})
+
+
+	def test_failed_batch_is_missing(self):
+		missing_dois = self.ingester.retrieve('Elsevier', ['10.1/a-ok', '10.1/b-down', '10.1/c-ok', '10.1/d'])
+
+		self.assertEqual(len(self.downloader.batches), 2)	# the other batch continues.
+		self.assertEqual(missing_dois, {'10.1/a-ok', '10.1/b-down', '10.1/d'})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,112 @@
+import os
+import json
+import tempfile
+import unittest
+
+from checkpoint import CrawlCheckpoint
+from base_downloader import DownloadError
+from elsevier_downloader import ElsevierDownloader
+from stub_session import StubSession, StubResponse, make_downloader
+
+
+class CrawlCheckpointTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.checkpoint_dir = os.path.join(self.tmp_dir.name, 'checkpoints')
+
+
+	def tearDown(self):
+		self.tmp_dir.cleanup()
+
+
+	def test_save_load_clear(self):
+		checkpoint = CrawlCheckpoint(self.checkpoint_dir, 'PMC', ('XAFS', None, 'None'))
+		self.assertEqual(checkpoint.load(), {})
+
+		checkpoint.save(retstart=200, uid={'PMC1': '10.1/a'})
+		state = CrawlCheckpoint(self.checkpoint_dir, 'PMC', ('XAFS', None, 'None')).load()	# the next run.
+
+		self.assertEqual(state['retstart'], 200)
+		self.assertEqual(state['uid'], {'PMC1': '10.1/a'})
+		self.assertFalse(os.path.exists(checkpoint.file + '.tmp'))
+
+		checkpoint.clear()
+		self.assertEqual(checkpoint.load(), {})
+
+
+	def test_queries_have_their_own_checkpoints(self):
+		a = CrawlCheckpoint(self.checkpoint_dir, 'PMC', ('XAFS', None, 'None'))
+		b = CrawlCheckpoint(self.checkpoint_dir, 'PMC', ('XANES', None, 'None'))
+		c = CrawlCheckpoint(self.checkpoint_dir, 'Elsevier', ('XAFS', None, 'None'))
+
+		self.assertEqual(len(set([a.file, b.file, c.file])), 3)
+
+
+	def test_broken_checkpoint_is_ignored(self):
+		checkpoint = CrawlCheckpoint(self.checkpoint_dir, 'PMC', 'XAFS')
+		with open(checkpoint.file, 'w') as f:
+			f.write('{"retstart": 2')	# e.g., written by an old version without the atomic rename.
+
+		self.assertEqual(checkpoint.load(), {})
+
+
+def make_results(term, offset, num_of_results):
+	return [{'pii': f'S{term}{i}', 'doi': f'10.1/{term}{i}', 'title': f'{term} {i}'} for i in range(offset, min(offset + 100, num_of_results))]
+
+
+XML = b'<full-text-retrieval-response>' + b'<p>text</p>'*20 + b'</full-text-retrieval-response>'
+
+
+class ElsevierResumeTest(unittest.TestCase):
+
+	num_of_results = {'(a OR b)': 7000, 'a': 2, 'b': 150}	# '(a OR b)' is over the offset cap, so it's split by the OR terms.
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.searches = []	# (qs, offset)
+		self.is_down = True	# the second page of 'b' fails.
+
+		def handler(method, url, kwargs):
+			if method == 'GET':
+				return StubResponse(200, XML, {'Content-Type': 'text/xml'})
+
+			params = json.loads(kwargs['data'])
+			qs, offset = params['qs'], params['display']['offset']
+			self.searches.append((qs, offset))
+
+			if self.is_down and (qs, offset) == ('b', 100):
+				return StubResponse(503, b'{"error": "Service Unavailable"}', {'Content-Type': 'application/json'})
+
+			total = self.num_of_results[qs]
+			body = {'resultsFound': total, 'results': make_results(qs, offset, total) if total <= 6000 else []}
+			return StubResponse(200, json.dumps(body).encode(), {'Content-Type': 'application/json'})
+
+		self.downloader = make_downloader(ElsevierDownloader, self.tmp_dir.name, StubSession(handler))
+		self.downloader.rate_limiter.enabled = False
+		self.downloader.max_concurrency = 1	# partitions are searched in order.
+
+
+	def tearDown(self):
+		self.downloader.uid_registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_resume_searches_remaining_partitions(self):
+		with self.assertRaises(DownloadError):
+			self.downloader.retrieve_articles('(a OR b)', 2020)
+
+		self.is_down = False
+		self.searches = []
+
+		doi_title = self.downloader.retrieve_articles('(a OR b)', 2020)
+
+		self.assertEqual(self.searches, [('b', 0), ('b', 100)])	# neither the split nor partition 'a' is searched again.
+		self.assertEqual(len(doi_title), 152)
+		self.assertIn('10.1/a0', self.downloader.uid_registry)
+		self.assertIn('10.1/b149', self.downloader.uid_registry)
+		self.assertEqual(os.listdir(self.downloader.checkpoint_dir), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
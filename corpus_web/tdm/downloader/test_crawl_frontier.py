@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+
+from crawl_frontier import CrawlFrontier
+from fetch_engine import FetchItem
+from elsevier_downloader import ElsevierDownloader
+from stub_session import StubSession, StubResponse, make_downloader
+
+
+def make_items(*uids):
+	return [FetchItem(x, 'https://example.org/' + x, '/archive/' + x + '/', x, '.xml') for x in uids]
+
+
+class CrawlFrontierTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.frontier = CrawlFrontier(os.path.join(self.tmp_dir.name, 'frontier.db'))
+
+
+	def tearDown(self):
+		self.frontier.conn.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_items_are_leased_once(self):
+		self.assertEqual(self.frontier.add('PMC', make_items('a', 'b', 'c')), 3)
+		self.assertEqual(self.frontier.add('PMC', make_items('a')), 0)
+
+		first = self.frontier.claim('PMC', 'worker-1', 2, lease_time=600)
+		second = self.frontier.claim('PMC', 'worker-2', 2, lease_time=600)
+
+		self.assertEqual(len(first), 2)
+		self.assertEqual([x.uid for x in second], sorted(set('abc') - set(x.uid for x in first)))
+		self.assertEqual(second[0].url, 'https://example.org/' + second[0].uid)
+		self.assertEqual(self.frontier.claim('PMC', 'worker-3', 2, lease_time=600), [])
+
+
+	def test_expired_lease_is_requeued(self):
+		self.frontier.add('PMC', make_items('a'))
+		self.frontier.claim('PMC', 'worker-1', 10, lease_time=-1)	# the worker dies, and the lease expires.
+
+		items = self.frontier.claim('PMC', 'worker-2', 10, lease_time=600)
+
+		self.assertEqual([x.uid for x in items], ['a'])
+		self.assertEqual(self.frontier.get_stats('PMC'), {('PMC', 'leased'): 1})
+
+
+	def test_item_fails_after_max_attempts(self):
+		self.frontier.add('PMC', make_items('a'))
+		for i in range(self.frontier.max_attempts):
+			self.assertEqual(len(self.frontier.claim('PMC', f'worker-{i}', 10, lease_time=-1)), 1)
+
+		self.assertEqual(self.frontier.claim('PMC', 'worker-x', 10, lease_time=600), [])
+		self.assertEqual(self.frontier.get_stats('PMC'), {('PMC', 'failed'): 1})
+		self.assertFalse(self.frontier.has_work('PMC'))
+
+		self.assertEqual(self.frontier.add('PMC', make_items('a')), 1)	# e.g., the retry pass.
+		self.assertTrue(self.frontier.has_work('PMC'))
+
+
+	def test_complete_fail_and_release(self):
+		self.frontier.add('PMC', make_items('a', 'b', 'c'))
+		self.frontier.claim('PMC', 'worker-1', 3, lease_time=600)
+
+		self.frontier.complete('PMC', 'A')
+		self.frontier.fail('PMC', 'b', 404)
+		self.assertEqual(self.frontier.release('worker-1'), 1)	# the worker stops.
+
+		self.assertEqual(self.frontier.get_stats(), {('PMC', 'done'): 1, ('PMC', 'failed'): 1, ('PMC', 'pending'): 1})
+		self.assertEqual(self.frontier.add('PMC', make_items('a')), 0)	# done items aren't added again.
+
+
+	def test_publishers_are_separate(self):
+		self.frontier.add('PMC', make_items('a'))
+		self.frontier.add('Springer', make_items('a'))
+
+		self.assertEqual(len(self.frontier.claim('PMC', 'worker-1', 10, lease_time=600)), 1)
+		self.assertTrue(self.frontier.has_work('Springer'))
+		self.assertEqual(len(self.frontier.claim('Springer', 'worker-1', 10, lease_time=600)), 1)
+
+
+XML = b'<full-text-retrieval-response>' + b'<p>text</p>'*20 + b'</full-text-retrieval-response>'
+
+
+class FrontierCredentialsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.frontier = CrawlFrontier(os.path.join(self.tmp_dir.name, 'frontier.db'))
+		self.keys = []	# API keys of requests
+
+		def handler(method, url, kwargs):
+			self.keys.append((kwargs.get('headers') or {}).get('X-ELS-APIKEY'))
+			return StubResponse(200, XML, {'Content-Type': 'text/xml'})
+
+		self.workers = []
+		for name, key in [('a', 'KEY_A'), ('b', 'KEY_B')]:	# workers on different machines with their own keys.
+			root = os.path.join(self.tmp_dir.name, 'worker_' + name)
+			os.makedirs(root)
+			worker = make_downloader(ElsevierDownloader, root, StubSession(handler))
+			worker.api_key = key
+			worker.frontier = self.frontier
+			worker.rate_limiter.enabled = False
+			self.workers.append(worker)
+
+
+	def tearDown(self):
+		for worker in self.workers:
+			worker.uid_registry.close()
+		self.frontier.conn.close()
+		self.tmp_dir.cleanup()
+
+
+	def get_stored_items(self):
+		return [x[0] for x in self.frontier.conn.execute('SELECT item FROM frontier')]
+
+
+	def test_keys_arent_stored(self):
+		self.workers[0].retrieve_by_dois(['10.1/a'])
+
+		self.assertEqual(self.keys, ['KEY_A'])
+		self.assertFalse(any('KEY_A' in x for x in self.get_stored_items()))
+
+
+	def test_worker_uses_its_own_key(self):
+		item = FetchItem('10.1/a', 'https://api.elsevier.com/content/article/doi/10.1/a', os.path.join(self.tmp_dir.name, 'a', ''), 'a', '.xml',
+						 headers={'X-ELS-APIKEY': 'KEY_A', 'Accept': 'text/xml'})	# e.g., recorded in an old failed list.
+		next(self.workers[0].iter_fetch_tasks([item]))	# worker A adds the item, and claims it.
+		self.frontier.release(self.workers[0].worker_id)	# worker A stops.
+
+		self.workers[1].run_tasks(self.workers[1].iter_frontier_tasks())
+
+		self.assertEqual(self.keys, ['KEY_B'])
+		self.assertFalse(any('KEY_A' in x for x in self.get_stored_items()))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,142 @@
+import threading
+import unittest
+
+from rate_limiter import RateLimiter
+from crawl_scheduler import CrawlScheduler, CrawlTask, QuotaExhaustedError
+
+
+class QuotaDownloader:
+	""" Downloader with a quota of the given number of tasks """
+
+	def __init__(self, quota):
+		self.quota = quota
+		self.is_saved = False
+
+
+	def get_quota_remaining(self):
+		return self.quota
+
+
+	def save_quota(self):
+		self.is_saved = True
+
+
+class CrawlSchedulerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.started = []	# (job name, i) in the order that tasks are started.
+		self.lock = threading.Lock()
+
+
+	def iter_tasks(self, name, num_of_tasks, host='example.org', downloader=None):
+		def run(i):
+			with self.lock:
+				self.started.append((name, i))
+			if downloader is not None:
+				downloader.quota -= 1
+			return i
+
+		for i in range(num_of_tasks):
+			yield CrawlTask(name, f'https://{host}/{name}/{i}', lambda i=i: run(i), max_per_host=1)
+
+
+	def test_priority_and_fair_share(self):
+		scheduler = CrawlScheduler(max_workers=1)
+		scheduler.add('backfill', self.iter_tasks('backfill', 2), priority=1)
+		scheduler.add('a', self.iter_tasks('a', 2))
+		scheduler.add('b', self.iter_tasks('b', 2))
+
+		scheduler.run()
+
+		self.assertEqual([x for x, _ in self.started], ['a', 'b', 'a', 'b', 'backfill', 'backfill'])
+
+
+	def test_barrier_and_results(self):
+		results = []
+
+		def tasks():
+			task = CrawlTask('a', 'https://example.org/search', lambda: [1, 2], kind='search')
+			yield task
+			yield None
+			for x in task.result:
+				yield CrawlTask('a', f'https://example.org/{x}', lambda x=x: x, callback=results.append)
+			return 'done'
+
+		scheduler = CrawlScheduler()
+		job = scheduler.add('a', tasks())
+		scheduler.run()
+
+		self.assertEqual(sorted(results), [1, 2])
+		self.assertEqual(job.result, 'done')
+
+
+	def test_quota_stop(self):
+		downloader = QuotaDownloader(3)
+
+		scheduler = CrawlScheduler(max_workers=1)
+		job = scheduler.add('Elsevier', self.iter_tasks('Elsevier', 10, downloader=downloader), downloader=downloader)
+		scheduler.run()
+
+		self.assertEqual(len(self.started), 3)
+		self.assertIsInstance(job.error, QuotaExhaustedError)
+		self.assertTrue(downloader.is_saved)
+
+
+	def test_token_is_reserved_at_dispatch(self):
+		rate_limiter = RateLimiter(rate=0.001, burst=2)	# two tokens, and the next one comes after 1000 seconds.
+
+		def run():
+			rate_limiter.acquire()	# it blocks unless the token was reserved.
+			return True
+
+		def tasks():
+			for i in range(3):
+				yield CrawlTask('a', f'https://example.org/{i}', run, rate_limiter=rate_limiter, max_per_host=3)
+
+		scheduler = CrawlScheduler()
+		job = scheduler.add('a', tasks())
+
+		futures = {}
+		delays = scheduler.dispatch(_Executor(), futures)
+
+		self.assertEqual(len(futures), 2)	# the third task waits for a token instead of blocking a worker.
+		self.assertEqual(len(delays), 1)
+		self.assertTrue(all(x.result() for x in futures))
+		self.assertEqual(job.next_task.url, 'https://example.org/2')
+
+
+	def test_unused_token_is_dropped(self):
+		rate_limiter = RateLimiter(rate=0.001, burst=2)
+
+		self.assertEqual(rate_limiter.try_acquire(), 0)
+		with rate_limiter.reserved():
+			pass	# no request is sent (e.g., a cache hit).
+
+		rate_limiter.acquire()	# a later request in the thread takes a new token.
+		self.assertLess(rate_limiter.tokens, 1)
+
+
+class _Future:
+
+	def __init__(self, value):
+		self.value = value
+
+
+	def result(self):
+		return self.value
+
+
+class _Executor:
+	""" Executor that runs a task in a new thread and waits for it """
+
+	def submit(self, fn, *args):
+		result = []
+		thread = threading.Thread(target=lambda: result.append(fn(*args)), daemon=True)
+		thread.start()
+		thread.join(timeout=5)
+
+		return _Future(result[0] if len(result) > 0 else None)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,65 @@
+import tempfile
+import unittest
+import requests
+
+from crossref_downloader import CrossrefDownloader
+from stub_session import StubSession, StubResponse, make_downloader
+
+
+PDF = b'%PDF-1.4\n' + b'x'*100 + b'\n%%EOF\n'
+
+
+def make_info(*urls, member='Emerald'):
+	return {'link': [{'URL': x, 'content-type': 'application/pdf'} for x in urls], 'member': member, 'metadata': {'uid': '10.1108/a'}}
+
+
+class CrossrefFailureTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.tokens = []	# clickthrough tokens of requests
+
+		def handler(method, url, kwargs):
+			self.tokens.append((kwargs.get('headers') or {}).get('CR-Clickthrough-Client-Token'))
+			if url.endswith('/ok'):
+				return StubResponse(200, PDF, {'Content-Type': 'application/pdf'})
+			if url.endswith('/html'):
+				return StubResponse(200, b'<html>' + b'x'*100 + b'</html>', {'Content-Type': 'text/html'})
+			if url.endswith('/reset'):
+				raise requests.exceptions.ConnectionError('reset')
+			return StubResponse(404, b'Not Found')
+
+		self.downloader = make_downloader(CrossrefDownloader, self.tmp_dir.name, StubSession(handler))
+
+
+	def tearDown(self):
+		self.downloader.uid_registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_failed_links_are_recorded(self):
+		self.downloader.download_article('10.1108/a', make_info('https://x.org/404', 'https://x.org/html', 'https://x.org/reset'))
+
+		self.assertNotIn('10.1108/a', self.downloader.uid_registry)
+		self.assertEqual([x.url for x in self.downloader.load_failures()], ['https://x.org/404', 'https://x.org/html', 'https://x.org/reset'])
+
+
+	def test_retry_skips_downloaded_article(self):
+		self.downloader.download_article('10.1108/a', make_info('https://x.org/404', 'https://x.org/ok'))
+
+		self.assertIn('10.1108/a', self.downloader.uid_registry)
+		self.assertEqual(self.downloader.retry_failures(), [])	# the failed link of the downloaded article isn't retried.
+
+
+	def test_wiley_token_isnt_recorded(self):
+		self.downloader.download_article('10.1002/a', make_info('https://x.org/404', member='Wiley'))
+
+		with open(self.downloader.failed_list) as f:
+			self.assertNotIn('TEST_KEY', f.read())
+
+		self.downloader.retry_failures()	# the token is added to the retried request again.
+		self.assertEqual(self.tokens, ['TEST_KEY', 'TEST_KEY'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from document_validator import DocumentValidator, InvalidDocumentError
+
+
+BODY = b'<p>' + b'x'*100 + b'</p>'
+
+
+def validate(document, extension='.xml', content_type=None, content_length=None, chunk_size=16):
+	validator = DocumentValidator(extension, content_type, content_length)
+	for i in range(0, len(document), chunk_size):
+		validator.feed(document[i:i + chunk_size])
+	validator.close()
+
+
+class DocumentValidatorTest(unittest.TestCase):
+
+	def test_valid_xml(self):
+		validate(b'<?xml version="1.0"?><root>' + BODY*3 + b'</root>')
+
+
+	def test_xml_with_prolog_comment_and_pi(self):
+		validate(b'<?xml version="1.0"?>\n<!-- generated -->\n<?xml-stylesheet href="a.xsl"?>\n<root>' + BODY + b'</root>')
+
+
+	def test_xml_with_trailing_comment(self):
+		validate(b'<root>' + BODY + b'</root>\n<!-- end -->')
+
+
+	def test_truncated_xml(self):
+		with self.assertRaises(InvalidDocumentError):
+			validate(b'<root>' + BODY + b'<p>cut')
+
+
+	def test_malformed_xml(self):
+		with self.assertRaises(InvalidDocumentError):
+			validate(b'<root>' + BODY + b'</wrong></root>')
+
+
+	def test_content_type_mismatch(self):
+		with self.assertRaises(InvalidDocumentError):
+			DocumentValidator('.xml', 'text/html; charset=utf-8')
+
+
+	def test_content_length_mismatch(self):
+		document = b'<root>' + BODY + b'</root>'
+		validate(document, content_length=len(document))
+
+		with self.assertRaises(InvalidDocumentError):
+			validate(document, content_length=len(document) + 10)
+
+
+	def test_too_small(self):
+		with self.assertRaises(InvalidDocumentError):
+			validate(b'<root/>')
+
+
+	def test_pdf(self):
+		validate(b'%PDF-1.4\n' + b'x'*100 + b'\n%%EOF\n', '.pdf', 'application/pdf')
+
+		with self.assertRaises(InvalidDocumentError):
+			validate(b'<html>' + b'x'*100 + b'</html>', '.pdf')
+
+		with self.assertRaises(InvalidDocumentError):
+			validate(b'%PDF-1.4\n' + b'x'*100, '.pdf')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,142 @@
+import os
+import time
+import tempfile
+import unittest
+import requests
+from requests.adapters import BaseAdapter
+
+from http_cache import HTTPCache
+from http_session import create_session
+
+
+class ETagAdapter(BaseAdapter):
+	""" Transport adapter of a server whose document has an ETag, and which returns 304 for a matching If-None-Match """
+
+	def __init__(self, content=b'{"results": []}', etag='"v1"'):
+		super().__init__()
+		self.content = content
+		self.etag = etag
+		self.requests = []	# request headers
+
+
+	def send(self, request, **kwargs):
+		self.requests.append(dict(request.headers))
+
+		response = requests.Response()
+		if request.headers.get('If-None-Match') == self.etag:
+			response.status_code = 304
+			response._content = b''
+		else:
+			response.status_code = 200
+			response._content = self.content
+		response.headers['ETag'] = self.etag
+		response.headers['Content-Type'] = 'application/json'
+		response.url = request.url
+		response.request = request
+
+		return response
+
+
+	def close(self):
+		pass
+
+
+def make_response(url, content):
+	response = requests.Response()
+	response.status_code = 200
+	response._content = content
+	response.url = url
+	response.headers['Content-Length'] = str(len(content))
+
+	return response
+
+
+class HTTPCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.cache = HTTPCache(os.path.join(self.tmp_dir.name, 'cache'), max_size=250)
+
+
+	def tearDown(self):
+		self.cache.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_put_and_get(self):
+		self.cache.put('k', make_response('https://example.org/a', b'body'))
+		response, age = self.cache.get('k')
+
+		self.assertEqual(response.content, b'body')
+		self.assertEqual(response.url, 'https://example.org/a')
+		self.assertNotIn('Content-Length', response.headers)	# it's not valid for the stored body.
+		self.assertTrue(response.from_cache)
+		self.assertLess(age, 60)
+		self.assertEqual(self.cache.get('unknown'), (None, None))
+
+
+	def test_least_recently_used_entries_are_evicted(self):
+		for key in ['a', 'b']:
+			self.cache.put(key, make_response('https://example.org/' + key, b'x'*100))
+			time.sleep(0.01)
+
+		self.cache.get('a')	# 'b' is the least recently used.
+		time.sleep(0.01)
+		self.cache.put('c', make_response('https://example.org/c', b'x'*100))
+
+		self.assertIsNotNone(self.cache.get('a')[0])
+		self.assertIsNone(self.cache.get('b')[0])
+		self.assertIsNotNone(self.cache.get('c')[0])
+		self.assertFalse(os.path.exists(self.cache.get_file('b')))
+
+
+	def test_key_includes_the_body(self):
+		a = requests.Request('PUT', 'https://example.org/search', data='{"qs": "a"}').prepare()
+		b = requests.Request('PUT', 'https://example.org/search', data='{"qs": "b"}').prepare()
+
+		self.assertNotEqual(self.cache.make_key(a), self.cache.make_key(b))
+
+
+class CachedSessionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.cache = HTTPCache(os.path.join(self.tmp_dir.name, 'cache'))
+		self.session = create_session(cache=self.cache)
+		self.adapter = ETagAdapter()
+		self.session.mount('https://', self.adapter)
+
+
+	def tearDown(self):
+		self.cache.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_fresh_response_is_served_from_the_cache(self):
+		self.session.get('https://example.org/search', cache_ttl=3600)
+		response = self.session.get('https://example.org/search', cache_ttl=3600)
+
+		self.assertEqual(response.content, self.adapter.content)
+		self.assertEqual(len(self.adapter.requests), 1)
+		self.assertEqual(self.session.num_of_requests, 1)
+
+
+	def test_stale_response_is_revalidated(self):
+		self.session.get('https://example.org/search', cache_ttl=0)
+		response = self.session.get('https://example.org/search', cache_ttl=0)
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.content, self.adapter.content)
+		self.assertEqual(self.adapter.requests[1].get('If-None-Match'), '"v1"')
+
+
+	def test_requests_without_ttl_bypass_the_cache(self):
+		self.session.get('https://example.org/article')
+		self.session.get('https://example.org/article')
+
+		self.assertEqual(len(self.adapter.requests), 2)
+		self.assertNotIn('If-None-Match', self.adapter.requests[1])
+
+
+if __name__ == '__main__':
+	unittest.main()
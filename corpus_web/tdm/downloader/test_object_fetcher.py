@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import object_fetcher
+from object_fetcher import ObjectQueue, ObjectFetcher
+from stub_session import StubSession, StubResponse
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'x'*100
+
+
+class ObjectQueueTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.queue = ObjectQueue(os.path.join(self.tmp_dir.name, 'objects.db'))
+		self.queue.enqueue('Elsevier', 'S1', [(f'fig{i}', f'https://example.org/fig{i}.png', f'/archive/S1/fig{i}.png') for i in range(3)])
+
+
+	def tearDown(self):
+		self.queue.conn.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_leased_objects_arent_claimed_again(self):
+		first = self.queue.claim(2, 'fetcher-1', 600)
+		second = self.queue.claim(10, 'fetcher-2', 600)
+
+		self.assertEqual(len(first), 2)
+		self.assertEqual(len(second), 1)
+		self.assertEqual(self.queue.claim(10, 'fetcher-3', 600), [])
+
+
+	def test_expired_lease_is_requeued(self):
+		self.queue.claim(10, 'fetcher-1', -1)	# the fetcher dies, and the leases expire.
+
+		objects = self.queue.claim(10, 'fetcher-2', 600)
+
+		self.assertEqual(len(objects), 3)
+		self.assertEqual(objects[0]['attempts'], 1)
+
+
+	def test_object_fails_after_max_attempts(self):
+		for i in range(self.queue.max_attempts):
+			self.queue.claim(10, f'fetcher-{i}', -1)
+		self.queue.claim(10, 'fetcher-x', 600)
+
+		self.assertEqual(self.queue.get_stats(), {('Elsevier', 'failed'): 3})
+		self.assertEqual(self.queue.reset(), 3)
+		self.assertEqual(self.queue.get_stats(), {('Elsevier', 'pending'): 3})
+
+
+	def test_release(self):
+		self.queue.claim(2, 'fetcher-1', 600)
+		self.queue.claim(1, 'fetcher-2', 600)
+
+		self.assertEqual(self.queue.release('fetcher-1'), 2)
+		self.assertEqual(self.queue.get_stats(), {('Elsevier', 'pending'): 2, ('Elsevier', 'fetching'): 1})
+
+
+class ObjectFetcherTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+
+		info_file = os.path.join(self.tmp_dir.name, 'api_key_and_archive_info.txt')
+		with open(info_file, 'w') as f:
+			f.write('UID_list = ' + os.path.join(self.tmp_dir.name, 'uid_list.txt') + '\n')
+
+		with mock.patch.object(object_fetcher, 'info_file', info_file):
+			self.fetcher = ObjectFetcher()
+
+		session = StubSession(lambda method, url, kwargs: StubResponse(200, PNG, {'Content-Type': 'image/png'}))
+		session.rate_limiter = None
+		self.fetcher.get_session = lambda host: session
+
+		self.file = os.path.join(self.tmp_dir.name, 'archive', 'S1', 'fig{}.png')
+		self.fetcher.queue.enqueue('Elsevier', 'S1', [(f'fig{i}', f'https://example.org/fig{i}.png', self.file.format(i)) for i in range(3)])
+
+
+	def tearDown(self):
+		self.fetcher.queue.conn.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_objects_of_another_fetcher_arent_fetched(self):
+		self.fetcher.queue.claim(1, 'other-fetcher', 600)	# another fetcher (or a parser's fetcher) is running.
+
+		for task in self.fetcher.iter_tasks():
+			if task is not None:
+				task.run()
+
+		self.assertEqual(self.fetcher.num_of_fetched, 0)	# callbacks are called by the scheduler.
+		self.assertEqual(self.fetcher.queue.get_stats(), {('Elsevier', 'done'): 2, ('Elsevier', 'fetching'): 1})
+
+
+	def test_stopped_fetcher_releases_its_objects(self):
+		tasks = self.fetcher.iter_tasks()
+		next(tasks).run()
+		tasks.close()	# e.g., the scheduler stopped the job.
+
+		self.assertEqual(self.fetcher.queue.get_stats(), {('Elsevier', 'done'): 1, ('Elsevier', 'pending'): 2})
+
+
+if __name__ == '__main__':
+	unittest.main()
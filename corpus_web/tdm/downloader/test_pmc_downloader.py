@@ -0,0 +1,132 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import datetime
+from unittest import mock
+
+from pmc_downloader import PMCDownloader
+from stub_session import StubSession, StubResponse, make_downloader
+
+
+def make_package(pmc_id, names=None):
+	nxml = b'<article>' + b'<p>text</p>'*20 + b'</article>'
+
+	buffer = io.BytesIO()
+	with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+		for name in names or [f'{pmc_id}/{pmc_id}.nxml']:
+			info = tarfile.TarInfo(name)
+			info.size = len(nxml)
+			tar.addfile(info, io.BytesIO(nxml))
+
+	return buffer.getvalue()
+
+
+class PMCPackageTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.is_down = True	# the package server returns 503.
+
+		def handler(method, url, kwargs):
+			if self.is_down:
+				return StubResponse(503, b'Service Unavailable')
+			return StubResponse(200, make_package('PMC123'), {'Content-Type': 'application/x-gzip'})
+
+		self.downloader = make_downloader(PMCDownloader, self.tmp_dir.name, StubSession(handler))
+
+
+	def tearDown(self):
+		self.downloader.uid_registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_failed_package_is_retried(self):
+		source = 'oa_package/ab/cd/PMC123.tar.gz'
+
+		self.assertEqual(self.downloader.fetch_package('PMC123', source, '10.1/pmc123'), 0)
+		self.assertEqual([x.url for x in self.downloader.load_failures()], [self.downloader.oa_package_url + source])
+
+		self.is_down = False
+		self.assertEqual(self.downloader.retry_failures(), [])
+
+		self.assertIn('10.1/pmc123', self.downloader.uid_registry)
+		self.assertEqual(self.downloader.load_failures(), [])
+
+		files = [os.path.join(d, x) for d, _, files in os.walk(self.downloader.path) for x in files]
+		self.assertTrue(any(x.endswith(os.path.join('PMC123', 'PMC123.nxml')) for x in files))
+
+
+	def test_paths_outside_the_article_directory_are_skipped(self):
+		package = make_package('PMC123', ['PMC123/PMC123.nxml', 'PMC123x/a.nxml', '../b.nxml'])
+		self.downloader.session = StubSession(lambda method, url, kwargs: StubResponse(200, package, {'Content-Type': 'application/x-gzip'}))
+
+		self.downloader.download_package('oa_package/ab/cd/PMC123.tar.gz')
+
+		files = [os.path.join(d, x) for d, _, files in os.walk(self.tmp_dir.name) for x in files if x.endswith('.nxml')]
+		self.assertEqual(len(files), 1)
+		self.assertTrue(files[0].endswith(os.path.join('PMC123', 'PMC123.nxml')))
+
+
+class PMCPackagePathsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+
+		def handler(method, url, kwargs):
+			if kwargs['params']['id'] == 'PMC1':
+				return StubResponse(200, b'<html><body>Maintenance', {'Content-Type': 'text/html'})
+			return StubResponse(200, b'<OA><records><record><link format="tgz" href="ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_package/ab/cd/PMC2.tar.gz"/></record></records></OA>')
+
+		self.downloader = make_downloader(PMCDownloader, self.tmp_dir.name, StubSession(handler))
+
+
+	def tearDown(self):
+		self.downloader.uid_registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_broken_lookup_doesnt_stop_the_others(self):
+		self.assertEqual(self.downloader.get_oa_package_paths(['PMC1', 'PMC2']), {'PMC2': 'oa_package/ab/cd/PMC2.tar.gz'})
+
+
+class LaterDate(datetime.date):
+
+	@classmethod
+	def today(cls):
+		return cls(2030, 1, 2)
+
+
+class PMCCheckpointTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.downloader = make_downloader(PMCDownloader, self.tmp_dir.name, StubSession(lambda method, url, kwargs: StubResponse(404)))
+
+
+	def tearDown(self):
+		self.downloader.uid_registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_resume_on_a_later_day(self):
+		since = datetime.date(2029, 12, 1)
+
+		tasks = self.downloader.iter_tasks('XAFS', None, since)
+		task = next(tasks)
+		task.result = ({'PMC1': '10.1/a'}, 200, 400)	# the first page of 400 results.
+		self.assertIsNone(next(tasks))
+		next(tasks)	# the second page is yielded after the checkpoint is saved.
+		tasks.close()	# the run dies.
+
+		with mock.patch('pmc_downloader.date', LaterDate):
+			task = next(self.downloader.iter_tasks('XAFS', None, since))
+
+		search_params = task.run.args[1]
+		self.assertEqual(search_params['retstart'], 200)
+		self.assertEqual(search_params['maxdate'], '2030/01/02')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,85 @@
+import time
+import unittest
+
+from rate_limiter import RateLimiter
+from stub_session import StubResponse
+
+
+class RateLimiterTest(unittest.TestCase):
+
+	def test_burst_then_wait(self):
+		rate_limiter = RateLimiter(rate=0.001, burst=2)
+
+		self.assertEqual(rate_limiter.get_delay(), 0)
+		rate_limiter.acquire()
+		rate_limiter.acquire()
+
+		self.assertGreater(rate_limiter.get_delay(), 900)	# the next token comes after about 1000 seconds.
+
+
+	def test_get_delay_doesnt_consume_tokens(self):
+		rate_limiter = RateLimiter(rate=0.001, burst=1)
+
+		for _ in range(3):
+			self.assertEqual(rate_limiter.get_delay(), 0)
+		self.assertEqual(rate_limiter.try_acquire(), 0)
+		self.assertGreater(rate_limiter.try_acquire(), 0)
+
+
+	def test_no_limit(self):
+		rate_limiter = RateLimiter()
+		for _ in range(100):
+			rate_limiter.acquire()
+
+		self.assertEqual(rate_limiter.get_delay(), 0)
+
+
+	def test_disabled(self):
+		rate_limiter = RateLimiter(rate=0.001, burst=1)
+		rate_limiter.enabled = False
+		for _ in range(3):
+			rate_limiter.acquire()
+
+		self.assertEqual(rate_limiter.get_delay(), 0)
+
+
+	def test_429_halves_the_rate_and_success_recovers_it(self):
+		rate_limiter = RateLimiter(rate=10)
+
+		rate_limiter.update(StubResponse(429))
+		rate_limiter.update(StubResponse(429))
+		self.assertAlmostEqual(rate_limiter.rate, 2.5)
+
+		for _ in range(20):
+			rate_limiter.update(StubResponse(200))
+		self.assertEqual(rate_limiter.rate, 10)
+
+
+	def test_retry_after_blocks_requests(self):
+		rate_limiter = RateLimiter()
+
+		rate_limiter.update(StubResponse(429, headers={'Retry-After': '120'}))
+
+		self.assertGreater(rate_limiter.get_delay(), 100)
+
+
+	def test_exhausted_remaining_blocks_until_reset(self):
+		rate_limiter = RateLimiter(rate=10)
+
+		rate_limiter.update(StubResponse(200, headers={'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(time.time() + 60)}))
+		self.assertGreater(rate_limiter.get_delay(), 50)
+
+		rate_limiter = RateLimiter(rate=10)
+		rate_limiter.update(StubResponse(200, headers={'X-RateLimit-Remaining': '5', 'X-RateLimit-Reset': str(time.time() + 60)}))
+		self.assertEqual(rate_limiter.get_delay(), 0)
+
+
+	def test_parse_retry_after(self):
+		self.assertEqual(RateLimiter.parse_retry_after('30'), 30)
+		self.assertIsNone(RateLimiter.parse_retry_after(None))
+		self.assertIsNone(RateLimiter.parse_retry_after('soon'))
+		self.assertLess(RateLimiter.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
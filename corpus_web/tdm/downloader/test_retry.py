@@ -0,0 +1,198 @@
+import os
+import tempfile
+import unittest
+import requests
+from requests.adapters import BaseAdapter
+
+from retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+from http_session import create_session
+from base_downloader import BaseDownloader
+from fetch_engine import FetchItem
+from stub_session import StubSession, StubResponse, make_downloader
+
+
+class StubAdapter(BaseAdapter):
+	""" Transport adapter that returns the given status codes in order (an exception is raised instead if it's given) """
+
+	def __init__(self, statuses):
+		super().__init__()
+		self.statuses = list(statuses)
+		self.num_of_sent = 0
+
+
+	def send(self, request, **kwargs):
+		self.num_of_sent += 1
+		status = self.statuses.pop(0)
+		if isinstance(status, Exception):
+			raise status
+
+		response = requests.Response()
+		response.status_code = status
+		response._content = b''
+		response.url = request.url
+		response.request = request
+
+		return response
+
+
+	def close(self):
+		pass
+
+
+class NoDelayPolicy(RetryPolicy):
+
+	def backoff(self, attempt):
+		pass
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+	def test_retryable(self):
+		policy = RetryPolicy()
+		for status, expected in [(200, False), (404, False), (429, True), (500, True), (503, True)]:
+			response = requests.Response()
+			response.status_code = status
+			self.assertEqual(policy.is_retryable(response), expected)
+
+
+	def test_session_retries_transient_errors(self):
+		session = create_session(retry_policy=NoDelayPolicy(max_attempts=5))
+		adapter = StubAdapter([503, requests.exceptions.ConnectionError(), 429, 200])
+		session.mount('https://', adapter)
+
+		response = session.get('https://example.org/a')
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(adapter.num_of_sent, 4)
+		self.assertEqual(session.num_of_retries, 3)
+		self.assertEqual(session.num_of_requests, 4)
+
+
+	def test_session_returns_last_response_when_budget_runs_out(self):
+		session = create_session(retry_policy=NoDelayPolicy(max_attempts=2))
+		session.mount('https://', StubAdapter([502, 502]))
+
+		self.assertEqual(session.get('https://example.org/a').status_code, 502)
+
+
+	def test_session_doesnt_retry_client_errors(self):
+		session = create_session(retry_policy=NoDelayPolicy())
+		adapter = StubAdapter([404])
+		session.mount('https://', adapter)
+
+		self.assertEqual(session.get('https://example.org/a').status_code, 404)
+		self.assertEqual(adapter.num_of_sent, 1)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+	def test_opens_after_consecutive_failures(self):
+		breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+		for _ in range(2):
+			breaker.record_failure('host')
+		breaker.before_request('host')
+
+		breaker.record_failure('host')
+		with self.assertRaises(CircuitOpenError):
+			breaker.before_request('host')
+
+
+	def test_success_resets_failures(self):
+		breaker = CircuitBreaker(failure_threshold=2)
+		breaker.record_failure('host')
+		breaker.record_success()
+		breaker.record_failure('host')
+
+		breaker.before_request('host')
+
+
+	def test_half_open_after_timeout(self):
+		breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+		breaker.record_failure('host')
+
+		breaker.before_request('host')	# a trial request is allowed after the timeout.
+		breaker.record_success()
+		breaker.before_request('host')
+
+
+class RetryDownloader(BaseDownloader):
+
+	def __init__(self):
+		super().__init__('Elsevier')
+
+
+	def auth_headers(self, item):
+		return {'X-ELS-APIKEY': self.api_key}
+
+
+	def retrieve_articles(self, query):
+		return {}
+
+
+XML = b'<root>' + b'<p>text</p>'*20 + b'</root>'
+
+
+class RetryPassTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.failed = set()	# URLs that fail
+
+		def handler(method, url, kwargs):
+			if url in self.failed:
+				return StubResponse(503, b'Service Unavailable', {'Content-Type': 'text/plain'})
+			return StubResponse(200, XML, {'Content-Type': 'text/xml'})
+
+		self.downloader = make_downloader(RetryDownloader, self.tmp_dir.name, StubSession(handler))
+
+
+	def tearDown(self):
+		self.downloader.uid_registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def record(self, uid):
+		item = FetchItem(uid, 'https://example.org/' + uid, os.path.join(self.tmp_dir.name, 'archive', uid, ''), uid, '.xml')
+		self.downloader.record_failure(item, 503)
+
+
+	def test_retried_items_and_failures_of_the_pass(self):
+		for uid in ['a', 'b', 'c']:
+			self.record(uid)
+		self.failed.add('https://example.org/b')
+
+		failed_items = self.downloader.retry_failures()
+
+		self.assertEqual([x.uid for x in failed_items], ['b'])
+		self.assertIn('a', self.downloader.uid_registry)
+		self.assertIn('c', self.downloader.uid_registry)
+		self.assertEqual([x.uid for x in self.downloader.load_failures()], ['b'])	# recorded again.
+		self.assertFalse(os.path.exists(self.downloader.failed_list + '.retry'))
+
+
+	def test_credentials_arent_recorded(self):
+		item = FetchItem('a', 'https://example.org/a', self.tmp_dir.name, 'a', '.xml', headers={'X-ELS-APIKEY': 'TEST_KEY', 'Accept': 'text/xml'})
+		self.downloader.record_failure(item, 503)
+
+		with open(self.downloader.failed_list) as f:
+			self.assertNotIn('TEST_KEY', f.read())
+		self.assertEqual(self.downloader.load_failures()[0].headers, {'Accept': 'text/xml'})
+
+
+	def test_stopped_pass_keeps_items(self):
+		for uid in ['a', 'b', 'c']:
+			self.record(uid)
+
+		tasks = self.downloader.iter_retry_tasks()
+		task = next(tasks)
+		task.run()
+		tasks.close()	# e.g., the quota is used up after the first item.
+
+		tasks = self.downloader.iter_retry_tasks()
+		uids = [x.url.rsplit('/', 1)[-1] for x in tasks if x is not None]
+
+		self.assertEqual(sorted(uids), ['b', 'c'])	# 'a' is in the registry.
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,46 @@
+import tempfile
+import unittest
+
+from springer_downloader import SpringerDownloader
+from stub_session import StubSession, StubResponse, make_downloader
+
+
+def make_page(dois):
+	records = b''.join(b'<article><front><article-meta><article-id pub-id-type="doi">' + x.encode() + b'</article-id>'
+					   b'<title-group><article-title>title</article-title></title-group></article-meta></front>' + b'<p>text</p>'*20 + b'</article>' for x in dois)
+	return b'<response><records>' + records + b'</records></response>'
+
+
+class SpringerRetrieveByDOIsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.queries = []
+
+		def handler(method, url, kwargs):
+			self.queries.append(kwargs['params']['q'])
+			return StubResponse(200, make_page(['10.1007/s1-(2020)']), {'Content-Type': 'application/xml'})
+
+		self.downloader = make_downloader(SpringerDownloader, self.tmp_dir.name, StubSession(handler))
+
+
+	def tearDown(self):
+		self.downloader.uid_registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_dois_are_quoted(self):
+		self.downloader.retrieve_by_dois(['10.1007/s1-(2020)', '10.1007/s2'])
+
+		self.assertEqual(self.queries, ['doi:"10.1007/s1-(2020)" OR doi:"10.1007/s2"'])
+
+
+	def test_missing_dois_are_returned(self):
+		missing_dois = self.downloader.retrieve_by_dois(['10.1007/S1-(2020)', '10.1007/s2'])
+
+		self.assertEqual(missing_dois, {'10.1007/s2'})
+		self.assertIn('10.1007/s1-(2020)', self.downloader.uid_registry)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from uid_registry import UIDRegistry
+from elsevier_downloader import ElsevierDownloader
+from stub_session import make_downloader
+
+
+class UIDRegistryTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.db_file = os.path.join(self.tmp_dir.name, 'uids.db')
+		self.registry = UIDRegistry(self.db_file)
+
+
+	def tearDown(self):
+		self.registry.close()
+		self.tmp_dir.cleanup()
+
+
+	def test_add_many(self):
+		self.assertEqual(self.registry.add_many(['10.1/A', '10.1/b ', '', None, '10.1/a']), 2)
+		self.assertEqual(self.registry.add_many(['10.1/B', '10.1/c']), 1)
+
+		self.assertIn('10.1/a', self.registry)
+		self.assertIn(' 10.1/C', self.registry)
+		self.assertEqual(len(self.registry), 3)
+
+
+	def test_filter_new(self):
+		self.registry.add_many(['10.1/a', '10.1/b'])
+		uids = [f'10.1/{i}' for i in range(1200)]	# more than a batch.
+		self.registry.add_many(uids[:700])
+
+		self.assertEqual(self.registry.filter_new(['10.1/A', '10.1/new'] + uids), set(['10.1/new'] + uids[700:]))
+
+
+	def test_remove(self):
+		self.registry.add('10.1/a')
+		self.registry.remove('10.1/A')
+		self.registry.remove('10.1/unknown')
+
+		self.assertNotIn('10.1/a', self.registry)
+		self.assertEqual(len(self.registry), 0)
+
+
+	def test_import_uid_list(self):
+		self.registry.close()
+		os.remove(self.db_file)
+
+		uid_list = os.path.join(self.tmp_dir.name, 'uid_list.txt')
+		with open(uid_list, 'w') as f:
+			f.write('10.1/a\n10.1/B\n\n10.1/a\n')
+
+		self.registry = UIDRegistry(self.db_file, uid_list)
+
+		self.assertEqual(len(self.registry), 2)
+		self.assertIn('10.1/b', self.registry)
+
+
+	def test_stats(self):
+		year = datetime.now().year
+
+		self.registry.add_many(['10.1/a', '10.1/b'], 'Elsevier', 'XAS')
+		self.registry.add_many(['10.1/b', '10.1/c'], 'PMC', 'XAS')	# 10.1/b is counted once.
+		self.registry.add('10.1/d', 'PMC', 'COVID-19')
+		self.registry.remove('10.1/a')
+
+		self.assertEqual(self.registry.get_stats(), {'Elsevier': 1, 'PMC': 2})
+		self.assertEqual(self.registry.get_stats(('publisher', 'project')), {('Elsevier', 'XAS'): 1, ('PMC', 'XAS'): 1, ('PMC', 'COVID-19'): 1})
+		self.assertEqual(self.registry.get_stats(('year',)), {year: 3})
+
+		with self.assertRaises(ValueError):
+			self.registry.get_stats(('uid',))
+
+
+	def test_stats_of_old_registry(self):
+		self.registry.add_many(['10.1/a', '10.1/b'], 'Elsevier')
+		self.registry.add('10.1/c')
+		self.registry.conn.execute('DROP TABLE stats')	# a registry created before the stats table.
+		self.registry.close()
+
+		self.registry = UIDRegistry(self.db_file)
+
+		self.assertEqual(self.registry.get_stats(), {'Elsevier': 2, '': 1})
+
+
+	def test_shared_by_connections(self):
+		other = UIDRegistry(self.db_file)	# e.g., another crawler process.
+		try:
+			other.add('10.1/a')
+			self.assertIn('10.1/a', self.registry)
+			self.assertEqual(self.registry.add('10.1/a'), 0)
+		finally:
+			other.close()
+
+
+class JournalModeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+
+
+	def tearDown(self):
+		self.tmp_dir.cleanup()
+
+
+	def get_journal_mode(self, options):
+		downloader = make_downloader(ElsevierDownloader, self.tmp_dir.name, options=options)
+		try:
+			return downloader.uid_registry.conn.execute('PRAGMA journal_mode').fetchone()[0]
+		finally:
+			downloader.uid_registry.close()
+
+
+	def test_default(self):
+		self.assertEqual(self.get_journal_mode([]), 'wal')
+
+
+	def test_frontier_journal_mode_is_used(self):
+		self.assertEqual(self.get_journal_mode(['Frontier_journal_mode = DELETE']), 'delete')	# e.g., workers on several machines.
+
+
+	def test_registry_journal_mode(self):
+		self.assertEqual(self.get_journal_mode(['Frontier_journal_mode = DELETE', 'Registry_journal_mode = WAL']), 'wal')
+		self.assertEqual(self.get_journal_mode(['Registry_journal_mode = DELETE']), 'delete')
+
+
+if __name__ == '__main__':
+	unittest.main()
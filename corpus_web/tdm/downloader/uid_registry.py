@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UIDRegistry:
+	"""
+	Registry of unique identifiers (e.g., DOI) of downloaded articles.
+	It's to avoid duplicate downloads for the same article from different sources.
+
+	Note:
+	- uids are stored in lowercase in an indexed SQLite table, so membership queries don't load all uids into memory.
+	- The database runs in WAL mode with a busy timeout, so multiple crawler processes can read and write it at the same time.
+	  WAL needs shared memory, so workers on several machines sharing a file system (e.g., NFS) must use the DELETE journal mode ('Registry_journal_mode').
+	- Writes are done in transactions ('BEGIN IMMEDIATE'), and add_many() inserts a batch of uids in a single transaction.
+	- When the database is created, uids in the old flat uid list file (one uid per line) are imported.
+	- The stats table keeps the number of uids per publisher, year (when a uid was added) and project.
+	  It's updated in the same transaction as the uids, so reading statistics doesn't need to walk the archive.
+
+	References:
+	- https://www.sqlite.org/wal.html
+	- https://www.sqlite.org/lang_transaction.html
+	"""
+
+	batch_size = 500	# the max number of host parameters in a single query is 999 in old SQLite versions.
+
+	def __init__(self, db_file, uid_list=None, journal_mode='WAL'):
+		is_new = not os.path.exists(db_file)
+
+		self.db_file = db_file
+		self._lock = threading.Lock()	# the connection is shared by threads of a process.
+		self.conn = sqlite3.connect(db_file, timeout=60, isolation_level=None, check_same_thread=False)
+		self.conn.execute(f'PRAGMA journal_mode={journal_mode}')
+		self.conn.execute('PRAGMA synchronous=NORMAL')
+		self.conn.execute('CREATE TABLE IF NOT EXISTS uids (uid TEXT PRIMARY KEY, publisher TEXT, added TEXT, project TEXT)')
+
+		if 'project' not in [x[1] for x in self.conn.execute('PRAGMA table_info(uids)')]:	# registry created before the stats table.
+			self.conn.execute('ALTER TABLE uids ADD COLUMN project TEXT')
+
+		if self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'stats'").fetchone() is None:
+			self.create_stats()
+
+		if is_new and uid_list is not None and os.path.exists(uid_list):
+			num_of_uids = self.import_file(uid_list)
+			logger.info(f'>> Imported {num_of_uids} uids from {uid_list}')
+
+
+	def __contains__(self, uid):
+		with self._lock:
+			cur = self.conn.execute('SELECT 1 FROM uids WHERE uid = ?', (uid.strip().lower(),))
+			return cur.fetchone() is not None
+
+
+	def __len__(self):
+		with self._lock:
+			return self.conn.execute('SELECT COUNT(*) FROM uids').fetchone()[0]
+
+
+	def filter_new(self, uids):
+		""" Return the set of lowercased uids that are not registered yet """
+		new_uids = set([x.strip().lower() for x in uids])
+		candidates = list(new_uids)
+
+		with self._lock:
+			for i in range(0, len(candidates), self.batch_size):
+				batch = candidates[i:i + self.batch_size]
+				query = 'SELECT uid FROM uids WHERE uid IN (' + ','.join(['?']*len(batch)) + ')'
+				for row in self.conn.execute(query, batch):
+					new_uids.discard(row[0])
+
+		return new_uids
+
+
+	def add(self, uid, publisher=None, project=None):
+		return self.add_many([uid], publisher, project)
+
+
+	def add_many(self, uids, publisher=None, project=None):
+		""" Register uids in a single transaction, and return the number of newly added uids """
+		now = datetime.now()
+		added = now.isoformat(timespec='seconds')
+		rows = [(x.strip().lower(), publisher, added, project) for x in uids if x is not None and x.strip() != '']
+
+		with self._lock:
+			self.conn.execute('BEGIN IMMEDIATE')
+			try:
+				before = self.conn.total_changes
+				self.conn.executemany('INSERT OR IGNORE INTO uids (uid, publisher, added, project) VALUES (?, ?, ?, ?)', rows)
+				num_of_added = self.conn.total_changes - before
+
+				if num_of_added > 0:
+					self.update_stats(publisher, now.year, project, num_of_added)
+
+				self.conn.execute('COMMIT')
+			except Exception:
+				self.conn.execute('ROLLBACK')
+				raise
+
+		return num_of_added
+
+
+	def remove(self, uid):
+		uid = uid.strip().lower()
+
+		with self._lock:
+			self.conn.execute('BEGIN IMMEDIATE')
+			try:
+				row = self.conn.execute('SELECT publisher, added, project FROM uids WHERE uid = ?', (uid,)).fetchone()
+				if row is not None:
+					self.conn.execute('DELETE FROM uids WHERE uid = ?', (uid,))
+					self.update_stats(row[0], int(row[1][:4]) if row[1] else None, row[2], -1)
+				self.conn.execute('COMMIT')
+			except Exception:
+				self.conn.execute('ROLLBACK')
+				raise
+
+
+	def create_stats(self):
+		""" Create the stats table from the registered uids """
+		with self._lock:
+			self.conn.execute('BEGIN IMMEDIATE')
+			try:
+				# empty strings (or 0) instead of NULLs since NULLs are distinct in a primary key.
+				self.conn.execute('CREATE TABLE IF NOT EXISTS stats (publisher TEXT, year INTEGER, project TEXT, count INTEGER, PRIMARY KEY (publisher, year, project))')
+				self.conn.execute("INSERT OR REPLACE INTO stats (publisher, year, project, count) "
+								  "SELECT COALESCE(publisher, ''), COALESCE(CAST(substr(added, 1, 4) AS INTEGER), 0), COALESCE(project, ''), COUNT(*) "
+								  "FROM uids GROUP BY 1, 2, 3")
+				self.conn.execute('COMMIT')
+			except Exception:
+				self.conn.execute('ROLLBACK')
+				raise
+
+
+	def update_stats(self, publisher, year, project, count):
+		""" Add count to the stats (it must be called in a transaction) """
+		key = (publisher or '', year or 0, project or '')
+		self.conn.execute('INSERT OR IGNORE INTO stats (publisher, year, project, count) VALUES (?, ?, ?, 0)', key)
+		self.conn.execute('UPDATE stats SET count = count + ? WHERE publisher = ? AND year = ? AND project = ?', (count,) + key)
+
+
+	def get_stats(self, by=('publisher',)):
+		"""
+		Return the number of uids grouped by the given fields (publisher, year, project).
+		e.g., by=('publisher',) -> {'Elsevier': 100, ...}, by=('publisher', 'year') -> {('Elsevier', 2020): 10, ...}
+		"""
+		fields = [x for x in by if x in ('publisher', 'year', 'project')]
+		if len(fields) == 0:
+			raise ValueError(f'Invalid fields: {by}')
+
+		with self._lock:
+			rows = self.conn.execute('SELECT ' + ', '.join(fields) + ', SUM(count) FROM stats GROUP BY ' + ', '.join(fields)).fetchall()
+
+		if len(fields) == 1:
+			return {x[0]: x[1] for x in rows}
+
+		return {tuple(x[:-1]): x[-1] for x in rows}
+
+
+	def import_file(self, uid_list):
+		""" Import a flat uid list file (one uid per line) """
+		with open(uid_list) as f:
+			return self.add_many([line for line in f])
+
+
+	def close(self):
+		self.conn.close()
@@ -18,6 +18,8 @@ from elasticsearch import Elasticsearch
 from elasticsearch.helpers import bulk
 from time import time
 
+from archive_layout import iter_files	# the archive layout is shared with downloaders. tdm/downloader must be on PYTHONPATH (see README).
+
 es = Elasticsearch([{'host':'localhost', 'port':9200}]) # connect to cluster
 
 
@@ -139,14 +141,14 @@ def index_folder(index, paths):
 	"""
 	for path in paths:
 		#for f in glob.glob(os.path.join(path, '*.json')):
-		for root, dirs, files in os.walk(path):
+		for root, files in iter_files(path):
 			for file in files:
 				if file.endswith(".json"):
 					# Ignore downloaded json files, and only use a generated json which has the same name of an original article.
 					if 'IOP_JSON' not in path:
-						if (os.path.exists(os.path.join(root, file.replace(".json", ".xml"))) or \
-							os.path.exists(os.path.join(root, file.replace(".json", ".nxml"))) or \
-							os.path.exists(os.path.join(root, file.replace(".json", ".html")))):
+						if (file.replace(".json", ".xml") in files or \
+							file.replace(".json", ".nxml") in files or \
+							file.replace(".json", ".html") in files):
 							pass
 						else:
 							print('downloaded json:', os.path.join(root, file))
@@ -6,6 +6,7 @@ import re
 from time import sleep
 from lxml import etree, html
 from base_parser import BaseParser
+from archive_layout import iter_articles	# tdm/downloader is on PYTHONPATH (see README).
 
 import chemdataextractor.scrape.pub.rsc as RSC
 from chemdataextractor.scrape import Selector
@@ -42,25 +43,19 @@ class AAASParser(BaseParser):
 		doi_list = set()
 
 		dir = self.path
-		for file in os.listdir(dir):
-			if file.endswith(".html"):
-				htmlstring = open(os.path.join(dir, file)).read()
-				htmlstring = re.sub(r'<\?xml.*\?>', '', htmlstring)
-
-				sel = Selector.from_text(htmlstring)
-				scrape = RscHtmlDocument(sel)
-				if scrape.doi is None:
-					print('No DOI:', file)
-				else:
-					doi_list.add(scrape.doi.lower())
-
-		existing_uids = set([line.strip().lower() for line in open(self.uid_list)])
-		
-		doi_list.difference_update(existing_uids)   # remove any duplicates
-
-		with open(self.uid_list, 'a') as file:
-			for doi in doi_list:
-				file.write("%s\n" % doi)
+		for html_file in iter_articles(dir, ".html"):
+			file = os.path.basename(html_file)
+			htmlstring = open(html_file).read()
+			htmlstring = re.sub(r'<\?xml.*\?>', '', htmlstring)
+
+			sel = Selector.from_text(htmlstring)
+			scrape = RscHtmlDocument(sel)
+			if scrape.doi is None:
+				print('No DOI:', file)
+			else:
+				doi_list.add(scrape.doi.lower())
+
+		self.uid_registry.add_many(doi_list, self.publisher)	# already registered uids are ignored.
 	
 	"""
 	def get_object(self, html_file):
@@ -1,8 +1,16 @@
 import os
 import abc
+import shutil
 from lxml import etree
 import logging
 
+# the HTTP session layer and the uid registry are shared with downloaders. tdm/downloader must be on PYTHONPATH (see README).
+from http_session import create_session
+from uid_registry import UIDRegistry
+from blob_store import BlobStore
+from object_fetcher import ObjectQueue
+from base_downloader import info_file
+
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
@@ -14,8 +22,15 @@ class BaseParser:
 	
 	
 	def __init__(self, publisher):
+		self.publisher = publisher
+		self.uid_registry_file = None
+		self.blob_dir = None
+		self.object_queue_file = None
+		self.registry_journal_mode = None
+		self.frontier_journal_mode = 'WAL'
+		
 		# get key, destination path, uid list, and error list.
-		with open('/home/gpark/corpus_web/tdm/api_key_and_archive_info.txt', 'r') as f:
+		with open(info_file, 'r') as f:
 			self.error_list = set()
 			for line in f.readlines():
 				if line.startswith('API_key'):
@@ -30,11 +45,56 @@ class BaseParser:
 						self.path = val
 				elif line.startswith('UID_list'):
 					self.uid_list = line.split('=', 1)[1].strip() # unique identifier for articles (e.g., DOI). It's to avoid duplicate downloads for the same article from different sources.
+				elif line.startswith('Registry_journal_mode'):
+					self.registry_journal_mode = line.split('=', 1)[1].strip()
+				elif line.startswith('Frontier_journal_mode'):
+					self.frontier_journal_mode = line.split('=', 1)[1].strip()
+				elif line.startswith('UID_registry'):
+					self.uid_registry_file = line.split('=', 1)[1].strip()
+				elif line.startswith('Blob_store'):
+					self.blob_dir = line.split('=', 1)[1].strip()
+				elif line.startswith('Object_queue'):
+					self.object_queue_file = line.split('=', 1)[1].strip()
 				elif line.startswith('Error_list'):
 					key = line.split('=', 1)[0].split('/')[1].strip()
 					val = line.split('=', 1)[1].strip()
 					if key == publisher:
 						self.error_list.update([x.strip() for x in val.split(',')])
+		
+		self.session = create_session()	# connection-pooled session used to fetch objects that aren't queued (e.g., AAAS figures).
+		
+		if self.uid_registry_file is None:
+			self.uid_registry_file = os.path.splitext(self.uid_list)[0] + '.db'
+		if self.registry_journal_mode is None:	# the same default as downloaders.
+			self.registry_journal_mode = self.frontier_journal_mode
+		self.uid_registry = UIDRegistry(self.uid_registry_file, self.uid_list, self.registry_journal_mode)
+		
+		if self.blob_dir is None:
+			self.blob_dir = os.path.join(os.path.dirname(self.uid_list), 'blobs')
+		self.blob_store = BlobStore(self.blob_dir)	# downloaded objects are stored by content, and parsed outputs are shared by identical articles.
+		
+		# objects (e.g., figures) are only enqueued while parsing, and they're fetched by object_fetcher.py.
+		if self.object_queue_file is None:
+			self.object_queue_file = os.path.join(os.path.dirname(self.uid_list), 'objects.db')
+		self.object_queue = ObjectQueue(self.object_queue_file)
+	
+	
+	def reuse_parsed(self, file):
+		"""
+		If an identical article (the same payload in the blob store) has been parsed, copy its parsed output (JSON file), and return True.
+		"""
+		parsed = self.blob_store.get_parsed(file)
+		if parsed is None:
+			return False
+		
+		shutil.copyfile(parsed, file.rsplit('.', 1)[0] + '.json')
+		
+		return True
+	
+	
+	def save_parsed(self, file):
+		""" Keep the parsed output of the article, so that identical articles reuse it """
+		self.blob_store.put_parsed(file, file.rsplit('.', 1)[0] + '.json')
 
 	
 	# debug
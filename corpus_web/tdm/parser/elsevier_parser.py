@@ -4,6 +4,7 @@ import requests
 import json
 from lxml import etree
 from base_parser import BaseParser
+from archive_layout import iter_articles	# tdm/downloader is on PYTHONPATH (see README).
 import logging
 
 logger = logging.getLogger(__name__)
@@ -45,12 +46,13 @@ class ElsevierParser(BaseParser):
 		cnt = 0
 
 		doi_list = set()
-		for filename in os.listdir(self.path):
+		for xml_file in iter_articles(self.path, ".xml"):
+			filename = os.path.basename(xml_file)
 			#print(filename)
 			#if ep.parse(os.path.join(dir, filename)):
 			#	num_of_empty_body_article += 1
 
-			if filename.endswith(".xml") and os.path.isfile(os.path.join(self.path, filename.replace('.xml', '.json'))) == False:
+			if os.path.isfile(xml_file.replace('.xml', '.json')) == False:
 				if filename in ['S0960894X06003441.xml', 'S0040403904026243.xml', 
 								'S0040402013003669.xml', 'S0960894X10000120.xml', 
 								'S0040403908011490.xml', 'S0040403904000334.xml']:
@@ -60,17 +62,11 @@ class ElsevierParser(BaseParser):
 				
 				print(filename, ' / count: ', cnt)
 				
-				doi_list.add(self.parse(os.path.join(self.path, filename), 'just_uid').lower())
+				doi_list.add(self.parse(xml_file, 'just_uid').lower())
 		
 		#print(num_of_empty_body_article)
 		
-		existing_uids = set([line.strip() for line in open(self.uid_list)])
-		
-		doi_list.difference_update(existing_uids)   # remove any duplicates
-
-		with open(self.uid_list, 'a') as file:
-			for doi in doi_list:
-				file.write("%s\n" % doi)
+		self.uid_registry.add_many(doi_list, self.publisher)	# already registered uids are ignored.
 
 		
 		'''
@@ -92,6 +88,10 @@ class ElsevierParser(BaseParser):
 	
 	
 	def get_object(self, xml_file):
+		"""
+		Enqueue objects (attachments) of an article, and return the number of newly queued objects.
+		Objects are fetched by object_fetcher.py, and already queued or fetched objects are ignored by the queue.
+		"""
 		tree = etree.parse(xml_file, self.xml_parser)
 		root = tree.getroot()
 		
@@ -104,17 +104,8 @@ class ElsevierParser(BaseParser):
 		url = get_text(root.xpath('//prism:url', namespaces=nsmap))
 		pii = url.rsplit('/', 1)[-1]
 		
-		#if os.path.isdir(self.obj_destination + pii) == True:	# skip already downloaded files.
-		#	return 0
-		for file in os.listdir(xml_file.rsplit('/', 1)[0]):	# assume that if a folder has any img file, then the objects were already downloaded.
-			img_ext = [".jpg", ".jpeg", ".gif", ".png", ".tiff", ".svg"]	
-			if file.endswith(tuple(img_ext)):
-				return 0
-		
 		""" Object extraction """
-		num_of_objs = 0
-
-		headers = {'X-ELS-APIKEY': self.api_key}
+		objects = []
 
 		for attachment in root.xpath('//xocs:attachment', namespaces=nsmap):
 			eid = attachment.xpath('xocs:attachment-eid', namespaces=nsmap)
@@ -125,22 +116,10 @@ class ElsevierParser(BaseParser):
 
 			url = "https://api.elsevier.com/content/object/eid/" + eid
 
-			response = requests.get(url, headers=headers)
-
-			if response.status_code == 200:
-				with open(self.path + pii + "/" + filename, 'wb') as file:
-					for chunk in response.iter_content(2048):
-						file.write(chunk)
-				
-				num_of_objs += 1
-			else:
-				error_msg = f'>> ERROR Code: {response.status_code}\n' + \
-							f'>> URL: {response.url}\n' + \
-							f'>> Resp txt: {response.text}'
-				#logger.error(error_msg)
-				print(error_msg)
-		
-		return num_of_objs
+			# objects are stored in the article directory, and identical objects (e.g., publisher logos) are stored once.
+			objects.append((eid, url, os.path.join(xml_file.rsplit('/', 1)[0], filename)))
+		
+		return self.object_queue.enqueue(self.publisher, pii, objects)
 	
 
 	def get_sentence(self, paragraph, para_id, specials, refs, sec_title=''):
@@ -12,6 +12,7 @@ from pmc_parser import PMCParser
 from pdf_parser import PDFParser
 from rsc_parser import RSCParser
 from aaas_parser import AAASParser
+from archive_layout import iter_files	# tdm/downloader is on PYTHONPATH (see README).
 
 
 def update_uid_list():
@@ -61,10 +62,10 @@ def parse_Elsevier():
 	
 	#flag = False
 
-	for root, dirs, files in os.walk(dir):
+	for root, files in iter_files(dir):
 		for file in files:
 			# Ignore object xml files (downloaded xml files as supplementary object), and only parse article xml files of which the directory has the same name. Skip already parsed articles.
-			if file.endswith(".xml") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1] and os.path.isfile(os.path.join(root, file.replace('.xml', '.json'))) == False: 
+			if file.endswith(".xml") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1] and file.replace('.xml', '.json') not in files: 
 			#if file.endswith(".xml") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1]:			
 				#start_time = time.time()
 
@@ -101,13 +102,18 @@ def parse_Elsevier():
 				#	input()
 				#continue
 
-				# Download objects.
+				# Enqueue objects. They're fetched by object_fetcher.py, so parsing doesn't wait for downloads.
 				num_of_objs = ep.get_object(os.path.join(root, file))
 				if num_of_objs > 0:
-					print('>> num of objects:', num_of_objs)
+					print('>> num of queued objects:', num_of_objs)
+				
+				# skip an identical article (the same payload) that has already been parsed, and reuse its output.
+				if ep.reuse_parsed(os.path.join(root, file)):
+					continue
 				
 				# Parse articles.
 				ret = ep.parse(os.path.join(root, file))
+				ep.save_parsed(os.path.join(root, file))
 
 				cnt += 1
 				
@@ -173,9 +179,9 @@ def parse_Springer():
 	check_point_found = False
 
 	dir = sp.path
-	for root, dirs, files in os.walk(dir):
+	for root, files in iter_files(dir):
 		for file in files:
-			if file.endswith(".xml") and os.path.isfile(os.path.join(root, file.replace('.xml', '.json'))) == False: # skip already parsed articles.
+			if file.endswith(".xml") and file.replace('.xml', '.json') not in files: # skip already parsed articles.
 			#if file.endswith(".xml"):
 	
 				# when an error occurs, to start after the last processed file.
@@ -202,8 +208,13 @@ def parse_Springer():
 				#start_time = time.time()
 				print('>> file:', file)
 
+				# skip an identical article (the same payload) that has already been parsed, and reuse its output.
+				if sp.reuse_parsed(os.path.join(root, file)):
+					continue
+				
 				if sp.parse(os.path.join(root, file)) == True:	# len(body_text) == 0 -> True
 					cnt_no_body_article += 1
+				sp.save_parsed(os.path.join(root, file))
 				
 				#print("--- %s seconds ---" % (time.time() - start_time))
 				cnt += 1
@@ -221,9 +232,9 @@ def parse_PMC():
 	cnt = 0
 
 	dir = pp.path
-	for root, dirs, files in os.walk(dir):
+	for root, files in iter_files(dir):
 		for file in files:
-			if file.endswith(".nxml") and os.path.isfile(os.path.join(root, file.replace('.nxml', '.json'))) == False: # skip already parsed articles.
+			if file.endswith(".nxml") and file.replace('.nxml', '.json') not in files: # skip already parsed articles.
 			#if file.endswith(".nxml"):
 				# list of parsing error files. Since some of nxml article have the same name in PMC, so compare pmc id instead.
 				pmc_id = root.rsplit('/', 1)[1]	# directory is the pmc id.
@@ -236,8 +247,13 @@ def parse_PMC():
 
 				#start_time = time.time()
 				
+				# skip an identical article (the same payload) that has already been parsed, and reuse its output.
+				if pp.reuse_parsed(os.path.join(root, file)):
+					continue
+				
 				if pp.parse(os.path.join(root, file)) == True:	# len(body_text) == 0 -> True
 					cnt_no_body_article += 1
+				pp.save_parsed(os.path.join(root, file))
 				
 				#print("--- %s seconds ---" % (time.time() - start_time))
 				print(">> the number of processed files: ", cnt)
@@ -260,10 +276,10 @@ def parse_RSC():
 
 	dir = rp.path
 
-	for root, dirs, files in os.walk(dir):
+	for root, files in iter_files(dir):
 		for file in files:
 			# Ignore object html files (downloaded html files as supplementary object), and only parse article html files of which the directory has the same name. Skip already parsed articles.
-			if file.endswith(".html") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1] and os.path.isfile(os.path.join(root, file.replace('.html', '.json'))) == False: 
+			if file.endswith(".html") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1] and file.replace('.html', '.json') not in files: 
 			#if file.endswith(".html") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1]: 
 	
 				print('>> file:', file)
@@ -290,15 +306,20 @@ def parse_RSC():
 				#	continue
 				
 				'''
-				There are two options: 1) download objects of articles. 2) parse articles.
+				There are two options: 1) enqueue objects of articles (fetched by object_fetcher.py). 2) parse articles.
 				'''
-				# Download objects.
+				# Enqueue objects.
 				rp.get_object(os.path.join(root, file))
 
 				#start_time = time.time()
 				
+				# skip an identical article (the same payload) that has already been parsed, and reuse its output.
+				if rp.reuse_parsed(os.path.join(root, file)):
+					continue
+				
 				# Parse articles.
 				ret = rp.parse(os.path.join(root, file))
+				rp.save_parsed(os.path.join(root, file))
 				
 				# when checking the number of articles with a body text.
 				#if rp.parse(os.path.join(root, file)) == True:	# len(body_text) == 0 -> True
@@ -324,10 +345,10 @@ def parse_AAAS():
 
 	dir = ap.path
 
-	for root, dirs, files in os.walk(dir):
+	for root, files in iter_files(dir):
 		for file in files:
 			# Ignore object html files (downloaded html files as supplementary object), and only parse article html files of which the directory has the same name. Skip already parsed articles.
-			if file.endswith(".html") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1] and os.path.isfile(os.path.join(root, file.replace('.html', '.json'))) == False: 
+			if file.endswith(".html") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1] and file.replace('.html', '.json') not in files: 
 			#if file.endswith(".html") and file.rsplit('.', 1)[0] == root.rsplit('/', 1)[1]: 
 
 				print('>> file:', file)
@@ -358,8 +379,13 @@ def parse_AAAS():
 
 				#start_time = time.time()
 				
+				# skip an identical article (the same payload) that has already been parsed, and reuse its output.
+				if ap.reuse_parsed(os.path.join(root, file)):
+					continue
+				
 				# Parse articles.
 				ret = ap.parse(os.path.join(root, file))
+				ap.save_parsed(os.path.join(root, file))
 				
 				# when checking the number of articles with a body text.
 				#if ap.parse(os.path.join(root, file)) == True:	# len(body_text) == 0 -> True
@@ -91,9 +91,7 @@ class PDFParser(BaseParser):
 					data = json.load(read_file)
 					doi_list.append(data['uid'].lower())
 
-		with open(self.uid_list, 'a') as file:
-			for doi in doi_list:
-				file.write(doi + '\n')
+		self.uid_registry.add_many(doi_list, publisher)	# already registered uids are ignored.
 				
 	
 	def parse(self, pdf_file, keywords, iop_meta_file=None, write_dir="/home/gpark/corpus_web/tdm/archive/IOP_JSON/"):
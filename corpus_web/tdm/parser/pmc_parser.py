@@ -4,6 +4,7 @@ import requests
 import json
 from lxml import etree
 from base_parser import BaseParser
+from archive_layout import iter_files	# tdm/downloader is on PYTHONPATH (see README).
 import logging
 
 logger = logging.getLogger(__name__)
@@ -53,7 +54,7 @@ class PMCParser(BaseParser):
 		
 		sys.exit()
 		'''
-		for root, dirs, files in os.walk(dir):
+		for root, files in iter_files(dir):
 			for file in files:
 				if file.endswith(".nxml"):
 					#print(f'>>> File: {file}')
@@ -73,9 +74,7 @@ class PMCParser(BaseParser):
 		
 		print(len(doi_list))
 		
-		with open(self.uid_list, 'a') as file:
-			for doi in doi_list:
-				file.write(doi + '\n')
+		self.uid_registry.add_many(doi_list, self.publisher)	# already registered uids are ignored.
 	
 	
 	def get_sentence(self, elem, para_id_prefix, start_para_idx, specials, refs, sec_title=''):
@@ -6,6 +6,7 @@ import re
 from time import sleep
 from lxml import etree, html
 from base_parser import BaseParser
+from archive_layout import iter_articles	# tdm/downloader is on PYTHONPATH (see README).
 
 import chemdataextractor.scrape.pub.rsc as RSC
 from chemdataextractor.scrape import Selector
@@ -28,7 +29,6 @@ class RSCParser(BaseParser):
 	"""
 	
 	rsc_html_reader = RscHtmlReader()
-	rsc_scraper = RSC.RscSearchScraper()
 	
 
 	def __init__(self):
@@ -42,28 +42,26 @@ class RSCParser(BaseParser):
 		doi_list = set()
 
 		dir = self.path
-		for file in os.listdir(dir):
-			if file.endswith(".html"):
-				htmlstring = open(os.path.join(dir, file)).read()
-				htmlstring = re.sub(r'<\?xml.*\?>', '', htmlstring)
-
-				sel = Selector.from_text(htmlstring)
-				scrape = RscHtmlDocument(sel)
-				if scrape.doi is None:
-					logger.error('No DOI: ' + file)
-				else:
-					doi_list.add(scrape.doi.lower())
-
-		existing_uids = set([line.strip().lower() for line in open(self.uid_list)])
-		
-		doi_list.difference_update(existing_uids)   # remove any duplicates
-
-		with open(self.uid_list, 'a') as file:
-			for doi in doi_list:
-				file.write("%s\n" % doi)
+		for html_file in iter_articles(dir, ".html"):
+			file = os.path.basename(html_file)
+			htmlstring = open(html_file).read()
+			htmlstring = re.sub(r'<\?xml.*\?>', '', htmlstring)
+
+			sel = Selector.from_text(htmlstring)
+			scrape = RscHtmlDocument(sel)
+			if scrape.doi is None:
+				logger.error('No DOI: ' + file)
+			else:
+				doi_list.add(scrape.doi.lower())
+
+		self.uid_registry.add_many(doi_list, self.publisher)	# already registered uids are ignored.
 	
 	
 	def get_object(self, html_file):
+		"""
+		Enqueue figures of an article, and return the number of newly queued figures.
+		Figures are fetched by object_fetcher.py, and already queued or fetched figures are ignored by the queue.
+		"""
 		htmlstring = open(html_file).read()
 		'''
 		Remove encoding declaration since it causes the following error when Selector reads the string.
@@ -75,38 +73,22 @@ class RSCParser(BaseParser):
 		scrape = RscHtmlDocument(sel)
 		
 		location = html_file.rsplit('/', 1)[0]
+		article_id = os.path.basename(html_file).rsplit('.', 1)[0]
 
-		# skip already downloaded files. Count the number of files except html and json file.
-		if len(scrape.figures) == len([name for name in os.listdir(location) if name.endswith('.html') == False and name.endswith('.json') == False]):
-			print('<get_object()> Figures are already downloaded!!')
-			return
-
-		num_of_downloaded_objs = 0
-		
-		headers = {'User-Agent': 'TDMCrawler; mailto: gpark@bnl.gov; BNL CSI Literature mining project'}
+		objects = []
 		
 		for fig in scrape.figures:
 			if fig.url is not None:
 				fig_url = 'https://pubs.rsc.org' + fig.url
-				
-				#sleep(self.sleep_sec)
-				response = self.rsc_scraper.http.get(fig_url, headers=headers)
-
-				if response.status_code == 200:
-					filename = fig.url.rsplit('/', 1)[1]
-
-					with open(location + "/" + filename, 'wb') as file:
-						for chunk in response.iter_content(2048):
-							file.write(chunk)
-							
-					num_of_downloaded_objs += 1
-				else:
-					error_msg = f'>> ERROR Code: {response.status_code}\n' + \
-								f'>> URL: {response.url}\n' + \
-								f'>> Resp txt: {response.text}'
-					logger.error(error_msg)
-
-		print('<get_object()> Total figures:', len(scrape.figures), '/ Downloaded figure:', num_of_downloaded_objs)
+				filename = fig.url.rsplit('/', 1)[1]
+
+				objects.append((filename, fig_url, location + "/" + filename))	# identical objects are stored once.
+
+		num_of_queued_objs = self.object_queue.enqueue(self.publisher, article_id, objects)
+
+		print('<get_object()> Total figures:', len(scrape.figures), '/ Queued figures:', num_of_queued_objs)
+		
+		return num_of_queued_objs
 
 	
 	def get_sentence(self, elem, para_id_prefix, start_para_idx, specials, refs, sec_title=''):
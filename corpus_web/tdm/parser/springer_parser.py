@@ -4,6 +4,7 @@ import requests
 import json
 from lxml import etree
 from base_parser import BaseParser
+from archive_layout import iter_articles	# tdm/downloader is on PYTHONPATH (see README).
 import logging
 
 logger = logging.getLogger(__name__)
@@ -59,28 +60,22 @@ class SpringerParser(BaseParser):
 		doi_list = set()
 
 		dir = self.path
-		for filename in os.listdir(dir):
-			if filename.endswith(".xml"):
-				#print(filename)
-				#if sp.parse(os.path.join(dir, filename)):
-				#	num_of_empty_body_article += 1
-				
-				if filename in ['101007JHEP072017078.xml']:
-					continue
+		for xml_file in iter_articles(dir, ".xml"):
+			filename = os.path.basename(xml_file)
+			#print(filename)
+			#if sp.parse(os.path.join(dir, filename)):
+			#	num_of_empty_body_article += 1
+			
+			if filename in ['101007JHEP072017078.xml']:
+				continue
 
-				doi_list.add(self.parse(os.path.join(dir, filename), 'just_uid').lower())
-				
-				#input("Press Enter to continue...")
+			doi_list.add(self.parse(xml_file, 'just_uid').lower())
+			
+			#input("Press Enter to continue...")
 
 		#print(num_of_empty_body_article)
 		
-		existing_uids = set([line.strip() for line in open(self.uid_list)])
-		
-		doi_list.difference_update(existing_uids)   # remove any duplicates
-
-		with open(self.uid_list, 'a') as file:
-			for doi in doi_list:
-				file.write("%s\n" % doi)
+		self.uid_registry.add_many(doi_list, self.publisher)	# already registered uids are ignored.
 	
 	
 	def get_sentence(self, elem, para_id_prefix, start_para_idx, specials, refs, sec_title=''):
@@ -197,7 +192,7 @@ class SpringerParser(BaseParser):
 					fig_file = output_file.rsplit('/', 1)[0] + '/' + fig_file
 				else:
 					url = self.article_img_link + chapter_doi + '/MediaObjects/' + fig_file	
-					response = requests.get(url)
+					response = self.session.get(url)
 					
 					if response.status_code == 200:
 						with open(output_file.rsplit('/', 1)[0] + '/' + fig_file, 'wb') as file:
@@ -381,7 +376,7 @@ class SpringerParser(BaseParser):
 					fig_file = output_file.rsplit('/', 1)[0] + '/' + fig_file
 				else:
 					url = self.article_img_link + article_doi + '/MediaObjects/' + fig_file	
-					response = requests.get(url)
+					response = self.session.get(url)
 					
 					if response.status_code == 200:
 						with open(output_file.rsplit('/', 1)[0] + '/' + fig_file, 'wb') as file:
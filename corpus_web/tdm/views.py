@@ -332,9 +332,26 @@ def __unicode__(self):
     return u'%s' % (self)
 
 
+lit_stat_file = "/home/gpark/corpus_web/tdm/archive/lit_stat.json"
+lit_stat_cache = {'mtime': None, 'data': None}	# in-process cache of literature statistics.
+
+def get_lit_stat():
+	"""
+	Return literature statistics. The file is read again only when it's changed (modification time), so a page hit costs a stat() call.
+	The statistics are maintained incrementally by the downloader.
+	"""
+	mtime = os.stat(lit_stat_file).st_mtime
+	
+	if lit_stat_cache['mtime'] != mtime:
+		with open(lit_stat_file, "r") as read_file:
+			lit_stat_cache['data'] = json.load(read_file)
+		lit_stat_cache['mtime'] = mtime
+	
+	return lit_stat_cache['data']
+
+
 def index(request):
-	with open("/home/gpark/corpus_web/tdm/archive/lit_stat.json", "r") as read_file:
-		data = json.load(read_file)
+	data = get_lit_stat()
 	
 	context = {
 		'data': data